@@ -1,37 +1,187 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session as flask_session,make_response, jsonify
-import pandas as pd
+import functools
+import time
+
+# Отсчёт времени запуска: до импорта Flask и SQLAlchemy
+STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, flash, session as flask_session,make_response, jsonify, g
 from flask import abort
+from werkzeug.http import is_resource_modified
 
 from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker,joinedload
-from tools.models import Base, User, Test, Question, TestAttempt, Group
+from sqlalchemy import create_engine, delete, update
+from sqlalchemy.orm import sessionmaker,joinedload, selectinload
+from tools.models import User, Test, Question, TestAttempt, TestVersion, Group
 import tools.config as config
+from utils.cache_bus import publish_questions_changed, publish_test_changed, publish_users_changed
+from utils.logging_config import setup_logging
+from utils.metrics import (instrument_engine, begin_scope, end_scope, registry, startup_seconds, admin_pages_total,
+                           PROMETHEUS_CONTENT_TYPE)
+from utils.replica import SyncReplicaRouting
+from utils.answer_matchers import AnswerSpecError, compile_matcher
+from utils.attempt_archive import attempt_model
+from utils.http_cache import CachedPage, PageCache, test_watermark, tests_watermark
+from utils.rescoring import rescore_text_question
+from utils.test_versions import in_current_version, lineage_id, new_version, replace_question
 import datetime
+import logging
 from io import BytesIO
 from urllib.parse import quote
-import pandas as pd
 
-app = Flask(__name__,
-            static_folder='templates/static',
-            template_folder='templates')
+IMPORTED = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+def create_app() -> Flask:
+    """
+    Создаёт приложение админки. Схема БД здесь не проверяется и не создаётся —
+    это делает шаг миграций (tools/init_db.py), поэтому запуск не ходит в базу.
+    """
+    setup_logging(config.LOG_LEVEL)
+    app = Flask(__name__,
+                static_folder='templates/static',
+                template_folder='templates')
+
+    app.secret_key = 'supersecretkey'
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SESSION_PERMANENT'] = False
+    Session(app)
+    return app
+
 
-app.secret_key = 'supersecretkey'
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_PERMANENT'] = False
-Session(app)
+app = create_app()
 
-# Настройка базы данных PostgreSQL
-engine = create_engine(config.DATABASE_URL.replace("+asyncpg", ''))
-Base.metadata.create_all(engine)
+# Настройка базы данных PostgreSQL; соединение открывается при первом запросе
+engine = instrument_engine(create_engine(config.DATABASE_URL.replace("+asyncpg", '')))
 DbSession = sessionmaker(bind=engine)
 
+# Реплика для страниц, которые только читают (если задан DATABASE_REPLICA_URL)
+ReplicaDbSession = None
+replica_routing = None
+if config.DATABASE_REPLICA_URL:
+    replica_engine = instrument_engine(create_engine(config.DATABASE_REPLICA_URL.replace("+asyncpg", '')))
+    ReplicaDbSession = sessionmaker(bind=replica_engine)
+    replica_routing = SyncReplicaRouting(
+        replica_engine, config.REPLICA_MAX_LAG_SECONDS, config.REPLICA_CHECK_INTERVAL_SECONDS,
+        config.READ_YOUR_WRITES_SECONDS)
+
+
+def read_session():
+    """
+    Сессия для чтения: с реплики, если она не отстаёт и администратор
+    не сохранял данные в последние READ_YOUR_WRITES_SECONDS, иначе с основной базы.
+    Выбор делается один раз за запрос: водяной знак страницы (conditional) и сама
+    страница читаются из одной базы.
+    """
+    if replica_routing is not None:
+        if 'use_replica' not in g:
+            pinned = flask_session.get('primary_until', 0) > time.time()
+            g.use_replica = replica_routing.use_replica(pinned)
+        if g.use_replica:
+            return ReplicaDbSession()
+    return DbSession()
+
+
+# После сохранения формы администратор какое-то время читает с основной базы
+@app.after_request
+def pin_primary_after_write(response):
+    if replica_routing is not None and request.method == 'POST':
+        flask_session['primary_until'] = time.time() + config.READ_YOUR_WRITES_SECONDS
+    return response
+
+
+# Привязка SQL-запросов к эндпоинту Flask
+@app.before_request
+def begin_metrics_scope():
+    g.metrics_token = begin_scope(request.endpoint or 'not_found', config.QUERY_REPEAT_THRESHOLD)
+
+
+@app.teardown_request
+def end_metrics_scope(exc):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        end_scope(token)
+
+
+# Отрисованные страницы и выгрузки: во время экзамена их обновляют чаще, чем меняются данные
+page_cache = PageCache()
+# Заголовки, которые сохраняются вместе с телом страницы
+CACHED_HEADERS = ('Content-Type', 'Content-Disposition')
+
+
+def conditional(watermark, session_factory):
+    """
+    Условный GET по водяному знаку данных страницы (utils.http_cache): ответ
+    получает ETag и Last-Modified; если у браузера та же версия, отвечаем 304
+    без отрисовки, а уже отрисованную версию отдаём из page_cache. Водяной знак —
+    один короткий запрос вместо всех запросов страницы. Если watermark вернул
+    None (например, теста нет), страница обрабатывается как обычно.
+
+    session_factory — та же сессия, из которой читает страница (DbSession или
+    read_session), иначе страницу со свежими данными можно получить под ETag
+    отстающей реплики. Если данные изменились во время отрисовки, страница
+    отдаётся без ETag и не кэшируется.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            with session_factory() as db_session:
+                mark = watermark(db_session, **view_args)
+            if mark is None:
+                return view(**view_args)
+
+            etag = mark.etag
+            if not is_resource_modified(request.environ, etag=etag, last_modified=mark.last_modified):
+                result = 'not_modified'
+                response = make_response('', 304)
+            else:
+                page = page_cache.get(request.full_path, etag)
+                if page is not None:
+                    result = 'hit'
+                    response = make_response(page.body)
+                    for name, value in page.headers:
+                        response.headers[name] = value
+                else:
+                    result = 'render'
+                    response = make_response(view(**view_args))
+                    with session_factory() as db_session:
+                        if watermark(db_session, **view_args) != mark:
+                            # Страница могла собраться из данных новее водяного знака
+                            admin_pages_total.inc(endpoint=request.endpoint, result=result)
+                            response.cache_control.no_store = True
+                            return response
+                    if response.status_code == 200 and not response.is_streamed:
+                        headers = tuple((name, response.headers[name]) for name in CACHED_HEADERS
+                                        if name in response.headers)
+                        page_cache.put(request.full_path, etag, CachedPage(response.get_data(), headers))
+            admin_pages_total.inc(endpoint=request.endpoint, result=result)
+
+            response.set_etag(etag)
+            if mark.last_modified is not None:
+                response.last_modified = mark.last_modified
+            # Браузер хранит страницу, но каждый раз сверяет версию
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+# Метрики в формате Prometheus
+@app.route('/metrics')
+def metrics():
+    response = make_response(registry.render())
+    response.headers['Content-Type'] = PROMETHEUS_CONTENT_TYPE
+    return response
+
 
 # Панель администратора для просмотра всех тестов
 @app.route('/admin')
+@conditional(tests_watermark, DbSession)
 def admin_panel():
     with DbSession() as db_session:
-        tests = db_session.query(Test).all()
+        tests = db_session.query(Test).options(selectinload(Test.groups)).all()
     return render_template('admin_panel.html', tests=tests)
 
 @app.route('/registration')
@@ -51,7 +201,10 @@ def confirm_users():
 
     with DbSession() as db_session:
         try:
-            db_session.query(User).filter(User.id.in_(user_ids)).update({"confirmed": True}, synchronize_session=False)
+            telegram_ids = db_session.execute(
+                update(User).where(User.id.in_(user_ids)).values(confirmed=True).returning(User.user_id)
+            ).scalars().all()
+            publish_users_changed(db_session, telegram_ids)
             db_session.commit()
             return jsonify({'success': True, 'message': 'Пользователи успешно подтверждены.'}), 200
         except Exception as e:
@@ -69,7 +222,10 @@ def delete_users():
 
     with DbSession() as db_session:
         try:
-            db_session.query(User).filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            telegram_ids = db_session.execute(
+                delete(User).where(User.id.in_(user_ids)).returning(User.user_id)
+            ).scalars().all()
+            publish_users_changed(db_session, telegram_ids)
             db_session.commit()
             return jsonify({'success': True, 'message': 'Пользователи успешно удалены.'}), 200
         except Exception as e:
@@ -84,6 +240,9 @@ def create_test():
         test_name = request.form['test_name']
         description = request.form.get('description')
         question_count = int(request.form['question_count'])
+        # Банк вопросов: если в нём больше question_count, каждая попытка получает свою выборку
+        pool_size = int(request.form.get('pool_size') or question_count)
+        shuffle = bool(request.form.get('shuffle'))
         expiry_date = request.form.get('expiry_date')
         scores_need_to_pass = int(request.form['scores_need_to_pass'])
         groups = request.form.getlist('groups')
@@ -93,6 +252,9 @@ def create_test():
         if scores_need_to_pass > question_count:
             flash('Количество баллов для прохождения не может превышать количество вопросов.')
             return redirect(url_for('create_test'))
+        if pool_size < question_count:
+            flash('В банке не может быть меньше вопросов, чем в попытке.')
+            return redirect(url_for('create_test'))
         if duration < 1:
             flash('Время на прохождение должно быть больше либо равно 1 минуте.')
             return redirect(url_for('create_test'))
@@ -105,16 +267,17 @@ def create_test():
             'test_name': test_name,
             'description': description,
             'question_count': question_count,
+            'shuffle': shuffle,
             'expiry_date': expiry_date,
             'scores_need_to_pass': scores_need_to_pass,
             'groups': groups,
             'duration': duration,
             'number_of_attempts': number_of_attempts
         }
-        flask_session['questions_data'] = [None] * question_count  # Инициализируем список вопросов заданной длины
+        flask_session['questions_data'] = [None] * pool_size  # Инициализируем список вопросов заданной длины
 
         # Переходим на страницу создания вопросов
-        return redirect(url_for('create_questions', test_id='temp', num_questions=question_count, question_index=0))
+        return redirect(url_for('create_questions', test_id='temp', num_questions=pool_size, question_index=0))
 
     # Обработка GET-запроса для отображения формы
     with DbSession() as db_session:
@@ -149,10 +312,14 @@ def create_questions(test_id, num_questions, question_index):
                 'question_text': question_text,
                 'question_type': question_type,
                 'options': [],
-                'right_answer': ''
+                'right_answer': '',
+                'weight': int(request.form.get('weight') or 1),
+                'partial_credit': question_type == 'multiple_choice' and bool(request.form.get('partial_credit'))
             }
 
             errors = []
+            if question_data['weight'] < 1:
+                errors.append('Баллы за верный ответ должны быть не меньше 1.')
 
             # Для вопросов с вариантами ответа
             if question_type in ['single_choice', 'multiple_choice']:
@@ -190,7 +357,12 @@ def create_questions(test_id, num_questions, question_index):
                 if not text_answer:
                     errors.append('Ответ не может быть пустым для текстового вопроса.')
                 else:
-                    question_data['right_answer'] = text_answer.lower()
+                    # Ответ хранится как введён: регистр в шаблонах re: значим (\d и \D), без учёта регистра сравнивает проверка
+                    try:
+                        compile_matcher(text_answer)
+                        question_data['right_answer'] = text_answer
+                    except AnswerSpecError as e:
+                        errors.append(str(e))
 
             else:
                 errors.append('Некорректный тип вопроса.')
@@ -222,11 +394,14 @@ def create_questions(test_id, num_questions, question_index):
                         test_name=test_data['test_name'],
                         description=test_data['description'],
                         question_count=test_data['question_count'],
+                        shuffle=test_data.get('shuffle', False),
                         expiry_date=datetime.datetime.strptime(test_data['expiry_date'], "%Y-%m-%dT%H:%M") if test_data['expiry_date'] else None,
                         scores_need_to_pass=test_data['scores_need_to_pass'],
-                        groups_with_access=", ".join(test_data['groups']) if test_data['groups'] else None,
+                        groups=db_session.query(Group).filter(Group.groupname.in_(test_data['groups'])).all() if test_data['groups'] else [],
                         duration=test_data['duration'],
-                        number_of_attempts=test_data['number_of_attempts']
+                        number_of_attempts=test_data['number_of_attempts'],
+                        versions=[TestVersion(version=1, question_count=test_data['question_count'],
+                                              shuffle=test_data.get('shuffle', False))]
                     )
                     db_session.add(test)
                     db_session.flush()  # Получаем ID теста для добавления вопросов
@@ -238,11 +413,14 @@ def create_questions(test_id, num_questions, question_index):
                             question_text=q_data['question_text'],
                             question_type=q_data['question_type'],
                             options=q_data['options'] if 'options' in q_data else None,
-                            right_answer=q_data['right_answer']
+                            right_answer=q_data['right_answer'],
+                            weight=q_data.get('weight', 1),
+                            partial_credit=q_data.get('partial_credit', False)
                         )
                         db_session.add(question)
 
                     try:
+                        publish_test_changed(db_session, test.id, test_data['groups'])
                         db_session.commit()
                     except Exception as e:
                         db_session.rollback()
@@ -278,7 +456,9 @@ def create_questions(test_id, num_questions, question_index):
 @app.route('/edit_test/<int:test_id>', methods=['GET', 'POST'])
 def edit_test(test_id):
     with DbSession() as db_session:
-        test = db_session.query(Test).filter_by(id=test_id).first()
+        query = db_session.query(Test).filter_by(id=test_id)
+        # Блокировка: перенос в архив не должен пройти между проверкой и сохранением
+        test = (query.with_for_update() if request.method == 'POST' else query).first()
         if not test:
             flash('Тест не найден.')
             return redirect(url_for('admin_panel'))
@@ -287,23 +467,37 @@ def edit_test(test_id):
             # Обновляем данные теста
             test.test_name = request.form['test_name']
             test.description = request.form.get('description')
-            test.question_count = int(request.form['question_count'])
+            question_count = int(request.form['question_count'])
             expiry_date = request.form.get('expiry_date')
             test.expiry_date = datetime.datetime.strptime(expiry_date, "%Y-%m-%dT%H:%M") if expiry_date else None
             test.scores_need_to_pass = int(request.form['scores_need_to_pass'])
             test.duration = int(request.form['duration'])
             test.number_of_attempts = int(request.form['number_of_attempts'])
+            shuffle = bool(request.form.get('shuffle'))
+            if (question_count, shuffle) != (test.question_count, test.shuffle):
+                # Выборка вопросов новых попыток меняется — начатые попытки остаются в своей версии
+                test.question_count = question_count
+                test.shuffle = shuffle
+                new_version(db_session, test)
             groups = request.form.getlist('groups')  # Список названий групп
-            test.groups_with_access = ", ".join(groups) if groups else None
+            previous_groups = [group.groupname for group in test.groups]
+            test.groups = db_session.query(Group).filter(Group.groupname.in_(groups)).all() if groups else []
 
             # Валидация данных
             errors = []
-            if test.scores_need_to_pass > test.question_count:
-                errors.append("Баллы для прохождения не могут превышать количество вопросов.")
+            # Наибольший балл за попытку: question_count самых «дорогих» вопросов банка
+            weights = sorted((weight for weight, in db_session.query(Question.weight)
+                              .filter(*in_current_version(test.id))), reverse=True)
+            max_points = sum(weights[:test.question_count]) or test.question_count
+            if test.scores_need_to_pass > max_points:
+                errors.append(f"Баллы для прохождения не могут превышать максимальный балл за попытку ({max_points}).")
             if test.duration < 1:
                 errors.append("Длительность теста должна быть не менее 1 минуты.")
             if test.expiry_date and (test.expiry_date - datetime.datetime.utcnow()) < datetime.timedelta(minutes=1):
                 errors.append("Дата окончания должна быть больше текущего времени на 1 минуту.")
+            if test.archived_at is not None and (test.expiry_date is None or test.expiry_date > test.archived_at):
+                # Лимит попыток считается по рабочей таблице, а попытки этого теста уже в архиве
+                errors.append("Попытки теста перенесены в архив, снова открыть его нельзя.")
 
             if errors:
                 for error in errors:
@@ -311,20 +505,22 @@ def edit_test(test_id):
                 # Остаёмся на странице редактирования теста
                 return redirect(url_for('edit_test', test_id=test.id))
             else:
+                publish_test_changed(db_session, test.id, groups, previous_groups)
                 db_session.commit()
                 flash('Тест успешно обновлён.', 'success')
                 return redirect(url_for('admin_panel'))
 
         # Получаем список групп для отображения в форме
         groups = db_session.query(Group).all()
-        # Парсим список названий групп с доступом
-        selected_groups = [g.strip() for g in test.groups_with_access.split(",")] if test.groups_with_access else []
+        # Список названий групп с доступом
+        selected_groups = [g.groupname for g in test.groups]
 
     return render_template('edit_test.html', test=test, groups=groups, selected_groups=selected_groups)
 
 
 # Отображение списка вопросов для редактирования
 @app.route('/edit_questions/<int:test_id>', methods=['GET'])
+@conditional(test_watermark, DbSession)
 def edit_questions(test_id):
     with DbSession() as db_session:
         test = db_session.query(Test).filter_by(id=test_id).first()
@@ -332,9 +528,13 @@ def edit_questions(test_id):
             flash('Тест не найден.')
             return redirect(url_for('admin_panel'))
 
-        questions = db_session.query(Question).filter_by(test_id=test_id).all()
+        questions = db_session.query(Question).filter(*in_current_version(test_id)).order_by(lineage_id()).all()
+        # numpy нужен только здесь, поэтому модуль загружается при первом открытии страницы
+        from utils.item_analysis import get_question_stats
+        # Сложность, дискриминативность и выбор вариантов по завершённым попыткам
+        question_stats = get_question_stats(db_session, test_id, questions)
 
-    return render_template('edit_questions.html', test=test, questions=questions)
+    return render_template('edit_questions.html', test=test, questions=questions, question_stats=question_stats)
 
 
 # Редактирование вопроса
@@ -346,6 +546,10 @@ def edit_question(question_id):
         if not question:
             flash('Вопрос не найден.')
             return redirect(url_for('admin_panel'))
+        if question.retired_in is not None:
+            # Ссылка на прежнюю версию вопроса: она не меняется, её видят только попытки своих версий
+            flash('Этот вопрос уже изменён. Откройте его текущую версию.')
+            return redirect(url_for('edit_questions', test_id=question.test_id))
 
         if request.method == 'POST':
             # Получаем данные из формы
@@ -356,8 +560,18 @@ def edit_question(question_id):
                 flash('Текст вопроса обязателен для заполнения.')
                 return redirect(url_for('edit_question', question_id=question_id))
 
-            question.question_text = question_text
-            question.question_type = question_type
+            weight = int(request.form.get('weight') or 1)
+            if weight < 1:
+                flash('Баллы за верный ответ должны быть не меньше 1.')
+                return redirect(url_for('edit_question', question_id=question_id))
+
+            # Строка вопроса не меняется: правка становится новой строкой в новой версии теста
+            edited = Question(
+                question_text=question_text,
+                question_type=question_type,
+                weight=weight,
+                partial_credit=question_type == 'multiple_choice' and bool(request.form.get('partial_credit'))
+            )
 
             # Обработка вариантов ответов
             if question_type in ['single_choice', 'multiple_choice']:
@@ -373,21 +587,38 @@ def edit_question(question_id):
                     }
                     options.append(option)
 
-                question.options = options
+                edited.options = options
                 # Формируем правильный ответ для хранения
                 right_answer = ''.join([str(opt['id']) for opt in options if opt['is_correct']])
-                question.right_answer = right_answer
+                edited.right_answer = right_answer
             elif question_type == 'text_input':
-                text_answer = request.form.get('text_answer')
-                question.right_answer = text_answer.lower()
-                question.options = None
+                text_answer = (request.form.get('text_answer') or '').strip()
+                try:
+                    compile_matcher(text_answer)
+                except AnswerSpecError as e:
+                    flash(str(e))
+                    return redirect(url_for('edit_question', question_id=question_id))
+                edited.right_answer = text_answer
+                edited.options = None
             else:
                 flash('Неизвестный тип вопроса.')
                 return redirect(url_for('edit_question', question_id=question_id))
 
-            # Сохраняем изменения
+            if not replace_question(db_session, question, edited):
+                db_session.rollback()
+                flash('Вопрос уже изменён в другой вкладке. Откройте его текущую версию.')
+                return redirect(url_for('edit_questions', test_id=question.test_id))
+
+            rescored = 0
+            if question_type == 'text_input' and request.form.get('rescore'):
+                rescored = rescore_text_question(db_session, edited)
+
+            # Сохраняем изменения; бот заменит снимок этого теста на новую версию
+            publish_questions_changed(db_session, question.test_id)
             db_session.commit()
             flash('Вопрос успешно обновлён.')
+            if rescored:
+                flash(f'Изменилась проверка ответов в попытках: {rescored}.')
             return redirect(url_for('edit_questions', test_id=question.test_id))
 
     return render_template('edit_question.html', question=question, question_id=question_id)
@@ -396,8 +627,9 @@ def edit_question(question_id):
 
 # Отображение результатов теста
 @app.route('/view_results/<int:test_id>')
+@conditional(test_watermark, read_session)
 def view_results(test_id):
-    with DbSession() as db_session:
+    with read_session() as db_session:
         # Получение теста
         test = db_session.query(Test).filter_by(id=test_id).first()
         if not test:
@@ -409,24 +641,27 @@ def view_results(test_id):
         selected_status = request.args.get('status')
         successful_users = request.args.get('successful_users')
 
+        # Попытки закрытого теста, перенесённого в архив, читаются из архива
+        Attempt = attempt_model(test)
+
         # Начало запроса для получения попыток с жадной загрузкой связанных данных
-        query = db_session.query(TestAttempt).options(
-            joinedload(TestAttempt.user).joinedload(User.group_rel)
-        ).filter(TestAttempt.test_id == test_id)
+        query = db_session.query(Attempt).options(
+            joinedload(Attempt.user).joinedload(User.group_rel)
+        ).filter(Attempt.test_id == test_id)
 
         # Применение фильтра по группам, если выбран
         if selected_groups:
-            query = query.join(TestAttempt.user).filter(User.group_rel.has(Group.groupname.in_(selected_groups)))
+            query = query.join(Attempt.user).filter(User.group_rel.has(Group.groupname.in_(selected_groups)))
 
         # Применение фильтра по статусу прохождения, если выбран
         if selected_status == 'passed':
-            query = query.filter(TestAttempt.passed == True)
+            query = query.filter(Attempt.passed == True)
         elif selected_status == 'failed':
-            query = query.filter(TestAttempt.passed == False)
+            query = query.filter(Attempt.passed == False)
 
         # Если выбраны успешные пользователи, фильтруем по лучшим попыткам
         if successful_users == 'true':
-            all_attempts = query.filter(TestAttempt.passed == True).all()
+            all_attempts = query.filter(Attempt.passed == True).all()
             best_attempts = {}
             for attempt in all_attempts:
                 user_id = attempt.user.id
@@ -448,23 +683,24 @@ def view_results(test_id):
         selected_status=selected_status
     )
 
-from flask import make_response
-from io import BytesIO
-import pandas as pd
-
 @app.route('/download_results/<int:test_id>', methods=['GET'])
+@conditional(test_watermark, read_session)
 def download_results(test_id):
-    with DbSession() as db_session:
+    # pandas загружается дольше всего остального приложения, а нужен только для выгрузки
+    import pandas as pd
+
+    with read_session() as db_session:
         # Получение теста
         test = db_session.query(Test).filter_by(id=test_id).first()
         if not test:
             flash('Тест не найден.')
             return redirect(url_for('view_results', test_id=test_id))
 
-        # Получение всех попыток
-        attempts = db_session.query(TestAttempt).options(
-            joinedload(TestAttempt.user).joinedload(User.group_rel)
-        ).filter(TestAttempt.test_id == test_id).all()
+        # Получение всех попыток (из архива, если тест в него перенесён)
+        Attempt = attempt_model(test)
+        attempts = db_session.query(Attempt).options(
+            joinedload(Attempt.user).joinedload(User.group_rel)
+        ).filter(Attempt.test_id == test_id).all()
 
         # Формирование данных для Excel
         user_best_attempts = {}
@@ -480,7 +716,7 @@ def download_results(test_id):
             data.append({
                 "ФИО": f"{attempt.user.firstname} {attempt.user.lastname} {attempt.user.middlename or ''}".strip(),
                 "Группа": attempt.user.group_rel.groupname,
-                "Балл за попытку": f"{attempt.score} / {test.question_count}" if test.question_count else f"{attempt.score} / -",
+                "Балл за попытку": f"{attempt.score} / {attempt.max_score or test.question_count or '-'}",
                 "Статус": "Сдал" if attempt.passed else "Не сдал"
             })
 
@@ -504,5 +740,10 @@ def download_results(test_id):
         return response
 
 
+startup_seconds.set(IMPORTED - STARTED, phase='import')
+startup_seconds.set(time.perf_counter() - IMPORTED, phase='setup')
+logger.info("Админка загружена за %.2f с (импорт %.2f с)", time.perf_counter() - STARTED, IMPORTED - STARTED)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -1,36 +1,128 @@
+import time
+
+# Отсчёт времени запуска: до импорта aiogram и SQLAlchemy, на которые приходится большая часть старта
+STARTED = time.perf_counter()
+
 import asyncio
+from datetime import timedelta
+from typing import Optional
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.base import BaseSession
 from tools import config
 import logging
 from handlers import register_handlers
-from middlewares.db_session import DbSessionMiddleware
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from middlewares.db_session import DbSessionMiddleware, ReleaseIdleDbSessionMiddleware
+from middlewares.update_metrics import UpdateMetricsMiddleware, ApiTimingRequestMiddleware
+from utils.cache_bus import CacheEventListener
+from utils.open_tests_cache import open_tests_cache
+from utils.test_snapshots import test_snapshots
+from utils.user_cache import user_profiles
+from utils.replica import AsyncReplicaRouting
+from utils.metrics import instrument_engine, start_metrics_server, startup_seconds
+from utils.sharding import ShardWorker
+from utils.fsm_storage import BoundedMemoryStorage, EvictionPolicy
+from tools.states import TestStates
+from handlers.test_passing import suspend_attempt, resume_attempt
+from utils.logging_config import setup_logging
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+IMPORTED = time.perf_counter()
 
 logger = logging.getLogger(__name__)
 
-# Конфигурация
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
 
-engine = create_async_engine(config.DATABASE_URL, echo=False)
-async_session = sessionmaker(
-    engine, expire_on_commit=False, class_=AsyncSession
-)
+def create_bot(token: str, session: Optional[BaseSession] = None) -> Bot:
+    bot = Bot(token=token, session=session)
+    bot.session.middleware(ReleaseIdleDbSessionMiddleware())
+    bot.session.middleware(ApiTimingRequestMiddleware())
+    return bot
+
+
+def create_dispatcher(engine: AsyncEngine, replica_engine: Optional[AsyncEngine] = None) -> Dispatcher:
+    """
+    Dispatcher с middleware и роутерами бота. Движки создаёт вызывающий: бот —
+    по config, нагрузочный тест — по своим аргументам. Соединения с БД
+    открываются при первом апдейте, схема проверяется только шагом миграций.
+    """
+    # Состояние простаивающих чатов удаляется из памяти, у чатов с попыткой — после её окончания
+    storage = BoundedMemoryStorage(
+        EvictionPolicy(
+            idle_ttl=config.FSM_IDLE_TTL_SECONDS,
+            active_grace=config.FSM_ACTIVE_GRACE_SECONDS,
+            max_chats=config.FSM_MAX_CHATS,
+            active_states=frozenset(state.state for state in (
+                TestStates.TESTING, TestStates.EDITING, TestStates.CONFIRM_FINISH)),
+        ),
+        sweep_interval=config.FSM_SWEEP_SECONDS,
+        on_evict=suspend_attempt,
+    )
+    dp = Dispatcher(storage=storage)
+    dp.startup.register(storage.start)
+    async_session = sessionmaker(
+        engine, expire_on_commit=False, class_=AsyncSession
+    )
+    test_snapshots.session_maker = async_session
+
+    update_metrics = UpdateMetricsMiddleware(
+        config.QUERY_REPEAT_THRESHOLD, config.SLOW_UPDATE_THRESHOLD_MS / 1000, config.LOG_SAMPLE_EVERY)
+    dp.message.middleware(update_metrics)
+    dp.callback_query.middleware(update_metrics)
+
+    # Реплика для обработчиков с флагом @flags.replica (если задан DATABASE_REPLICA_URL)
+    replica_session = None
+    replica_routing = None
+    if replica_engine is not None:
+        replica_session = sessionmaker(replica_engine, expire_on_commit=False, class_=AsyncSession)
+        replica_routing = AsyncReplicaRouting(
+            replica_engine, config.REPLICA_MAX_LAG_SECONDS, config.REPLICA_CHECK_INTERVAL_SECONDS,
+            config.READ_YOUR_WRITES_SECONDS)
+        open_tests_cache.settle_time = timedelta(seconds=config.REPLICA_MAX_LAG_SECONDS)
+        user_profiles.settle_time = config.REPLICA_MAX_LAG_SECONDS
 
-dp.message.middleware(DbSessionMiddleware(async_session))
-dp.callback_query.middleware(DbSessionMiddleware(async_session))
+    db_session_middleware = DbSessionMiddleware(async_session, replica_session, replica_routing)
+    dp.message.middleware(db_session_middleware)
+    dp.callback_query.middleware(db_session_middleware)
+
+    register_handlers(dp)
+    return dp
 
-register_handlers(dp)
 
 async def main():
+    # Настройка логирования: запись в поток идёт в отдельном потоке, не в event loop
+    setup_logging(config.LOG_LEVEL)
+
+    engine = instrument_engine(create_async_engine(config.DATABASE_URL, echo=False))
+    replica_engine = None
+    if config.DATABASE_REPLICA_URL:
+        replica_engine = instrument_engine(create_async_engine(config.DATABASE_REPLICA_URL, echo=False))
+    bot = create_bot(config.BOT_TOKEN)
+    dp = create_dispatcher(engine, replica_engine)
+
+    # Эндпоинт /metrics для Prometheus
+    await start_metrics_server(config.BOT_METRICS_PORT)
+    # Точечный сброс кэшей по событиям из админки
+    cache_listener = CacheEventListener(engine, (open_tests_cache, test_snapshots, user_profiles))
+    listener_task = asyncio.create_task(cache_listener.run())
+
+    startup_seconds.set(IMPORTED - STARTED, phase='import')
+    startup_seconds.set(time.perf_counter() - IMPORTED, phase='setup')
+    logger.info("Бот запущен за %.2f с (импорт %.2f с)", time.perf_counter() - STARTED, IMPORTED - STARTED)
+
+    if config.BOT_MODE == "worker":
+        # Апдейты приходят от front.py, состояние чатов передаётся через БД
+        worker = ShardWorker(
+            config.WORKER_NAME, config.WORKER_URL, dp, bot,
+            sessionmaker(engine, expire_on_commit=False, class_=AsyncSession),
+            suspend_attempt, resume_attempt, config.WORKER_HEARTBEAT_SECONDS, config.WORKER_TIMEOUT_SECONDS)
+        await dp.emit_startup(bot=bot)
+        try:
+            await worker.run("0.0.0.0", config.WORKER_PORT)
+        finally:
+            await dp.emit_shutdown(bot=bot)
+            await bot.session.close()
+        return
+
     # Запуск бота
     await dp.start_polling(bot, skip_updates=True)
 
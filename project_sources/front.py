@@ -0,0 +1,60 @@
+import asyncio
+import logging
+
+import aiohttp
+from aiohttp import web
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from tools import config
+from utils.logging_config import setup_logging
+from utils.metrics import start_metrics_server
+from utils.sharding import Front
+
+logger = logging.getLogger(__name__)
+
+
+async def set_webhook():
+    """Регистрирует вебхук в Telegram, если задан публичный адрес WEBHOOK_URL."""
+    if not config.WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL не задан: вебхук в Telegram не регистрируется")
+        return
+    from aiogram import Bot
+
+    async with Bot(token=config.BOT_TOKEN) as bot:
+        await bot.set_webhook(config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                              secret_token=config.WEBHOOK_SECRET, drop_pending_updates=True)
+    logger.info("Вебхук зарегистрирован: %s%s", config.WEBHOOK_URL, config.WEBHOOK_PATH)
+
+
+async def main():
+    """
+    Приёмник вебхука для режима шардирования: раздаёт апдейты рабочим процессам
+    bot.py (BOT_MODE=worker) по id чата, см. utils.sharding.Front.
+    """
+    setup_logging(config.LOG_LEVEL)
+    engine = create_async_engine(config.DATABASE_URL, echo=False)
+    front = Front(sessionmaker(engine, expire_on_commit=False, class_=AsyncSession),
+                  config.FRONT_REFRESH_SECONDS, config.WORKER_TIMEOUT_SECONDS, config.WEBHOOK_SECRET)
+
+    async with aiohttp.ClientSession() as http:
+        front.http = http
+        await front.refresh()
+        watcher = asyncio.create_task(front.watch_workers())
+
+        runner = web.AppRunner(front.web_app(config.WEBHOOK_PATH), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", config.FRONT_PORT).start()
+        await start_metrics_server(config.BOT_METRICS_PORT)
+        await set_webhook()
+        logger.info("Приёмник вебхука слушает порт %s", config.FRONT_PORT)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            watcher.cancel()
+            await runner.cleanup()
+            await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
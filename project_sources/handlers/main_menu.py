@@ -3,7 +3,7 @@ from typing import List, Tuple, Optional
 from zoneinfo import ZoneInfo
 import re
 from datetime import datetime
-from aiogram import Router, types
+from aiogram import Router, types, flags
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
@@ -12,20 +12,17 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func
 from tools.models import User, Group, Test, TestAttempt
-from tools.config import ADMIN_USERNAME
+from tools.config import ADMIN_USERNAME, LOG_SAMPLE_EVERY
 from tools.states import TestStates  # Импортируем TestStates
+from utils.open_tests_cache import open_tests_cache, OpenTest
+from utils.test_snapshots import test_snapshots
+from utils.user_cache import user_profiles
+from tools.callbacks import SelectTest
 import logging
 
 router = Router()
 
-# Настройка логирования
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
 # Состояния для FSM
@@ -45,7 +42,7 @@ async def is_user_testing(state: FSMContext) -> bool:
 
 
 # Функция для создания главного меню
-def get_main_menu(username: str, confirmed: bool) -> ReplyKeyboardMarkup:
+def get_main_menu(username: Optional[str], confirmed: bool) -> ReplyKeyboardMarkup:
     buttons = []
 
     if confirmed:
@@ -60,7 +57,7 @@ def get_main_menu(username: str, confirmed: bool) -> ReplyKeyboardMarkup:
 @router.message(Command(commands="start"))
 async def start_handler(message: types.Message, state: FSMContext, session: AsyncSession):
     username = message.from_user.username
-    logger.info(f"Получено сообщение /start от пользователя {username}")  # Отладочный вывод
+    logger.info("Получено сообщение /start от пользователя %s", username)  # Отладочный вывод
 
     if not username:
         await message.reply("Ваш профиль Telegram не содержит имени пользователя (username). Регистрация невозможна.")
@@ -87,7 +84,7 @@ async def start_handler(message: types.Message, state: FSMContext, session: Asyn
             )
             await state.set_state(Registration.awaiting_user_data)
     except Exception as e:
-        logger.error(f"Ошибка в обработчике /start: {e}")
+        logger.error("Ошибка в обработчике /start: %s", e)
         await message.reply("Произошла ошибка при проверке данных. Попробуйте позже.")
 
 
@@ -148,16 +145,16 @@ async def register_new_user(message: types.Message, state: FSMContext, session:
 
         await state.clear()
     except Exception as e:
-        logger.error(f"Ошибка при регистрации: {e}")
+        logger.error("Ошибка при регистрации: %s", e)
         await message.reply("Произошла ошибка при регистрации. Попробуйте позже.")
 
 
 # Обработчик кнопки "Доступные тесты"
 @router.message(lambda message: message.text == "Доступные тесты")
+@flags.replica
 async def available_tests_handler(message: types.Message, state: FSMContext, session: AsyncSession):
-    # Получаем пользователя из базы данных
-    result = await session.execute(select(User).where(User.user_id == message.from_user.id))
-    user = result.scalars().first()
+    # Профиль подтверждённого пользователя кэшируется; админка сбрасывает его при подтверждении и удалении
+    user = await user_profiles.get(session, message.from_user.id)
 
     if not user:
         await message.answer("Вы не зарегистрированы. Пожалуйста, используйте команду /start для регистрации.")
@@ -179,37 +176,33 @@ async def available_tests_handler(message: types.Message, state: FSMContext, ses
         # Текущая дата и время
         current_time_val = datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
 
-        # Подготовка запроса с подсчетом попыток
-        stmt = (
-            select(Test, func.count(TestAttempt.id).label("attempt_count"))
-            .outerjoin(TestAttempt, (Test.id == TestAttempt.test_id) & (TestAttempt.user_id == user.id))
-            .where(
-                (Test.expiry_date == None) | (Test.expiry_date > current_time_val),
-                Test.question_count > 0
+        # Открытые тесты группы берутся из кэша, из БД читаем только число попыток пользователя
+        open_tests = [
+            test for test in await open_tests_cache.get(session, user.group)
+            if test.expiry_date is None or test.expiry_date > current_time_val
+        ]
+
+        attempt_counts = {}
+        if open_tests:
+            attempts_result = await session.execute(
+                select(TestAttempt.test_id, func.count(TestAttempt.id))
+                .where(
+                    TestAttempt.user_id == user.id,
+                    TestAttempt.test_id.in_([test.id for test in open_tests])
+                )
+                .group_by(TestAttempt.test_id)
             )
-            .group_by(Test.id)
-            .having(func.count(TestAttempt.id) < Test.number_of_attempts)
-        )
-
-        # Выполнение запроса
-        test_result = await session.execute(stmt)
-        tests_with_attempts = test_result.all()  # Каждый элемент: (Test, attempt_count)
-
-        logger.info(f"Найдено тестов после фильтрации по попыткам: {len(tests_with_attempts)}")
+            attempt_counts = dict(attempts_result.all())
+            # Студент, открывший список, скорее всего сейчас начнёт тест — снимок загружается заранее
+            test_snapshots.prewarm(test.id for test in open_tests)
 
-        # Фильтруем тесты по группе
-        available_tests: List[Tuple[Test, int]] = []
-        for test, attempt_count in tests_with_attempts:
-            if not test.groups_with_access:
-                # Если доступен для всех групп
-                available_tests.append((test, test.number_of_attempts - attempt_count))
-            else:
-                # Проверяем, принадлежит ли пользователь к разрешенной группе
-                allowed_groups = [group.strip() for group in test.groups_with_access.split(",")]
-                if user.group in allowed_groups:
-                    available_tests.append((test, test.number_of_attempts - attempt_count))
+        available_tests: List[Tuple[OpenTest, int]] = [
+            (test, test.number_of_attempts - attempt_counts.get(test.id, 0)) for test in open_tests
+            if attempt_counts.get(test.id, 0) < test.number_of_attempts
+        ]
 
-        logger.info(f"Доступных тестов для пользователя после фильтрации по группам: {len(available_tests)}")
+        logger.info("Доступных тестов для пользователя: %s", len(available_tests),
+                    extra={"sample_every": LOG_SAMPLE_EVERY})
 
         if not available_tests:
             await message.answer("Нет доступных тестов для вашей группы или вы исчерпали все попытки.")
@@ -221,7 +214,7 @@ async def available_tests_handler(message: types.Message, state: FSMContext, ses
                 [
                     InlineKeyboardButton(
                         text=f"{test.test_name} (до {test.expiry_date.strftime('%d.%m.%Y %H:%M') if test.expiry_date else '∞'}) (Попытки осталось: {remaining})",
-                        callback_data=f"select_test:{test.id}"
+                        callback_data=SelectTest(test_id=test.id).pack()
                     )
                 ] for test, remaining in available_tests
             ]
@@ -229,7 +222,7 @@ async def available_tests_handler(message: types.Message, state: FSMContext, ses
 
         await message.answer("Выберите тест для прохождения:", reply_markup=keyboard)
     except Exception as e:
-        logger.error(f"Ошибка в обработчике 'Доступные тесты': {e}")
+        logger.error("Ошибка в обработчике 'Доступные тесты': %s", e)
         await message.answer("Произошла ошибка при получении тестов. Попробуйте позже.")
 
 
@@ -1,38 +1,52 @@
 # handlers/results.py
 
-import json
-from typing import Optional, List, Dict, Any
-from aiogram import Router, types
+from typing import Optional, List, Dict, Any, Tuple
+from aiogram import Router, types, flags
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import StateFilter
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 import logging
 
-from tools.models import TestAttempt, Test, User, Question
+from tools.models import TestAttempt, Test, User, Question, AttemptAnswer
+from utils.attempt_answers import mask_to_option_ids
+from utils.question_pool import attempt_questions, attempt_size, ordered_options
+from utils.test_versions import version_banks
 from .main_menu import get_main_menu  # Импорт функции главного меню
 from tools.states import TestStates  # Импорт состояний из states.py
+from tools.config import LOG_SAMPLE_EVERY
+from tools.callbacks import (
+    TestsPage, ViewResultsTest, AttemptsPage, ViewAttempt, AttemptNav,
+    BackToAttempts, BackToTestsMenu, BackToMainMenu, Noop, NOOP,
+)
+from utils.callback_router import CallbackIndex
 
 router = Router()
+callbacks = CallbackIndex(router)
 
-# Настройка логирования
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-if not logger.hasHandlers():
-    logger.addHandler(handler)
 
 ITEMS_PER_PAGE = 8  # Количество элементов на странице
 
 
 # Вспомогательная функция для проверки, находится ли пользователь в состоянии тестирования
+async def load_test_max_score(session: AsyncSession, test_id: int) -> Tuple[Optional[Test], int]:
+    """Тест и максимальный балл за попытку текущей версии (число вопросов в ней)."""
+    result = await session.execute(
+        select(Test, select(func.count(Question.id))
+               .where(Question.test_id == Test.id, Question.retired_in.is_(None)).scalar_subquery())
+        .where(Test.id == test_id)
+    )
+    row = result.first()
+    if row is None:
+        return None, 0
+    test, bank_size = row
+    return test, attempt_size(test.question_count, bank_size)
+
+
 async def is_user_testing(state: FSMContext) -> bool:
     current_state = await state.get_state()
     testing_states = [
@@ -54,7 +68,7 @@ def create_tests_keyboard(tests: List[Test], passed_tests_ids: List[int], page:
     for test in tests:
         passed_symbol = ' ✅' if test.id in passed_tests_ids else ''
         button_text = f"{test.test_name}{passed_symbol}"
-        callback_data = f"view_results_test:{test.id}" if active else "noop"
+        callback_data = ViewResultsTest(test_id=test.id).pack() if active else NOOP
         buttons.append([
             InlineKeyboardButton(
                 text=button_text,
@@ -64,11 +78,11 @@ def create_tests_keyboard(tests: List[Test], passed_tests_ids: List[int], page:
 
     navigation_buttons = []
     if page > 1:
-        callback_data_prev = f"tests_page:{page - 1}" if active else "noop"
+        callback_data_prev = TestsPage(page=page - 1).pack() if active else NOOP
         navigation_buttons.append(
             InlineKeyboardButton(text="⬅️ Назад", callback_data=callback_data_prev))
     if page < total_pages:
-        callback_data_next = f"tests_page:{page + 1}" if active else "noop"
+        callback_data_next = TestsPage(page=page + 1).pack() if active else NOOP
         navigation_buttons.append(
             InlineKeyboardButton(text="➡️ Вперёд", callback_data=callback_data_next))
 
@@ -76,7 +90,7 @@ def create_tests_keyboard(tests: List[Test], passed_tests_ids: List[int], page:
         buttons.append(navigation_buttons)
 
     # Добавляем кнопку "⬅️ Назад в главное меню"
-    callback_data_back = "back_to_main_menu" if active else "noop"
+    callback_data_back = BackToMainMenu().pack() if active else NOOP
     buttons.append(
         [InlineKeyboardButton(text="⬅️ Назад в главное меню", callback_data=callback_data_back)]
     )
@@ -91,33 +105,14 @@ def create_attempts_keyboard(attempts: List[TestAttempt], page: int, total_pages
     """
     buttons = []
     for attempt in attempts:
-        try:
-            # Обработка attempt.answers как dict или str
-            if isinstance(attempt.answers, str):
-                try:
-                    answers_dict = json.loads(attempt.answers)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Ошибка десериализации answers для попытки {attempt.id}: {e}")
-                    answers_dict = {}
-            elif isinstance(attempt.answers, dict):
-                answers_dict = attempt.answers
-            else:
-                logger.error(
-                    f"Ожидалась строка JSON или dict для attempt.answers, но получен тип: {type(attempt.answers)}")
-                answers_dict = {}
-
-            # Подсчет набранных баллов
-            attempt_score = sum(1 for ans in answers_dict.values() if isinstance(ans, dict) and ans.get('correct'))
-            logger.debug(f"Attempt ID={attempt.id}: Score={attempt_score}/{max_score}")
-        except Exception as e:
-            logger.error(f"Неизвестная ошибка при обработке attempt.answers для попытки {attempt.id}: {e}")
-            attempt_score = 0
-
+        # Балл попытки хранится в test_attempts.score, ответы для списка не загружаются
+        attempt_score = attempt.score
         attempt_date = attempt.start_time.strftime('%Y-%m-%d %H:%M')
         passed_symbol = '✅' if attempt.passed else '❌'
-        button_text = f"Попытка от {attempt_date} - {attempt_score}/{max_score} - {passed_symbol}"
+        # У попыток до весов вопросов максимум не сохранён — берём число вопросов
+        button_text = f"Попытка от {attempt_date} - {attempt_score}/{attempt.max_score or max_score} - {passed_symbol}"
 
-        callback_data = f"view_attempt:{attempt.id}" if active else "noop"
+        callback_data = ViewAttempt(attempt_id=attempt.id).pack() if active else NOOP
         buttons.append([
             InlineKeyboardButton(
                 text=button_text,
@@ -128,11 +123,11 @@ def create_attempts_keyboard(attempts: List[TestAttempt], page: int, total_pages
     # Навигационные кнопки
     navigation_buttons = []
     if page > 1:
-        callback_data_prev = f"attempts_page:{test_id}:{page - 1}" if active else "noop"
+        callback_data_prev = AttemptsPage(test_id=test_id, page=page - 1).pack() if active else NOOP
         navigation_buttons.append(
             InlineKeyboardButton(text="⬅️ Назад", callback_data=callback_data_prev))
     if page < total_pages:
-        callback_data_next = f"attempts_page:{test_id}:{page + 1}" if active else "noop"
+        callback_data_next = AttemptsPage(test_id=test_id, page=page + 1).pack() if active else NOOP
         navigation_buttons.append(
             InlineKeyboardButton(text="➡️ Вперёд", callback_data=callback_data_next))
 
@@ -140,7 +135,7 @@ def create_attempts_keyboard(attempts: List[TestAttempt], page: int, total_pages
         buttons.append(navigation_buttons)
 
     # Добавляем кнопку "⬅️ Назад к списку тестов"
-    callback_data_back = "back_to_tests_menu" if active else "noop"
+    callback_data_back = BackToTestsMenu().pack() if active else NOOP
     buttons.append(
         [InlineKeyboardButton(text="⬅️ Назад к списку тестов", callback_data=callback_data_back)]
     )
@@ -156,16 +151,16 @@ def create_attempt_details_keyboard(attempt_id: int, question_index: int, total_
     """
     navigation_buttons = []
     if question_index > 0:
-        callback_data_prev = f"attempt_nav:{attempt_id}:{question_index - 1}" if active else "noop"
+        callback_data_prev = AttemptNav(attempt_id=attempt_id, question_index=question_index - 1).pack() if active else NOOP
         navigation_buttons.append(
             InlineKeyboardButton(text="⬅️ Назад", callback_data=callback_data_prev))
     if question_index < total_questions - 1:
-        callback_data_next = f"attempt_nav:{attempt_id}:{question_index + 1}" if active else "noop"
+        callback_data_next = AttemptNav(attempt_id=attempt_id, question_index=question_index + 1).pack() if active else NOOP
         navigation_buttons.append(
             InlineKeyboardButton(text="➡️ Вперёд", callback_data=callback_data_next))
 
     # Добавляем кнопку "⬅️ Назад к списку попыток"
-    callback_data_back = "back_to_attempts" if active else "noop"
+    callback_data_back = BackToAttempts().pack() if active else NOOP
     navigation_buttons.append(
         InlineKeyboardButton(text="⬅️ Назад к списку попыток", callback_data=callback_data_back)
     )
@@ -174,9 +169,11 @@ def create_attempt_details_keyboard(attempt_id: int, question_index: int, total_
 
 
 @router.message(lambda message: message.text == "Пройденные тесты")
+@flags.replica
 async def show_results_menu(message: types.Message, session: AsyncSession, state: FSMContext):
     logger.info(
-        f"Обработчик 'Пройденные тесты' вызван для пользователя {message.from_user.username}")
+        "Обработчик 'Пройденные тесты' вызван для пользователя %s", message.from_user.username,
+        extra={"sample_every": LOG_SAMPLE_EVERY})
     user_id = message.from_user.id
 
     # Проверяем, находится ли пользователь в состоянии тестирования
@@ -236,16 +233,12 @@ async def show_results_menu(message: types.Message, session: AsyncSession, state
     await state.set_state(TestStates.VIEWING_TESTS)
 
 
-@router.callback_query(StateFilter(TestStates.VIEWING_TESTS), lambda c: c.data and c.data.startswith("tests_page:"))
-async def paginate_tests(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+@callbacks(TestsPage, TestStates.VIEWING_TESTS)
+@flags.replica
+async def paginate_tests(callback: types.CallbackQuery, callback_data: TestsPage, session: AsyncSession,
+                         state: FSMContext):
     await callback.answer()
-
-    try:
-        _, page_str = callback.data.split(":")
-        page = int(page_str)
-    except ValueError:
-        await callback.message.answer("Некорректный номер страницы.")
-        return
+    page = callback_data.page
 
     user_id = callback.from_user.id
 
@@ -314,9 +307,10 @@ async def paginate_tests(callback: types.CallbackQuery, session: AsyncSession, s
     await state.set_state(TestStates.VIEWING_TESTS)
 
 
-@router.callback_query(StateFilter(TestStates.VIEWING_TESTS),
-                       lambda c: c.data and c.data.startswith("view_results_test:"))
-async def select_test(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+@callbacks(ViewResultsTest, TestStates.VIEWING_TESTS)
+@flags.replica
+async def select_test(callback: types.CallbackQuery, callback_data: ViewResultsTest, session: AsyncSession,
+                      state: FSMContext):
     await callback.answer()
 
     user_id = callback.from_user.id
@@ -328,12 +322,7 @@ async def select_test(callback: types.CallbackQuery, session: AsyncSession, stat
             "Вы сейчас проходите тест. Пожалуйста, завершите текущий тест перед тем, как просматривать пройденные тесты.")
         return
 
-    try:
-        _, test_id_str = callback.data.split(":")
-        test_id = int(test_id_str)
-    except ValueError:
-        await callback.message.answer("Некорректный ID теста.")
-        return
+    test_id = callback_data.test_id
 
     # Получение объекта пользователя
     user_result = await session.execute(
@@ -360,20 +349,12 @@ async def select_test(callback: types.CallbackQuery, session: AsyncSession, stat
         )
         return
 
-    # Загрузка теста с вопросами для получения максимального количества баллов
-    test_result = await session.execute(
-        select(Test)
-        .options(selectinload(Test.questions))
-        .where(Test.id == test_id)
-    )
-    test: Optional[Test] = test_result.scalars().first()
+    # Максимальный балл — число вопросов в попытке; банк вопросов для этого не загружается
+    test, max_score = await load_test_max_score(session, test_id)
     if not test:
         await callback.message.answer("Тест не найден.")
         return
 
-    # Максимальное количество баллов равно количеству вопросов
-    max_score = len(test.questions)
-
     # Пагинация
     total_pages = (len(attempts) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
     current_page = 1
@@ -397,18 +378,13 @@ async def select_test(callback: types.CallbackQuery, session: AsyncSession, stat
     await state.update_data(attempts_message_id=sent_message.message_id)
 
 
-@router.callback_query(StateFilter(TestStates.VIEWING_ATTEMPTS),
-                       lambda c: c.data and c.data.startswith("attempts_page:"))
-async def paginate_attempts(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+@callbacks(AttemptsPage, TestStates.VIEWING_ATTEMPTS)
+@flags.replica
+async def paginate_attempts(callback: types.CallbackQuery, callback_data: AttemptsPage, session: AsyncSession,
+                            state: FSMContext):
     await callback.answer()
-
-    try:
-        _, test_id_str, page_str = callback.data.split(":")
-        test_id = int(test_id_str)
-        page = int(page_str)
-    except ValueError:
-        await callback.message.answer("Некорректные данные пагинации.")
-        return
+    test_id = callback_data.test_id
+    page = callback_data.page
 
     user_id = callback.from_user.id
 
@@ -438,19 +414,12 @@ async def paginate_attempts(callback: types.CallbackQuery, session: AsyncSession
         await callback.message.answer("У вас нет попыток для этого теста.")
         return
 
-    # Загрузка теста с вопросами для получения максимального количества баллов
-    test_result = await session.execute(
-        select(Test)
-        .options(selectinload(Test.questions))
-        .where(Test.id == test_id)
-    )
-    test: Optional[Test] = test_result.scalars().first()
+    # Максимальный балл — число вопросов в попытке; банк вопросов для этого не загружается
+    test, max_score = await load_test_max_score(session, test_id)
     if not test:
         await callback.message.answer("Тест не найден.")
         return
 
-    max_score = len(test.questions)
-
     # Пагинация
     total_pages = (len(attempts) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
 
@@ -477,9 +446,10 @@ async def paginate_attempts(callback: types.CallbackQuery, session: AsyncSession
     await state.update_data(attempts_message_id=callback.message.message_id)
 
 
-@router.callback_query(StateFilter(TestStates.VIEWING_ATTEMPTS),
-                       lambda c: c.data and c.data.startswith("view_attempt:"))
-async def view_attempt(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
+@callbacks(ViewAttempt, TestStates.VIEWING_ATTEMPTS)
+@flags.replica
+async def view_attempt(callback: types.CallbackQuery, callback_data: ViewAttempt, session: AsyncSession,
+                       state: FSMContext):
     await callback.answer()
 
     user_id = callback.from_user.id
@@ -491,52 +461,44 @@ async def view_attempt(callback: types.CallbackQuery, session: AsyncSession, sta
             "Вы сейчас проходите тест. Пожалуйста, завершите текущий тест перед тем, как просматривать пройденные тесты.")
         return
 
-    try:
-        _, attempt_id_str = callback.data.split(":")
-        attempt_id = int(attempt_id_str)
-    except ValueError:
-        await callback.message.answer("Некорректный ID попытки.")
-        return
+    attempt_id = callback_data.attempt_id
 
     # Загрузка попытки с ответами
-    result = await session.execute(
-        select(TestAttempt)
-        .options(
-            selectinload(TestAttempt.test).selectinload(Test.questions)  # Загрузка теста и его вопросов
-        )
-        .where(TestAttempt.id == attempt_id)
-    )
+    result = await session.execute(select(TestAttempt).where(TestAttempt.id == attempt_id))
     attempt: Optional[TestAttempt] = result.scalars().first()
 
     if not attempt:
         await callback.message.answer("Попытка не найдена.")
         return
 
-    # Получение вопросов из теста
-    questions = attempt.test.questions
+    # Ответы попытки: {question_id: {option_mask, text_answer, correct}}
+    answers_result = await session.execute(
+        select(AttemptAnswer.question_id, AttemptAnswer.option_mask, AttemptAnswer.text_answer,
+               AttemptAnswer.correct)
+        .where(AttemptAnswer.attempt_id == attempt_id)
+    )
+    attempt_answers_dict = {
+        str(question_id): {'option_mask': option_mask, 'text_answer': text_answer, 'correct': correct}
+        for question_id, option_mask, text_answer, correct in answers_result.all()
+    }
+
+    # Вопросы попытки заново выбираются по её зерну из версии теста, которую она проходила:
+    # правки теста после попытки на них не влияют
+    bank = await version_banks.get(session, attempt.test_id, attempt.test_version)
+    questions = attempt_questions(bank, attempt, {int(question_id) for question_id in attempt_answers_dict}) \
+        if bank is not None else []
 
     if not questions:
         await callback.message.answer("Вопросы для этого теста не найдены.")
         return
 
-    # Сохранение необходимых данных в состоянии
-    if isinstance(attempt.answers, str):
-        try:
-            attempt_answers_dict = json.loads(attempt.answers)
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка десериализации answers для попытки {attempt.id}: {e}")
-            attempt_answers_dict = {}
-    elif isinstance(attempt.answers, dict):
-        attempt_answers_dict = attempt.answers
-    else:
-        logger.error(f"Ожидалась строка JSON или dict для attempt.answers, но получен тип: {type(attempt.answers)}")
-        attempt_answers_dict = {}
-
     await state.update_data(
         attempt_id=attempt_id,
         questions=questions,
+        seed=attempt.seed,
+        shuffle=bank.shuffle,
         question_index=0,
-        attempt_answers=attempt_answers_dict  # Теперь это словарь
+        attempt_answers=attempt_answers_dict
     )
     await state.set_state(TestStates.VIEWING_ATTEMPT_DETAILS)
 
@@ -544,18 +506,11 @@ async def view_attempt(callback: types.CallbackQuery, session: AsyncSession, sta
     await send_attempt_question(callback.message, state)
 
 
-@router.callback_query(StateFilter(TestStates.VIEWING_ATTEMPT_DETAILS),
-                       lambda c: c.data and c.data.startswith("attempt_nav:"))
-async def navigate_attempt_questions(callback: types.CallbackQuery, state: FSMContext):
+@callbacks(AttemptNav, TestStates.VIEWING_ATTEMPT_DETAILS)
+async def navigate_attempt_questions(callback: types.CallbackQuery, callback_data: AttemptNav, state: FSMContext):
     await callback.answer()
-
-    try:
-        _, attempt_id_str, question_index_str = callback.data.split(":")
-        attempt_id = int(attempt_id_str)
-        question_index = int(question_index_str)
-    except ValueError:
-        await callback.message.answer("Некорректные данные навигации.")
-        return
+    attempt_id = callback_data.attempt_id
+    question_index = callback_data.question_index
 
     # Проверяем, находится ли пользователь в состоянии тестирования
     user_testing = await is_user_testing(state)
@@ -572,111 +527,8 @@ async def navigate_attempt_questions(callback: types.CallbackQuery, state: FSMCo
     await send_attempt_question(callback.message, state)
 
 
-async def send_attempt_question(message: types.Message, state: FSMContext):
-    user_data = await state.get_data()
-    attempt_id = user_data.get('attempt_id')
-    questions: List[Question] = user_data.get('questions', [])
-    question_index = user_data.get('question_index', 0)
-    attempt_answers: Dict[str, Any] = user_data.get('attempt_answers', {})
-
-    if question_index < 0 or question_index >= len(questions):
-        await message.answer("Вопрос не найден.")
-        return
-
-    current_question: Question = questions[question_index]
-    question_id_str = str(current_question.id)
-    user_answer_entry = attempt_answers.get(question_id_str)
-    is_correct = False
-
-    if user_answer_entry is not None:
-        is_correct = user_answer_entry.get('correct', False)
-        user_answer = user_answer_entry.get('user_answer', None)
-    else:
-        user_answer = None
-        is_correct = False
-
-    # Обработка ответа пользователя для множественного выбора и single_choice
-    if current_question.question_type == 'multiple_choice':
-        if isinstance(user_answer, list):
-            user_answer_list = [str(ans) for ans in user_answer]  # Убедимся, что все ответы - строки
-        elif isinstance(user_answer, str):
-            # Если ответы хранятся как строка, разбиваем их на список символов
-            user_answer_list = list(user_answer)
-        else:
-            user_answer_list = []
-    elif current_question.question_type == 'single_choice':
-        if isinstance(user_answer, list) and len(user_answer) == 1:
-            user_answer_list = [str(user_answer[0])]
-        elif isinstance(user_answer, str):
-            user_answer_list = [user_answer]
-        else:
-            user_answer_list = []
-    else:
-        user_answer_list = [str(user_answer)] if user_answer is not None else []
-
-    # Построение текста сообщения
-    question_text = f"Вопрос {question_index + 1}/{len(questions)}:\n\n{current_question.question_text}\n\n"
-
-    if current_question.question_type in ['single_choice', 'multiple_choice']:
-        if current_question.question_type == 'multiple_choice':
-            question_text += f"Выберите один вариант ответа:\n"
-        else:
-            question_text += f"Выберите один или несколько вариантов ответа:\n"
-
-        options_text = ""
-        for idx, option in enumerate(current_question.options, start=1):
-            option_id_str = str(option['id'])
-            if current_question.question_type == 'single_choice':
-
-                selected = (option_id_str == user_answer_list[0]) if user_answer_list else False
-            elif current_question.question_type == 'multiple_choice':
-                selected = (option_id_str in user_answer_list)
-            else:
-                selected = False
-
-            checkmark = "✅" if selected else ""
-            options_text += f"{idx}. {option['text']} {checkmark}\n"
-        question_text += options_text
-    elif current_question.question_type == 'text_input':
-        if user_answer:
-            question_text += f"Ваш ответ: {user_answer}\n"
-        else:
-            question_text += "Вы не ответили на этот вопрос.\n"
-
-    # Обработка отсутствующего ответа
-    if user_answer_entry is None:
-        if current_question.question_type == 'text_input':
-            question_text += f"\nРезультат: Не отвечено"
-        else:
-            question_text += f"\nРезультат: ❌ Неправильно"
-    else:
-        question_text += f"\nРезультат: {'✅ Правильно' if is_correct else '❌ Неправильно'}"
-
-    # Создание клавиатуры
-    keyboard = create_attempt_details_keyboard(
-        attempt_id, question_index, len(questions), active=True
-    )
-
-    # Логирование для отладки
-    logger.debug(f"Attempt ID: {attempt_id}, Question Index: {question_index}")
-    logger.debug(f"Current Question ID: {current_question.id}")
-    logger.debug(f"User Answer Entry: {user_answer_entry}")
-    logger.debug(f"User Answer List: {user_answer_list}")
-    logger.debug(f"Is Correct: {is_correct}")
-    logger.debug(f"Question Text: {question_text}")
-
-    try:
-        await message.edit_text(question_text, reply_markup=keyboard)
-    except TelegramBadRequest as e:
-        if "message is not modified" in str(e):
-            logger.debug("Message is not modified. Skipping edit.")
-            pass
-        else:
-            logger.error(f"Ошибка при редактировании сообщения: {e}")
-            await message.answer(question_text, reply_markup=keyboard)
-
-
-@router.callback_query(StateFilter(TestStates.VIEWING_ATTEMPT_DETAILS), lambda c: c.data == "back_to_attempts")
+@callbacks(BackToAttempts, TestStates.VIEWING_ATTEMPT_DETAILS)
+@flags.replica
 async def back_to_attempts(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
     await callback.answer()
 
@@ -716,19 +568,12 @@ async def back_to_attempts(callback: types.CallbackQuery, session: AsyncSession,
         await callback.message.answer("У вас нет попыток для этого теста.")
         return
 
-    # Загрузка теста с вопросами для получения максимального количества баллов
-    test_result = await session.execute(
-        select(Test)
-        .options(selectinload(Test.questions))
-        .where(Test.id == test_id)
-    )
-    test: Optional[Test] = test_result.scalars().first()
+    # Максимальный балл — число вопросов в попытке; банк вопросов для этого не загружается
+    test, max_score = await load_test_max_score(session, test_id)
     if not test:
         await callback.message.answer("Тест не найден.")
         return
 
-    max_score = len(test.questions)
-
     # Пагинация
     total_pages = (len(attempts) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
     current_page = 1
@@ -750,7 +595,8 @@ async def back_to_attempts(callback: types.CallbackQuery, session: AsyncSession,
     await state.update_data(attempts_message_id=sent_message.message_id)
 
 
-@router.callback_query(StateFilter(TestStates.VIEWING_ATTEMPTS), lambda c: c.data == "back_to_tests_menu")
+@callbacks(BackToTestsMenu, TestStates.VIEWING_ATTEMPTS)
+@flags.replica
 async def back_to_tests_menu(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
     await callback.answer()
 
@@ -817,7 +663,8 @@ async def back_to_tests_menu(callback: types.CallbackQuery, session: AsyncSessio
     await state.set_state(TestStates.VIEWING_TESTS)
 
 
-@router.callback_query(lambda c: c.data == "back_to_main_menu")
+@callbacks(BackToMainMenu)
+@flags.replica
 async def back_to_main_menu(callback: types.CallbackQuery, session: AsyncSession, state: FSMContext):
     await callback.answer()
 
@@ -853,7 +700,7 @@ async def back_to_main_menu(callback: types.CallbackQuery, session: AsyncSession
     await state.clear()
 
 
-@router.callback_query(lambda c: c.data == "noop")
+@callbacks(Noop)
 async def noop_handler(callback: types.CallbackQuery):
     await callback.answer()
 
@@ -872,47 +719,24 @@ async def send_attempt_question(message: types.Message, state: FSMContext):
     current_question: Question = questions[question_index]
     question_id_str = str(current_question.id)
     user_answer_entry = attempt_answers.get(question_id_str)
-    is_correct = False
 
     if user_answer_entry is not None:
         is_correct = user_answer_entry.get('correct', False)
-        user_answer = user_answer_entry.get('user_answer', None)
+        selected_option_ids = mask_to_option_ids(user_answer_entry.get('option_mask'))
+        user_answer = user_answer_entry.get('text_answer')
     else:
-        user_answer = None
         is_correct = False
-
-    # Обработка ответа пользователя для множественного выбора и single_choice
-    if current_question.question_type == 'multiple_choice':
-        if isinstance(user_answer, list):
-            user_answer_list = [str(ans) for ans in user_answer]  # Убедимся, что все ответы - строки
-        elif isinstance(user_answer, str):
-            # Если ответы хранятся как строка, разбиваем их на список символов
-            user_answer_list = list(user_answer)
-        else:
-            user_answer_list = []
-    elif current_question.question_type == 'single_choice':
-        if isinstance(user_answer, list) and len(user_answer) == 1:
-            user_answer_list = [str(user_answer[0])]
-        elif isinstance(user_answer, str):
-            user_answer_list = [user_answer]
-        else:
-            user_answer_list = []
-    else:
-        user_answer_list = [str(user_answer)] if user_answer is not None else []
+        selected_option_ids = []
+        user_answer = None
 
     # Построение текста сообщения
     question_text = f"Вопрос {question_index + 1}/{len(questions)}:\n\n{current_question.question_text}\n\n"
 
     if current_question.question_type in ['single_choice', 'multiple_choice']:
         options_text = ""
-        for idx, option in enumerate(current_question.options, start=1):
-            option_id_str = str(option['id'])
-            if current_question.question_type == 'single_choice':
-                selected = (option_id_str == user_answer_list[0]) if user_answer_list else False
-            elif current_question.question_type == 'multiple_choice':
-                selected = (option_id_str in user_answer_list)
-            else:
-                selected = False
+        options = ordered_options(current_question, user_data.get('seed'), user_data.get('shuffle', False))
+        for idx, option in enumerate(options, start=1):
+            selected = int(option['id']) in selected_option_ids
 
             checkmark = "✅" if selected else ""
             options_text += f"{idx}. {option['text']} {checkmark}\n"
@@ -938,12 +762,12 @@ async def send_attempt_question(message: types.Message, state: FSMContext):
     )
 
     # Логирование для отладки
-    logger.debug(f"Attempt ID: {attempt_id}, Question Index: {question_index}")
-    logger.debug(f"Current Question ID: {current_question.id}")
-    logger.debug(f"User Answer Entry: {user_answer_entry}")
-    logger.debug(f"User Answer List: {user_answer_list}")
-    logger.debug(f"Is Correct: {is_correct}")
-    logger.debug(f"Question Text: {question_text}")
+    logger.debug("Attempt ID: %s, Question Index: %s", attempt_id, question_index)
+    logger.debug("Current Question ID: %s", current_question.id)
+    logger.debug("User Answer Entry: %s", user_answer_entry)
+    logger.debug("Selected Option IDs: %s", selected_option_ids)
+    logger.debug("Is Correct: %s", is_correct)
+    logger.debug("Question Text: %s", question_text)
 
     try:
         await message.edit_text(question_text, reply_markup=keyboard)
@@ -952,5 +776,5 @@ async def send_attempt_question(message: types.Message, state: FSMContext):
             logger.debug("Message is not modified. Skipping edit.")
             pass
         else:
-            logger.error(f"Ошибка при редактировании сообщения: {e}")
+            logger.error("Ошибка при редактировании сообщения: %s", e)
             await message.answer(question_text, reply_markup=keyboard)
@@ -1,37 +1,49 @@
 # test_passing.py
 
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from zoneinfo import ZoneInfo
-from tools.config import ADMIN_CHAT_ID, DATABASE_URL
+from tools.config import (
+    ADMIN_CHAT_ID, LOG_SAMPLE_EVERY, START_TEST_CONCURRENCY, START_TEST_QUEUE_LIMIT,
+    START_TEST_QUEUE_TIMEOUT_SECONDS, QUEUE_POSITION_UPDATE_SECONDS, START_TEST_POOL_WAIT_SECONDS,
+    COUNTDOWN_EDITS_PER_SECOND, COUNTDOWN_QUIET_SECONDS,
+)
 from aiogram import Router, types, Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import StateFilter
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.future import select
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
 from .main_menu import get_main_menu
-from tools.models import Test, Question, TestAttempt, User
+from tools.models import Test, Question
 import logging
 from aiogram.exceptions import TelegramBadRequest
 
 from tools.states import TestStates
 from utils.decorators import check_active_test
-from utils.calculate_score import calculate_score
+from utils.scoring_plan import AttemptScore, scoring_plan
+from utils.finalization import finalize_attempt
+from utils.attempt_start import StartRefusal, start_attempt
+from utils.logging_config import state_fields
+from utils.callback_router import CallbackIndex
+from utils.admission import AdmissionController, AdmissionRejected, pool_saturated
+from utils.test_snapshots import test_snapshots
+from utils.test_versions import version_banks
+from utils.countdown import CountdownTicker, format_time_left
+from utils.question_pool import attempt_size, draw_questions, new_attempt_seed, ordered_options
+from tools.callbacks import (
+    SelectTest, AnswerOption, Navigate, Direction, EditAnswer, CancelEditing,
+    FinishTest, ConfirmFinishYes, ConfirmFinishNo, Noop, NOOP,
+)
 
 import asyncio
 
 router = Router()
+callbacks = CallbackIndex(router)
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+start_test_admission = AdmissionController(
+    "start_test", START_TEST_CONCURRENCY, START_TEST_QUEUE_LIMIT,
+    START_TEST_QUEUE_TIMEOUT_SECONDS, QUEUE_POSITION_UPDATE_SECONDS, START_TEST_POOL_WAIT_SECONDS)
 
 def current_time():
     return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
@@ -41,7 +53,7 @@ async def notify_admin(bot: Bot, message: str):
         try:
             await bot.send_message(chat_id=ADMIN_CHAT_ID, text=message)
         except Exception as e:
-            logger.error(f"Не удалось уведомить администратора: {e}")
+            logger.error("Не удалось уведомить администратора: %s", e)
 
 # Функция для экранирования символов MarkdownV2
 def escape_markdown_v2(text: str) -> str:
@@ -50,14 +62,31 @@ def escape_markdown_v2(text: str) -> str:
         text = text.replace(ch, f"\\{ch}")
     return text
 
+# Таймеры monitor_test_time по чатам: при передаче чата другому процессу бота их нужно остановить
+attempt_timers: Dict[int, asyncio.Task] = {}
+
+
+def schedule_monitor(chat_id: int, user_id: int, test_attempt_id: int, end_time: datetime, bot: Bot,
+                     state: FSMContext):
+    task = asyncio.create_task(
+        monitor_test_time(
+            user_id=user_id,
+            test_attempt_id=test_attempt_id,
+            end_time=end_time,
+            bot=bot,
+            state=state
+        )
+    )
+    attempt_timers[chat_id] = task
+    task.add_done_callback(lambda done: attempt_timers.get(chat_id) is done and attempt_timers.pop(chat_id))
+
+
 async def monitor_test_time(user_id: int, test_attempt_id: int, end_time: datetime, bot: Bot, state: FSMContext):
-    logger.debug(f"monitor_test_time started for user {user_id}, test_attempt {test_attempt_id}, end_time {end_time}")
-    engine = create_async_engine(DATABASE_URL, echo=False)
-    async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    logger.debug("monitor_test_time started for user %s, test_attempt %s, end_time %s", user_id, test_attempt_id, end_time)
 
     now = current_time()
     delay = (end_time - now).total_seconds()
-    logger.debug(f"Computed delay: {delay} seconds")
+    logger.debug("Computed delay: %s seconds", delay)
     if delay > 0:
         await asyncio.sleep(delay)
     else:
@@ -65,57 +94,29 @@ async def monitor_test_time(user_id: int, test_attempt_id: int, end_time: dateti
 
     state_data = await state.get_data()
     current_state = await state.get_state()
-    logger.debug(f"After sleep: state_data={state_data}, current_state={current_state}")
+    logger.debug("After sleep: %s, current_state=%s", state_fields(state_data), current_state)
 
-    if state_data.get('test_attempt_id') == test_attempt_id and current_state in [TestStates.TESTING.state, TestStates.EDITING.state]:
-        logger.debug(f"Time expired. Attempt {test_attempt_id} finishing test for user {user_id}")
+    # CONFIRM_FINISH тоже: иначе попытка, оставленная на вопросе «Вы уверены?», не завершится
+    if state_data.get('test_attempt_id') == test_attempt_id and current_state in [
+            TestStates.TESTING.state, TestStates.EDITING.state, TestStates.CONFIRM_FINISH.state]:
+        logger.debug("Time expired. Attempt %s finishing test for user %s", test_attempt_id, user_id)
 
-        # При окончании времени записываем ответы в БД один раз
-        answers = state_data.get('answers', {})
         test_id = state_data.get('test_id')
+        questions = state_data.get('questions', [])  # Уже загружено при start_test
 
-        async with async_session() as session:
-            test_attempt_result = await session.execute(
-                select(TestAttempt).where(TestAttempt.id == test_attempt_id)
-            )
-            test_attempt: Optional[TestAttempt] = test_attempt_result.scalars().first()
-
-            if not test_attempt:
-                logger.error("TestAttempt not found in monitor_test_time")
-                return
-
-            test_result = await session.execute(
-                select(Test).where(Test.id == test_attempt.test_id))
-            test: Optional[Test] = test_result.scalars().first()
-            if not test:
-                logger.error(
-                    f"Тест с ID {test_attempt.test_id} не найден при мониторинге времени.")
-                return
-
-            questions = state_data.get('questions', [])  # Уже загружено при start_test
-
-            # Записываем ответы пользователя в test_attempt (один раз)
-            test_attempt.answers = answers
-
-            score, passed, detailed_answers = calculate_score(
-                test, answers, questions)
-
-            test_attempt.score = score
-            test_attempt.passed = passed
-            test_attempt.end_time = current_time()
-            test_attempt.answers = detailed_answers
+        # Сессии из общего пула бота (см. create_dispatcher)
+        async with test_snapshots.session_maker() as session:
+            try:
+                result = await score_attempt(session, state_data)
+                if result is None:
+                    logger.error("Тест с ID %s не найден при мониторинге времени.", test_id)
+                    return
 
-            user_result = await session.execute(
-                select(User).where(User.user_id == user_id)
-            )
-            user: Optional[User] = user_result.scalars().first()
-            if not user:
-                logger.error(f"Пользователь с ID {user_id} не найден при мониторинге времени.")
-                return
+                if not await finalize_attempt(session, test_attempt_id, current_time(), result, questions):
+                    logger.debug("Attempt %s already finalized, timer does nothing", test_attempt_id)
+                    return
 
-            try:
-                await session.commit()
-                text_to_send = f"⏰ Время теста истекло. Ваш тест завершён.\n\nБаллы: {score}\nСтатус: {'✅ Пройден' if passed else '❌ Не пройден'}"
+                text_to_send = f"⏰ Время теста истекло. Ваш тест завершён.\n\nБаллы: {result.score} из {result.max_score}\nСтатус: {'✅ Пройден' if result.passed else '❌ Не пройден'}"
                 text_to_send = escape_markdown_v2(text_to_send)
                 await bot.send_message(
                     chat_id=user_id,
@@ -123,12 +124,14 @@ async def monitor_test_time(user_id: int, test_attempt_id: int, end_time: dateti
                     parse_mode='MarkdownV2'
                 )
                 logger.info(
-                    f"Автоматически завершён тест {test.id} для пользователя {user_id} (score={score}, passed={passed}).")
+                    "Автоматически завершён тест %s для пользователя %s (score=%s, passed=%s).",
+                    test_id, user_id, result.score, result.passed)
 
                 await state.clear()
-                logger.debug(f"State cleared for user {user_id} after auto-finishing test.")
+                countdown.forget(user_id)
+                logger.debug("State cleared for user %s after auto-finishing test.", user_id)
 
-                main_menu = get_main_menu(user.username, True)
+                main_menu = get_main_menu(None, True)
                 menu_text = "Вы можете выбрать следующий тест или воспользоваться другими опциями."
                 menu_text = escape_markdown_v2(menu_text)
                 await bot.send_message(
@@ -140,18 +143,74 @@ async def monitor_test_time(user_id: int, test_attempt_id: int, end_time: dateti
                 logger.debug("Main menu sent after auto-finishing test.")
             except Exception as e:
                 await session.rollback()
-                logger.error(f"Ошибка при автоматическом завершении теста: {e}")
+                logger.error("Ошибка при автоматическом завершении теста: %s", e)
                 await notify_admin(
                     bot, f"Ошибка при автоматическом завершении теста: {e}"
                 )
     else:
         logger.debug("No conditions met for auto-finishing test.")
 
-@router.callback_query(lambda c: c.data and c.data.startswith("select_test:"))
-async def start_test(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession, bot: Bot):
+async def score_attempt(session: AsyncSession, user_data: Dict[str, Any]) -> Optional[AttemptScore]:
+    """
+    Итог попытки по правилам версии теста, которую она проходила, даже если тест
+    с тех пор изменили. None — теста больше нет.
+    """
+    snapshot = await test_snapshots.get(session, user_data.get('test_id'))
+    if snapshot is None:
+        return None
+    # Попытки, начатые до версий в состоянии FSM, оцениваются по текущей версии
+    bank = await version_banks.get(session, snapshot.test.id, user_data.get('test_version') or snapshot.bank.version)
+    return scoring_plan(bank).score(snapshot.test, user_data.get('answers', {}), user_data.get('questions', []))
+
+
+# Что ответить, если попытку создать нельзя (кнопка теста устарела или нажата дважды)
+START_REFUSAL_TEXTS = {
+    StartRefusal.NO_USER: "Пользователь не найден в системе.",
+    StartRefusal.NO_TEST: "Тест не найден.",
+    StartRefusal.NO_ACCESS: "Этот тест недоступен для вашей группы.",
+    StartRefusal.EXPIRED: "Срок прохождения этого теста истёк.",
+    StartRefusal.NO_ATTEMPTS_LEFT: "Вы исчерпали все попытки прохождения этого теста.",
+}
+
+
+async def create_test_attempt(callback: types.CallbackQuery, session: AsyncSession, bot: Bot,
+                              test: Test) -> Optional[Tuple[int, int, datetime, datetime]]:
+    """
+    Создаёт попытку теста одним запросом с проверкой срока, доступа и лимита попыток.
+    Возвращает (id попытки, зерно, начало, конец); если попытку создать нельзя или
+    произошла ошибка, сообщает пользователю (и администратору) и возвращает None.
+    """
+    start_time = current_time()
+    end_time = start_time + timedelta(minutes=test.duration)
+    user_id = callback.from_user.id
+    seed = new_attempt_seed()
+
+    try:
+        started = await start_attempt(session, user_id, test, seed, start_time, end_time)
+    except Exception as e:
+        await session.rollback()
+        logger.error("Ошибка при создании попытки теста: %s", e)
+        await callback.message.answer("Произошла ошибка при создании попытки теста. Попробуйте позже.")
+        await notify_admin(bot, f"Ошибка при создании попытки теста: {e}")
+        return None
+
+    if started.attempt_id is None:
+        logger.info("Попытка теста %s для пользователя %s не создана: %s", test.id, user_id, started.refusal.value,
+                    extra={"sample_every": LOG_SAMPLE_EVERY})
+        # Повторное нажатие, пока создаётся первая попытка: её вопросы уже отправлены
+        if started.refusal is not StartRefusal.CONCURRENT:
+            await callback.message.edit_text(START_REFUSAL_TEXTS[started.refusal])
+        return None
+    logger.debug("Created TestAttempt ID=%s for user=%s, test=%s", started.attempt_id, user_id, test.id)
+    return started.attempt_id, seed, start_time, end_time
+
+
+@callbacks(SelectTest)
+async def start_test(callback: types.CallbackQuery, callback_data: SelectTest, state: FSMContext,
+                     session: AsyncSession, bot: Bot):
     await callback.answer()
     current_state = await state.get_state()
-    logger.debug(f"start_test: current_state={current_state}")
+    logger.debug("start_test: current_state=%s", current_state)
 
     if current_state == TestStates.TESTING.state:
         await callback.message.edit_text(
@@ -159,65 +218,55 @@ async def start_test(callback: types.CallbackQuery, state: FSMContext, session:
         )
         return
 
-    test_id_str = callback.data.split(":")[1]
-    if not test_id_str.isdigit():
-        await callback.message.answer("Некорректный ID теста.")
-        return
-
-    test_id = int(test_id_str)
-    test_result = await session.execute(select(Test).where(Test.id == test_id))
-    test: Optional[Test] = test_result.scalars().first()
-    if not test:
+    test_id = callback_data.test_id
+    # Тест с вопросами общий для всей группы: при открытии теста его загружает один запрос
+    snapshot = await test_snapshots.get(session, test_id)
+    if not snapshot:
         await callback.message.answer("Тест не найден.")
         return
+    test, bank = snapshot.test, snapshot.bank
 
-    # Заранее грузим все вопросы и храним их в user_data
-    question_result = await session.execute(
-        select(Question).where(Question.test_id == test_id))
-    questions = question_result.scalars().all()
-
-    if not questions:
+    if not bank.questions:
         await callback.message.answer("В этом тесте пока нет вопросов.")
         return
 
-    start_time = current_time()
-    end_time = start_time + timedelta(minutes=test.duration)
-    user_id = callback.from_user.id
-
-    user_result = await session.execute(
-        select(User).where(User.user_id == user_id))
-    user: Optional[User] = user_result.scalars().first()
-    if not user:
-        await callback.message.answer("Пользователь не найден в системе.")
-        return
-
-    test_attempt = TestAttempt(
-        test_id=test_id,
-        user_id=user.id,
-        start_time=start_time,
-        end_time=end_time,
-        score=0,
-        passed=False,
-        answers={}
-    )
+    async def show_queue_position(position: int):
+        try:
+            await callback.message.edit_text(
+                f"⏳ Тест начинают много студентов одновременно. Вы в очереди: {position}.\n"
+                "Тест откроется автоматически, ничего нажимать не нужно."
+            )
+        except TelegramBadRequest as e:
+            logger.debug("Не удалось обновить позицию в очереди: %s", e)
 
-    # Один раз создаём test_attempt
+    # Создание попытки ограничено START_TEST_CONCURRENCY, чтобы вся группа не заняла пул соединений разом
     try:
-        session.add(test_attempt)
-        await session.commit()
-        logger.debug(f"Created TestAttempt ID={test_attempt.id} for user={user_id}, test={test_id}")
-    except Exception as e:
-        await session.rollback()
-        logger.error(f"Ошибка при создании попытки теста: {e}")
-        await callback.message.answer("Произошла ошибка при создании попытки теста. Попробуйте позже.")
-        await notify_admin(bot, f"Ошибка при создании попытки теста: {e}")
+        async with start_test_admission.slot(show_queue_position, lambda: pool_saturated(session.bind)):
+            test_attempt = await create_test_attempt(callback, session, bot, test)
+    except AdmissionRejected as e:
+        logger.warning("Начало теста %s отклонено (%s)", test_id, e.reason, extra={"sample_every": LOG_SAMPLE_EVERY})
+        await callback.message.edit_text(
+            "Сейчас тест начинают слишком много студентов. Попробуйте ещё раз через минуту.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="🔄 Попробовать снова", callback_data=SelectTest(test_id=test_id).pack())
+            ]])
+        )
+        return
+    if test_attempt is None:
         return
+    test_attempt_id, seed, start_time, end_time = test_attempt
+    # Вопросы попытки — ссылки на объекты снимка, выбранные по зерну попытки
+    questions = draw_questions(bank.questions, attempt_size(bank.question_count, len(bank.questions)), seed,
+                               bank.shuffle)
 
     # Сохраняем все данные в user_data
     await state.update_data(
         test_id=test_id,
-        test_attempt_id=test_attempt.id,
+        test_attempt_id=test_attempt_id,
         questions=questions,
+        seed=seed,
+        test_version=bank.version,
+        shuffle=bank.shuffle,
         current_index=0,
         start_time=start_time,
         end_time=end_time,
@@ -227,35 +276,24 @@ async def start_test(callback: types.CallbackQuery, state: FSMContext, session:
     await state.set_state(TestStates.TESTING.state)
     logger.debug("State set to TESTING after start_test")
 
+    countdown.track(callback.message.chat.id, end_time, state)
     await send_question(callback.message, state)
-    asyncio.create_task(
-        monitor_test_time(
-            user_id=user_id,
-            test_attempt_id=test_attempt.id,
-            end_time=end_time,
-            bot=bot,
-            state=state
-        )
-    )
+    schedule_monitor(callback.message.chat.id, callback.from_user.id, test_attempt_id, end_time, bot, state)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("answer:"))
+@callbacks(AnswerOption)
 @check_active_test
-async def handle_answer(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+async def handle_answer(callback: types.CallbackQuery, state: FSMContext, callback_data: AnswerOption,
+                        session: AsyncSession):
     await callback.answer()
     user_data = await state.get_data()
-    logger.debug(f"handle_answer: user_data={user_data}")
+    logger.debug("handle_answer: %s", state_fields(user_data))
 
     current_index = user_data["current_index"]
     questions: List[Question] = user_data["questions"]
     current_question: Question = questions[current_index]
 
-    answer_id_str = callback.data.split(":")[1]
-    if not answer_id_str.isdigit():
-        await callback.message.answer("Некорректный ID ответа.")
-        return
-
-    answer_id = int(answer_id_str)
+    answer_id_str = str(callback_data.option_id)
     answers = user_data.get("answers", {})
 
     # Никаких запросов к БД здесь не делаем, просто обновляем answers в памяти
@@ -278,44 +316,44 @@ async def handle_answer(callback: types.CallbackQuery, state: FSMContext, sessio
 
     # Сохраняем только в памяти (FSM), без коммита в БД
     await state.update_data(answers=answers)
-    logger.debug(f"handle_answer: updated answers={answers}")
+    logger.debug("handle_answer: updated answers=%s", answers)
 
     logger.debug("Calling send_question from handle_answer")
     await send_question(callback.message, state)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("navigate:"))
+@callbacks(Navigate)
 @check_active_test
-async def navigate_question(callback: types.CallbackQuery, state: FSMContext):
+async def navigate_question(callback: types.CallbackQuery, state: FSMContext, callback_data: Navigate):
     await callback.answer()
     user_data = await state.get_data()
-    logger.debug(f"navigate_question: user_data={user_data}")
+    logger.debug("navigate_question: %s", state_fields(user_data))
 
-    action = callback.data.split(":")[1]
+    direction = callback_data.direction
     current_index = user_data["current_index"]
     questions: List[Question] = user_data["questions"]
 
-    if action == "next" and current_index < len(questions) - 1:
+    if direction == Direction.NEXT and current_index < len(questions) - 1:
         current_index += 1
-    elif action == "prev" and current_index > 0:
+    elif direction == Direction.PREV and current_index > 0:
         current_index -= 1
     else:
         await callback.message.answer("Невозможно выполнить это действие.")
         return
 
     await state.update_data(current_index=current_index)
-    logger.debug(f"navigate_question: current_index={current_index}, calling send_question")
+    logger.debug("navigate_question: current_index=%s, calling send_question", current_index)
     await send_question(callback.message, state)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("edit_answer:"))
+@callbacks(EditAnswer)
 @check_active_test
 async def edit_answer(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     await callback.answer()
     user_data = await state.get_data()
     current_index = user_data.get("current_index", 0)
     questions = user_data.get("questions", [])
-    logger.debug(f"edit_answer: user_data={user_data}")
+    logger.debug("edit_answer: %s", state_fields(user_data))
 
     if not questions or current_index >= len(questions):
         await callback.message.answer("Вопрос не найден.")
@@ -337,7 +375,7 @@ async def edit_answer(callback: types.CallbackQuery, state: FSMContext, session:
 @router.message(TestStates.EDITING)
 async def handle_text_edit(message: types.Message, state: FSMContext, session: AsyncSession):
     user_data = await state.get_data()
-    logger.debug(f"handle_text_edit: user_data={user_data}")
+    logger.debug("handle_text_edit: %s", state_fields(user_data))
 
     editing_question_id = user_data.get("editing_question_id")
 
@@ -349,7 +387,7 @@ async def handle_text_edit(message: types.Message, state: FSMContext, session: A
     new_answer = message.text.strip()
     answers[str(editing_question_id)] = new_answer
     await state.update_data(answers=answers)
-    logger.debug(f"handle_text_edit: new_answer={new_answer}, answers={answers}")
+    logger.debug("handle_text_edit: new_answer=%s, answers=%s", new_answer, answers)
 
     # Не делаем коммит в БД сейчас, только в конце теста
     await state.set_state(TestStates.TESTING)
@@ -359,26 +397,26 @@ async def handle_text_edit(message: types.Message, state: FSMContext, session: A
     try:
         await message.delete()
     except Exception as e:
-        logger.error(f"Ошибка при удалении сообщения пользователя: {e}")
+        logger.error("Ошибка при удалении сообщения пользователя: %s", e)
 
     logger.debug("Calling send_question from handle_text_edit")
     await send_question(message, state)
 
 
-@router.callback_query(lambda c: c.data == "finish_test")
+@callbacks(FinishTest)
 @check_active_test
 async def initiate_finish_test(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
     user_data = await state.get_data()
-    logger.debug(f"initiate_finish_test: user_data={user_data}")
+    logger.debug("initiate_finish_test: %s", state_fields(user_data))
 
     await state.set_state(TestStates.CONFIRM_FINISH.state)
     logger.debug("State changed to CONFIRM_FINISH in initiate_finish_test")
 
     confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Да", callback_data="confirm_finish_yes"),
-            InlineKeyboardButton(text="❌ Нет", callback_data="confirm_finish_no")
+            InlineKeyboardButton(text="✅ Да", callback_data=ConfirmFinishYes().pack()),
+            InlineKeyboardButton(text="❌ Нет", callback_data=ConfirmFinishNo().pack())
         ]
     ])
 
@@ -389,19 +427,19 @@ async def initiate_finish_test(callback: types.CallbackQuery, state: FSMContext)
     await state.update_data(confirmation_message_id=confirmation_msg.message_id)
 
 
-@router.callback_query(lambda c: c.data == "confirm_finish_yes")
+@callbacks(ConfirmFinishYes)
 @check_active_test
 async def confirm_finish_yes(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession, bot: Bot):
     await callback.answer()
     current_state = await state.get_state()
-    logger.debug(f"confirm_finish_yes: current_state={current_state}")
+    logger.debug("confirm_finish_yes: current_state=%s", current_state)
 
     if current_state != TestStates.CONFIRM_FINISH.state:
         await callback.message.answer("Ваше тестирование не активно.")
         return
 
     user_data = await state.get_data()
-    logger.debug(f"Confirm Finish Yes - user_data={user_data}")
+    logger.debug("Confirm Finish Yes - %s", state_fields(user_data))
 
     # Удаляем сообщение подтверждения
     confirmation_message_id = user_data.get("confirmation_message_id")
@@ -410,44 +448,28 @@ async def confirm_finish_yes(callback: types.CallbackQuery, state: FSMContext, s
             await bot.delete_message(chat_id=callback.message.chat.id, message_id=confirmation_message_id)
             logger.debug("Confirmation message deleted after confirm_finish_yes.")
         except Exception as e:
-            logger.error(f"Ошибка при удалении сообщения подтверждения: {e}")
+            logger.error("Ошибка при удалении сообщения подтверждения: %s", e)
 
     test_id = user_data.get("test_id")
     test_attempt_id = user_data.get("test_attempt_id")
-    answers = user_data.get("answers", {})
     questions = user_data.get("questions", [])
     user_id = callback.from_user.id
     end_time = current_time()
 
-    # При завершении теста записываем ответы один раз в БД
-    async with session.begin():
-        test_result = await session.execute(select(Test).where(Test.id == test_id))
-        test: Optional[Test] = test_result.scalars().first()
-        if not test:
-            await callback.message.answer("Тест не найден.")
-            return
-
-        user_result = await session.execute(select(User).where(User.user_id == user_id))
-        user: Optional[User] = user_result.scalars().first()
-        if not user:
-            await callback.message.answer("Пользователь не найден в системе.")
-            return
-
-        test_attempt_result = await session.execute(
-            select(TestAttempt).where(TestAttempt.id == test_attempt_id)
-        )
-        test_attempt: Optional[TestAttempt] = test_attempt_result.scalars().first()
-        if test_attempt:
-            test_attempt.answers = answers
-            score, passed, detailed_answers = calculate_score(test, answers, questions)
-            test_attempt.score = score
-            test_attempt.passed = passed
-            test_attempt.end_time = end_time
-            test_attempt.answers = detailed_answers
+    # Итог и ответы — одним условным запросом: второе нажатие «Да» или таймер,
+    # завершивший попытку раньше, ничего не запишут
+    result = await score_attempt(session, user_data)
+    if result is None:
+        await callback.message.answer("Тест не найден.")
+        return
+    if not await finalize_attempt(session, test_attempt_id, end_time, result, questions):
+        logger.debug("Attempt %s already finalized, confirm_finish_yes does nothing", test_attempt_id)
+        return
+    score, passed = result.score, result.passed
 
     # Завершили запись в БД
     msg_text = (f"Вы успешно завершили тест. Спасибо за участие!\n\n"
-                f"Баллы: {score}\n"
+                f"Баллы: {score} из {result.max_score}\n"
                 f"Статус: {'✅ Пройден' if passed else '❌ Не пройден'}")
     msg_text = escape_markdown_v2(msg_text)
     await callback.message.answer(
@@ -455,15 +477,16 @@ async def confirm_finish_yes(callback: types.CallbackQuery, state: FSMContext, s
         parse_mode='MarkdownV2'
     )
     logger.info(
-        f"User {user_id} finished test {test_id} with score={score}, passed={passed}.")
+        "User %s finished test %s with score=%s, passed=%s.", user_id, test_id, score, passed)
 
     await state.clear()
+    countdown.forget(callback.message.chat.id)
     logger.debug("State cleared after confirm_finish_yes")
 
     disabled_keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
-                text="✅ Завершить тест (недоступно)", callback_data="noop")
+                text="✅ Завершить тест (недоступно)", callback_data=NOOP)
         ]
     ])
 
@@ -471,9 +494,9 @@ async def confirm_finish_yes(callback: types.CallbackQuery, state: FSMContext, s
         await callback.message.edit_reply_markup(reply_markup=disabled_keyboard)
         logger.debug("Finish test buttons disabled successfully after confirm_finish_yes.")
     except TelegramBadRequest as e:
-        logger.error(f"Ошибка при редактировании кнопок после завершения теста: {e}")
+        logger.error("Ошибка при редактировании кнопок после завершения теста: %s", e)
 
-    main_menu = get_main_menu(user.username, True)
+    main_menu = get_main_menu(callback.from_user.username, True)
     menu_text = "Вы можете выбрать следующий тест или воспользоваться другими опциями."
     menu_text = escape_markdown_v2(menu_text)
     await callback.message.answer(
@@ -484,12 +507,12 @@ async def confirm_finish_yes(callback: types.CallbackQuery, state: FSMContext, s
     logger.debug("Main menu sent after finishing test manually.")
 
 
-@router.callback_query(lambda c: c.data == "confirm_finish_no")
+@callbacks(ConfirmFinishNo)
 @check_active_test
 async def confirm_finish_no(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
     user_data = await state.get_data()
-    logger.debug(f"confirm_finish_no: user_data={user_data}")
+    logger.debug("confirm_finish_no: %s", state_fields(user_data))
 
     confirmation_message_id = user_data.get("confirmation_message_id")
     if confirmation_message_id:
@@ -500,7 +523,7 @@ async def confirm_finish_no(callback: types.CallbackQuery, state: FSMContext):
             )
             logger.debug("Confirmation message deleted after confirm_finish_no.")
         except Exception as e:
-            logger.error(f"Ошибка при удалении сообщения подтверждения: {e}")
+            logger.error("Ошибка при удалении сообщения подтверждения: %s", e)
 
     await state.update_data(confirmation_message_id=None)
     await state.set_state(TestStates.TESTING.state)
@@ -510,20 +533,20 @@ async def confirm_finish_no(callback: types.CallbackQuery, state: FSMContext):
     await send_question(callback.message, state)
 
 
-@router.callback_query(lambda c: c.data == "noop")
+@callbacks(Noop)
 async def noop_handler(callback: types.CallbackQuery):
     await callback.answer()
     logger.debug("noop_handler called, doing nothing.")
 
 
-@router.callback_query(lambda c: c.data == "cancel_editing")
+@callbacks(CancelEditing)
 @check_active_test
 async def cancel_editing(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
     logger.debug("cancel_editing called")
 
     current_state = await state.get_state()
-    logger.debug(f"cancel_editing: current_state={current_state}")
+    logger.debug("cancel_editing: current_state=%s", current_state)
 
     if current_state != TestStates.EDITING.state:
         await callback.message.answer("Вы не в режиме редактирования.")
@@ -535,28 +558,21 @@ async def cancel_editing(callback: types.CallbackQuery, state: FSMContext):
     await send_question(callback.message, state)
 
 
-async def send_question(message: types.Message, state: FSMContext):
-    logger.debug("send_question called")
-    user_data = await state.get_data()
-    current_state = await state.get_state()
+def render_question(user_data: Dict[str, Any], current_state: Optional[str]
+                    ) -> Optional[Tuple[str, InlineKeyboardMarkup, str]]:
+    """Текст и клавиатура текущего вопроса и показанное в нём оставшееся время; None, если вопросов нет."""
     editing_question_id = user_data.get("editing_question_id")
-    logger.debug(f"send_question: user_data={user_data}, current_state={current_state}")
 
     questions = user_data.get("questions", [])
     current_index = user_data.get("current_index", 0)
     if not questions or current_index >= len(questions):
-        await message.answer("Вопросы отсутствуют.")
-        logger.debug("No questions to display in send_question")
-        return
+        return None
 
     current_question = questions[current_index]
     answers = user_data.get("answers", {})
 
     end_time = user_data.get("end_time")
-    now = current_time()
-    delta = end_time - now
-    minutes, seconds = divmod(int(delta.total_seconds()), 60)
-    time_left_str = f"{minutes} мин {seconds} сек"
+    time_left_str = format_time_left(end_time - current_time())
 
 
     question_number = f"{current_index + 1}/{len(questions)}"
@@ -583,12 +599,12 @@ async def send_question(message: types.Message, state: FSMContext):
         if editing_this_question:
             edit_button = InlineKeyboardButton(
                 text="❌ Отменить редактирование",
-                callback_data="cancel_editing"
+                callback_data=CancelEditing().pack()
             )
         else:
             edit_button = InlineKeyboardButton(
                 text="✏️ Редактировать ответ",
-                callback_data=f"edit_answer:{current_question.id}"
+                callback_data=EditAnswer(question_id=current_question.id).pack()
             )
         buttons.append([edit_button])
 
@@ -599,7 +615,8 @@ async def send_question(message: types.Message, state: FSMContext):
             question_lines.append("Выберите один или несколько вариантов ответа:\n")
 
         option_buttons = []
-        for idx, option in enumerate(current_question.options, start=1):
+        options = ordered_options(current_question, user_data.get("seed"), user_data.get("shuffle", False))
+        for idx, option in enumerate(options, start=1):
             if current_question.question_type == "single_choice":
                 is_selected = (str(option["id"]) == str(answers.get(str(current_question.id), "")))
             elif current_question.question_type == "multiple_choice":
@@ -615,26 +632,26 @@ async def send_question(message: types.Message, state: FSMContext):
             option_buttons.append(
                 InlineKeyboardButton(
                     text=button_text,
-                    callback_data=f"answer:{option['id']}"
+                    callback_data=AnswerOption(option_id=option['id']).pack()
                 )
             )
         buttons.append(option_buttons)
 
-    prev_callback = "noop" if editing_this_question else "navigate:prev"
-    next_callback = "noop" if editing_this_question else "navigate:next"
+    prev_callback = NOOP if editing_this_question else Navigate(direction=Direction.PREV).pack()
+    next_callback = NOOP if editing_this_question else Navigate(direction=Direction.NEXT).pack()
 
     navigation_buttons = []
     if current_index > 0:
         navigation_buttons.append(InlineKeyboardButton(
             text="⬅️ Назад", callback_data=prev_callback))
     navigation_buttons.append(InlineKeyboardButton(
-        text=f"{current_index + 1}/{len(questions)}", callback_data="noop"))
+        text=f"{current_index + 1}/{len(questions)}", callback_data=NOOP))
     if current_index < len(questions) - 1:
         navigation_buttons.append(InlineKeyboardButton(
             text="➡️ Вперед", callback_data=next_callback))
 
     navigation_buttons.append(InlineKeyboardButton(
-        text="✅ Завершить тест", callback_data="finish_test"))
+        text="✅ Завершить тест", callback_data=FinishTest().pack()))
 
     if navigation_buttons:
         buttons.append(navigation_buttons)
@@ -642,12 +659,27 @@ async def send_question(message: types.Message, state: FSMContext):
         question_lines.append("\nЧтобы завершить тест, нажмите на кнопку \"✅ Завершить тест\".")
 
     question_text = "\n".join(question_lines)
-    logger.debug(f"Raw question_text: {question_text}")
+    logger.debug("Raw question_text: %s", question_text)
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    return question_text, keyboard, time_left_str
+
+
+async def send_question(message: types.Message, state: FSMContext):
+    logger.debug("send_question called")
+    user_data = await state.get_data()
+    current_state = await state.get_state()
+    logger.debug("send_question: %s, current_state=%s", state_fields(user_data), current_state)
+
+    rendered = render_question(user_data, current_state)
+    if rendered is None:
+        await message.answer("Вопросы отсутствуют.")
+        logger.debug("No questions to display in send_question")
+        return
+    question_text, keyboard, time_left_str = rendered
 
     message_id = user_data.get("message_id")
-    logger.debug(f"send_question: message_id={message_id}, editing_mode={editing_mode}, editing_this_question={editing_this_question}")
+    logger.debug("send_question: message_id=%s, state=%s", message_id, current_state)
     try:
         if message_id:
             await message.bot.edit_message_text(
@@ -662,12 +694,58 @@ async def send_question(message: types.Message, state: FSMContext):
             await state.update_data(message_id=msg.message_id)
             logger.debug("New message sent in send_question, message_id updated")
     except TelegramBadRequest as e:
-        logger.error(f"Ошибка при редактировании/отправке сообщения: {e}")
+        logger.error("Ошибка при редактировании/отправке сообщения: %s", e)
         try:
             msg = await message.answer(question_text, reply_markup=keyboard)
             await state.update_data(message_id=msg.message_id)
             logger.debug("Sent new message without parse_mode after edit failure in send_question")
         except Exception as err:
-            logger.error(f"Даже без parse_mode ошибка: {err}")
+            logger.error("Даже без parse_mode ошибка: %s", err)
+    countdown.touch(message.chat.id, time_left_str)
+
+
+async def render_countdown(state: FSMContext):
+    """Сообщение с вопросом для CountdownTicker; None, если тест уже не проходится."""
+    current_state = await state.get_state()
+    if current_state not in (TestStates.TESTING.state, TestStates.EDITING.state, TestStates.CONFIRM_FINISH.state):
+        return None
+    user_data = await state.get_data()
+    rendered = render_question(user_data, current_state)
+    if rendered is None or not user_data.get("message_id"):
+        return None
+    question_text, keyboard, _ = rendered
+    return user_data["message_id"], question_text, keyboard
+
+
+countdown = CountdownTicker(render_countdown, COUNTDOWN_EDITS_PER_SECOND, COUNTDOWN_QUIET_SECONDS)
+
+
+def suspend_attempt(chat_id: int):
+    """Чат передан другому процессу бота: его таймеры здесь больше не нужны."""
+    task = attempt_timers.pop(chat_id, None)
+    if task is not None:
+        task.cancel()
+    countdown.forget(chat_id)
+
+
+async def resume_attempt(bot: Bot, state: FSMContext):
+    """Чат принят от другого процесса бота: если в нём идёт тест, запускаем его таймеры здесь."""
+    if await state.get_state() not in (TestStates.TESTING.state, TestStates.EDITING.state,
+                                       TestStates.CONFIRM_FINISH.state):
+        return
+    user_data = await state.get_data()
+    chat_id, user_id = state.key.chat_id, state.key.user_id
+    schedule_monitor(chat_id, user_id, user_data["test_attempt_id"], user_data["end_time"], bot, state)
+    countdown.track(chat_id, user_data["end_time"], state)
+
+
+@router.startup()
+async def start_countdown(bot: Bot):
+    countdown.start(bot)
+
+
+@router.shutdown()
+async def stop_countdown():
+    await countdown.stop()
 
 logger.debug("test_passing.py module loaded")
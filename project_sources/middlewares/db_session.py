@@ -1,25 +1,131 @@
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.methods import TelegramMethod
 from aiogram import types
-from typing import Any, Dict, Callable, Awaitable
+from contextvars import ContextVar
+from typing import Any, Dict, Callable, Awaitable, Optional
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 import logging
 
-class DbSessionMiddleware(BaseMiddleware):
+from utils.callback_router import handler_flag
+from utils.metrics import current_scope, db_sessions_total, db_early_releases_total
+from utils.replica import AsyncReplicaRouting
+from utils.session_writes import HAS_WRITES, WROTE
+
+logger = logging.getLogger(__name__)
+
+
+class LazySession:
+    """
+    Прокси AsyncSession для обработчика.
+
+    Сессия создаётся при первом обращении к ней, поэтому обработчики, которые
+    не ходят в БД (noop, navigate:, confirm_finish_no), её не открывают вовсе.
+    Соединение берётся из пула при первом запросе и может быть отдано обратно
+    до конца обработчика — см. release_if_idle.
+    """
+
+    __slots__ = ("_session_maker", "_session")
+
     def __init__(self, session_maker: async_sessionmaker):
+        self._session_maker = session_maker
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def used(self) -> bool:
+        return self._session is not None
+
+    @property
+    def wrote(self) -> bool:
+        return self._session is not None and self._session.info.get(WROTE, False)
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._session_maker()
+        return getattr(self._session, name)
+
+    async def release_if_idle(self) -> bool:
+        """
+        Завершает транзакцию, в которой были только чтения, чтобы вернуть соединение в пул.
+        Транзакции с несохранёнными или уже отправленными в БД изменениями не трогает.
+        """
+        session = self._session
+        if session is None or not session.in_transaction():
+            return False
+        if session.new or session.dirty or session.deleted or session.info.get(HAS_WRITES):
+            return False
+        # Откат сделал бы объекты устаревшими; commit при expire_on_commit=False их сохраняет
+        await session.commit()
+        return True
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+current_db_session: ContextVar[Optional[LazySession]] = ContextVar("current_db_session", default=None)
+
+
+def _endpoint() -> str:
+    scope = current_scope.get()
+    return scope.endpoint if scope else "unknown"
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Передаёт обработчику LazySession. Обработчики с флагом @flags.replica читают
+    с реплики, если она настроена и не отстаёт; пользователь, чей апдейт что-то
+    записал, после этого какое-то время читает только с основной базы.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker,
+                 replica_session_maker: Optional[async_sessionmaker] = None,
+                 replica_routing: Optional[AsyncReplicaRouting] = None):
         self.session_maker = session_maker
+        self.replica_session_maker = replica_session_maker
+        self.replica_routing = replica_routing
         super().__init__()
 
+    async def _choose_session_maker(self, data: Dict[str, Any], user: Optional[types.User]) -> async_sessionmaker:
+        if self.replica_routing is None or not handler_flag(data, "replica"):
+            return self.session_maker
+        pinned = user is not None and self.replica_routing.is_pinned(user.id)
+        if await self.replica_routing.use_replica(pinned):
+            return self.replica_session_maker
+        return self.session_maker
+
     async def __call__(
             self,
             handler: Callable[[types.Update, Dict[str, Any]], Awaitable[Any]],
             event: types.Update,
             data: Dict[str, Any],
     ) -> Any:
+        user: Optional[types.User] = data.get("event_from_user")
+        session = LazySession(await self._choose_session_maker(data, user))
+        token = current_db_session.set(session)
         try:
-            async with self.session_maker() as session:
-                data["session"] = session
-                return await handler(event, data)
+            data["session"] = session
+            return await handler(event, data)
         except Exception as e:
-            logger = logging.getLogger(__name__)
-            logger.error(f"Ошибка в Middleware DbSessionMiddleware: {e}")
+            logger.error("Ошибка в Middleware DbSessionMiddleware: %s", e)
             raise
+        finally:
+            current_db_session.reset(token)
+            db_sessions_total.inc(endpoint=_endpoint(), used=str(session.used).lower())
+            if self.replica_routing is not None and user is not None and session.wrote:
+                self.replica_routing.pin(user.id)
+            await session.close()
+
+
+class ReleaseIdleDbSessionMiddleware(BaseRequestMiddleware):
+    """
+    Перед запросом к Telegram API отдаёт в пул соединение текущего обработчика,
+    если его транзакция только читала: иначе соединение простаивает всё время
+    сетевого запроса.
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method: TelegramMethod):
+        session = current_db_session.get()
+        if session is not None and await session.release_if_idle():
+            db_early_releases_total.inc(endpoint=_endpoint())
+        return await make_request(bot, method)
@@ -0,0 +1,77 @@
+import logging
+import time
+from typing import Any, Dict, Callable, Awaitable
+
+from aiogram import types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.methods import TelegramMethod
+
+from utils.metrics import (
+    begin_scope, end_scope, record_api_call,
+    update_latency_seconds, update_db_seconds, update_api_seconds,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Имя обработчика апдейта; для callback-запросов — обработчик, выбранный CallbackIndex."""
+    callback_route = data.get("callback_route")
+    if callback_route is not None:
+        return callback_route.name
+    handler_object = data.get("handler")
+    return handler_object.callback.__name__ if handler_object else "unknown"
+
+
+def update_route(event: types.TelegramObject, endpoint: str) -> str:
+    """Ключ гистограмм: префикс callback-данных ("answer:", "navigate:") или имя обработчика сообщения."""
+    if isinstance(event, types.CallbackQuery) and event.data:
+        prefix, separator, _ = event.data.partition(":")
+        return prefix + separator
+    return endpoint
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Замеряет обработку апдейта: полное время, время SQL и время запросов к Telegram API.
+    Апдейты дольше slow_update_threshold (в секундах) пишутся в журнал с раскладкой по запросам;
+    при перегрузке их много, поэтому в журнал попадает один из slow_update_log_every.
+    """
+
+    def __init__(self, repeat_threshold: int, slow_update_threshold: float, slow_update_log_every: int = 1):
+        self.repeat_threshold = repeat_threshold
+        self.slow_update_threshold = slow_update_threshold
+        self.slow_update_log_every = slow_update_log_every
+        super().__init__()
+
+    async def __call__(
+            self,
+            handler: Callable[[types.Update, Dict[str, Any]], Awaitable[Any]],
+            event: types.Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        endpoint = handler_name(data)
+        route = update_route(event, endpoint)
+        token = begin_scope(endpoint, self.repeat_threshold, route)
+        try:
+            return await handler(event, data)
+        finally:
+            scope = end_scope(token)
+            update_latency_seconds.observe(scope.elapsed, route=route)
+            update_db_seconds.observe(scope.db_time, route=route)
+            update_api_seconds.observe(scope.api_time, route=route)
+            if scope.elapsed > self.slow_update_threshold:
+                logger.warning("Медленный апдейт %s", scope,
+                               extra={"sample_every": self.slow_update_log_every})
+
+
+class ApiTimingRequestMiddleware(BaseRequestMiddleware):
+    """Учитывает время запросов бота к Telegram API в апдейте, из которого они сделаны."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method: TelegramMethod):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record_api_call(type(method).__name__, started, time.perf_counter() - started)
@@ -0,0 +1,18 @@
+#!/bin/bash
+# Потоковая реплика сервиса postgres: при первом запуске копирует базу
+# через pg_basebackup (-R пишет standby.signal и primary_conninfo), затем
+# запускает postgres в режиме горячего резерва
+set -e
+
+PGDATA=/var/lib/postgresql/data
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_basebackup -h postgres -U "$POSTGRES_USER" -D "$PGDATA" -R -X stream -P; do
+        echo "Основная база ещё недоступна, повтор через 2 с"
+        rm -rf "${PGDATA:?}"/*
+        sleep 2
+    done
+    chmod 700 "$PGDATA"
+fi
+
+exec postgres -c hot_standby=on
@@ -3,6 +3,7 @@ function validateForm(event) {
     const description = document.querySelector('textarea[name="description"]').value.trim();
     const groupCheckboxes = document.querySelectorAll('input[name="groups"]:checked');
     const questionCount = document.querySelector('input[name="question_count"]').value;
+    const poolSize = document.querySelector('input[name="pool_size"]').value;
     const scoresToPass = document.querySelector('input[name="scores_need_to_pass"]').value;
     const expiryDate = document.querySelector('input[name="expiry_date"]').value;
     const number_of_attempts = document.querySelector('input[name="number_of_attempts"]').value;
@@ -28,6 +29,13 @@ function validateForm(event) {
         return false;
     }
 
+    // Проверка размера банка вопросов
+    if (poolSize && parseInt(poolSize) < parseInt(questionCount)) {
+        alert('В банке не может быть меньше вопросов, чем в попытке.');
+        event.preventDefault();
+        return false;
+    }
+
     // Проверка даты окончания
     if (expiryDate) {
         const now = new Date();
@@ -0,0 +1,57 @@
+"""
+Перенос попыток закрытых тестов в архив (utils.attempt_archive).
+
+Тест закрыт, если его expiry_date раньше --closed-before (по умолчанию —
+ARCHIVE_AFTER назад). Каждый тест переносится в своей транзакции; админка
+показывает результаты такого теста из архива. Месячные секции архива, к которым
+уже не обращаются, можно отсоединить (ALTER TABLE ... DETACH PARTITION),
+выгрузить сжатым pg_dump -Fc и удалить.
+
+Запуск из корня проекта (например, раз в сутки по cron):
+    python -m tools.archive_attempts
+    python -m tools.archive_attempts --closed-before 2026-02-01 --dry-run
+    python -m tools.archive_attempts --test-id 12
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import tools.config as config
+from utils.attempt_archive import ARCHIVE_AFTER, archive_test, closed_tests, current_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=config.DATABASE_URL)
+    parser.add_argument("--closed-before", type=datetime.fromisoformat,
+                        help="Переносить тесты с expiry_date раньше этой даты (ГГГГ-ММ-ДД)")
+    parser.add_argument("--test-id", type=int, help="Перенести только этот тест")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать тесты, ничего не перенося")
+    args = parser.parse_args()
+
+    now = current_time()
+    closed_before = min(args.closed_before or now - ARCHIVE_AFTER, now)
+    engine = create_engine(args.database_url.replace("+asyncpg", ""))
+    db_session_maker = sessionmaker(bind=engine)
+    with db_session_maker() as db_session:
+        test_ids = [args.test_id] if args.test_id else closed_tests(db_session, closed_before)
+    print(f"Тестов к переносу: {len(test_ids)} (закрыты раньше {closed_before:%Y-%m-%d %H:%M})")
+
+    for test_id in test_ids:
+        if args.dry_run:
+            print(f"Тест {test_id}")
+            continue
+        with db_session_maker() as db_session:
+            moved = archive_test(db_session, test_id, now)
+            if moved is None:
+                print(f"Тест {test_id}: не перенесён — ещё открыт, уже в архиве или по нему идёт попытка")
+                continue
+            db_session.commit()
+        print(f"Тест {test_id}: перенесено попыток {moved[0]}, ответов {moved[1]}")
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
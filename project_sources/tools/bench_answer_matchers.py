@@ -0,0 +1,51 @@
+"""
+Замер проверки ответов на текстовые вопросы: собранная заранее проверка
+(compile_matcher, как в calculate_score и пересчёте попыток) против разбора
+строки ответа заново для каждого ответа.
+
+Запуск из корня проекта: python -m tools.bench_answer_matchers [ответов] [вопросов]
+"""
+import random
+import sys
+import time
+
+from utils.answer_matchers import compile_matcher
+
+SPECS = [
+    "Москва\nстолица России",
+    "re:(пётр|петр)\\s*(i|1|первый)",
+    "num: 3.14 ± 0.01",
+    "num: 100 ± 5%\nсто",
+    "фотосинтез\nфото-синтез\nre:фотосинтез\\w*",
+]
+ANSWERS = ["москва", " Столица  россии ", "Пётр I", "петр первый", "3,141", "3.2", "104", "сто", "Фотосинтеза",
+           "не знаю", "1 000", "ёжик"]
+
+
+def main():
+    answers = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    questions = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = random.Random(0)
+    # Разные вопросы — разные строки ответа, как у банка вопросов теста
+    specs = [f"{rng.choice(SPECS)}\nвариант {i}" for i in range(questions)]
+    workload = [(rng.choice(specs), rng.choice(ANSWERS)) for _ in range(answers)]
+
+    compile_matcher.cache_clear()
+    started = time.perf_counter()
+    compiled = sum(compile_matcher(spec)(answer) for spec, answer in workload)
+    compiled_time = time.perf_counter() - started
+
+    interpret = compile_matcher.__wrapped__
+    sample = workload[:max(1, answers // 20)]
+    started = time.perf_counter()
+    interpreted = sum(interpret(spec)(answer) for spec, answer in sample)
+    interpreted_time = (time.perf_counter() - started) * len(workload) / len(sample)
+
+    print(f"{answers} ответов на {questions} вопросов, верных: {compiled}")
+    print(f"С кэшем проверок: {compiled_time * 1000:.0f} мс — {answers / compiled_time:,.0f} ответов/с")
+    print(f"Разбор на каждый ответ: {interpreted_time * 1000:.0f} мс — {answers / interpreted_time:,.0f} ответов/с "
+          f"(оценка по {len(sample)} ответам, верных {interpreted})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Сравнение маршрутизации callback-запросов: цепочка lambda-фильтров против CallbackIndex.
+
+Обработчики пустые, поэтому замеряется только проход апдейта через Dispatcher:
+middleware aiogram, FSM и выбор обработчика. Набор обработчиков повторяет
+три роутера бота; --scale добавляет столько же копий с другими префиксами,
+подключённые перед роутерами бота, чтобы показать рост цены цепочки
+фильтров с числом обработчиков.
+
+Запуск из корня проекта: python -m tools.bench_callback_routing [--updates N] [--scale K]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import StateFilter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from tools import callbacks as cb
+from tools.states import TestStates
+from utils.callback_router import CallbackIndex
+
+USER_ID = 1
+
+# (класс данных, состояние фильтра) по роутерам в порядке подключения в register_handlers
+TEST_PASSING = [
+    (cb.SelectTest, None), (cb.AnswerOption, None), (cb.Navigate, None), (cb.EditAnswer, None),
+    (cb.FinishTest, None), (cb.ConfirmFinishYes, None), (cb.ConfirmFinishNo, None),
+    (cb.Noop, None), (cb.CancelEditing, None),
+]
+RESULTS_VIEW = [
+    (cb.TestsPage, TestStates.VIEWING_TESTS), (cb.ViewResultsTest, TestStates.VIEWING_TESTS),
+    (cb.AttemptsPage, TestStates.VIEWING_ATTEMPTS), (cb.ViewAttempt, TestStates.VIEWING_ATTEMPTS),
+    (cb.AttemptNav, TestStates.VIEWING_ATTEMPT_DETAILS), (cb.BackToAttempts, TestStates.VIEWING_ATTEMPT_DETAILS),
+    (cb.BackToTestsMenu, TestStates.VIEWING_ATTEMPTS), (cb.BackToMainMenu, None), (cb.Noop, None),
+]
+
+# Доли callback-данных во время прохождения теста (по нагрузочному прогону tools.load_test)
+TRAFFIC = [("answer:3", 50), ("navigate:next", 30), ("navigate:prev", 5), ("noop", 5),
+           ("finish_test", 4), ("confirm_finish_no", 3), ("back_to_main_menu", 3)]
+
+
+async def noop_handler(callback: CallbackQuery):
+    pass
+
+
+def extra_prefixes(scale: int):
+    """Дополнительные обработчики с уникальными префиксами, чтобы увеличить цепочку."""
+    routers = []
+    for copy in range(scale - 1):
+        routes = []
+        for payload, state in TEST_PASSING + RESULTS_VIEW:
+            name = f"x{copy}_{payload.__prefix__}"
+            routes.append((type(name, (CallbackData,), {"__annotations__": dict(payload.__annotations__)},
+                                prefix=name), state))
+        routers.append(routes)
+    return routers
+
+
+def filter_chain_dispatcher(layout) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    for routes in layout:
+        router = Router()
+        for payload, state in routes:
+            prefix = payload.__prefix__
+            if payload.model_fields:
+                data_filter = (lambda p: lambda c: c.data and c.data.startswith(p + ":"))(prefix)
+            else:
+                data_filter = (lambda p: lambda c: c.data == p)(prefix)
+            filters = (StateFilter(state), data_filter) if state else (data_filter,)
+            router.callback_query.register(noop_handler, *filters)
+        dp.include_router(router)
+    return dp
+
+
+def indexed_dispatcher(layout) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    for routes in layout:
+        router = Router()
+        callbacks = CallbackIndex(router)
+        for payload, state in routes:
+            callbacks(payload, *([state] if state else []))(noop_handler)
+        dp.include_router(router)
+    return dp
+
+
+def make_update(update_id: int, data: str) -> Update:
+    user = User(id=USER_ID, is_bot=False, first_name="Студент")
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=USER_ID, type="private"), text="Вопрос")
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance="bench", message=message, data=data))
+
+
+async def measure(dp: Dispatcher, bot: Bot, updates) -> float:
+    key = StorageKey(bot_id=bot.id, chat_id=USER_ID, user_id=USER_ID)
+    await dp.storage.set_state(key, TestStates.TESTING)
+    for update in updates[:200]:  # Прогрев
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=5_000)
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    datas = rng.choices([data for data, _ in TRAFFIC], weights=[w for _, w in TRAFFIC], k=args.updates)
+    updates = [make_update(i, data) for i, data in enumerate(datas)]
+    bot = Bot(token="42:BENCH")
+
+    print(f"{'обработчиков':>12}{'фильтры, мкс':>16}{'индекс, мкс':>16}{'ускорение':>12}")
+    for scale in args.scale:
+        layout = extra_prefixes(scale) + [TEST_PASSING, RESULTS_VIEW]
+        handlers = sum(len(routes) for routes in layout)
+        chain = await measure(filter_chain_dispatcher(layout), bot, updates)
+        indexed = await measure(indexed_dispatcher(layout), bot, updates)
+        print(f"{handlers:>12}{chain * 1e6:>16.1f}{indexed * 1e6:>16.1f}{chain / indexed:>11.1f}x")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
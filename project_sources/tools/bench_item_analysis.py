@@ -0,0 +1,54 @@
+"""
+Замер времени расчёта статистики вопросов на синтетических данных.
+
+Запуск из корня проекта: python -m tools.bench_item_analysis [попыток] [вопросов]
+"""
+import sys
+import time
+
+import numpy as np
+
+from utils.item_analysis import ItemAnalysis
+
+
+def synthetic_answers(attempts: int, questions: int, options: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    ability = rng.normal(size=attempts)
+    difficulty = rng.normal(size=questions)
+
+    attempt_ids = np.repeat(np.arange(1, attempts + 1), questions)
+    question_ids = np.tile(np.arange(1, questions + 1), attempts)
+    p_correct = 1 / (1 + np.exp(-(ability[:, None] - difficulty[None, :])))
+    correct = (rng.random((attempts, questions)) < p_correct).astype(np.int64).ravel()
+    option_masks = 1 << rng.integers(0, options, size=attempts * questions)
+    return attempt_ids, question_ids, option_masks, correct
+
+
+def main():
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    questions = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    options = 4
+    columns = synthetic_answers(attempts, questions, options)
+
+    analysis = ItemAnalysis(range(1, questions + 1), options)
+    started = time.perf_counter()
+    analysis.update(*columns)
+    stats = analysis.stats()
+    full = time.perf_counter() - started
+
+    # Инкрементальное обновление: ещё 1% попыток поверх накопленной статистики
+    extra = synthetic_answers(attempts // 100, questions, options, seed=1)
+    started = time.perf_counter()
+    analysis.update(extra[0] + attempts, *extra[1:])
+    analysis.stats()
+    incremental = time.perf_counter() - started
+
+    print(f"{attempts} попыток × {questions} вопросов ({attempts * questions} ответов)")
+    print(f"Полный расчёт: {full * 1000:.1f} мс")
+    print(f"Добавление {attempts // 100} попыток: {incremental * 1000:.1f} мс")
+    print(f"Пример: вопрос {stats[0].question_id}, решаемость {stats[0].difficulty:.2f}, "
+          f"дискриминативность {stats[0].discrimination:.2f}")
+
+
+if __name__ == '__main__':
+    main()
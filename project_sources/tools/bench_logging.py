@@ -0,0 +1,107 @@
+"""
+Замер стоимости журналирования на один апдейт «answer:» до и после перевода на ленивые записи.
+
+Повторяет записи, которые делают check_active_test, handle_answer и send_question
+при выборе варианта ответа; вывод идёт в /dev/null.
+
+Запуск из корня проекта: python -m tools.bench_logging [апдейтов] [вопросов]
+"""
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from tools.models import Question
+from utils.logging_config import LOG_FORMAT, create_queue_handler, state_fields
+
+
+def make_user_data(questions: int):
+    return {
+        "test_id": 1,
+        "test_attempt_id": 1,
+        "questions": [
+            Question(id=i, test_id=1, question_text=f"Вопрос {i}", question_type="single_choice",
+                     options=["Первый", "Второй", "Третий", "Четвёртый"], right_answer="1")
+            for i in range(1, questions + 1)
+        ],
+        "current_index": 0,
+        "start_time": datetime.now(),
+        "end_time": datetime.now(),
+        "answers": {str(i): "1" for i in range(1, questions + 1)},
+        "message_id": 1,
+    }
+
+
+def eager_update(logger: logging.Logger, user_data):
+    """Записи апдейта в прежнем виде: f-строки с полным FSM-словарём."""
+    current_state = "TestStates:TESTING"
+    answers = user_data["answers"]
+    question_text = user_data["questions"][0].question_text
+    logger.debug(f"check_active_test: user_data={user_data}, current_state={current_state}")
+    logger.debug(f"handle_answer: user_data={user_data}")
+    logger.debug(f"handle_answer: updated answers={answers}")
+    logger.debug("Calling send_question from handle_answer")
+    logger.debug("send_question called")
+    logger.debug(f"send_question: user_data={user_data}, current_state={current_state}")
+    logger.debug(f"Raw question_text: {question_text}")
+    logger.debug(f"send_question: message_id={1}, editing_mode={False}, editing_this_question={False}")
+    logger.debug("Message edited successfully in send_question")
+
+
+def lazy_update(logger: logging.Logger, user_data):
+    """Те же записи с отложенным форматированием и сводкой FSM-данных."""
+    current_state = "TestStates:TESTING"
+    answers = user_data["answers"]
+    question_text = user_data["questions"][0].question_text
+    logger.debug("check_active_test: %s, current_state=%s", state_fields(user_data), current_state)
+    logger.debug("handle_answer: %s", state_fields(user_data))
+    logger.debug("handle_answer: updated answers=%s", answers)
+    logger.debug("Calling send_question from handle_answer")
+    logger.debug("send_question called")
+    logger.debug("send_question: %s, current_state=%s", state_fields(user_data), current_state)
+    logger.debug("Raw question_text: %s", question_text)
+    logger.debug("send_question: message_id=%s, editing_mode=%s, editing_this_question=%s", 1, False, False)
+    logger.debug("Message edited successfully in send_question")
+
+
+def measure(name: str, update, logger: logging.Logger, user_data, updates: int):
+    started = time.perf_counter()
+    for _ in range(updates):
+        update(logger, user_data)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<48}{elapsed / updates * 1e6:>10.1f} мкс/апдейт")
+
+
+def isolated_logger(name: str, level: int, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"bench_logging.{name}")
+    logger.propagate = False
+    logger.setLevel(level)
+    logger.handlers[:] = [handler]
+    return logger
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    questions = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    user_data = make_user_data(questions)
+
+    with open(os.devnull, "w") as devnull:
+        stream_handler = logging.StreamHandler(devnull)
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        before = isolated_logger("before", logging.DEBUG, stream_handler)
+
+        queue_handler, listener = create_queue_handler(devnull)
+        listener.start()
+        after_info = isolated_logger("after_info", logging.INFO, queue_handler)
+        after_debug = isolated_logger("after_debug", logging.DEBUG, queue_handler)
+
+        print(f"{updates} апдейтов, {questions} вопросов в FSM")
+        measure("до: DEBUG, f-строки, StreamHandler в потоке бота", eager_update, before, user_data, updates)
+        measure("после: INFO, ленивые аргументы", lazy_update, after_info, user_data, updates)
+        measure("после: DEBUG, ленивые аргументы, очередь", lazy_update, after_debug, user_data, updates)
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Замер подсчёта баллов попытки: прежний calculate_score, разбиравший right_answer
+каждого вопроса при каждом вызове, против ScoringPlan, собранного один раз на
+версию теста.
+
+Запуск из корня проекта: python -m tools.bench_scoring [попыток] [вопросов]
+"""
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from tools.models import Question
+from utils.scoring_plan import ScoringPlan
+
+
+def legacy_calculate_score(test, user_answers, questions):
+    """calculate_score до ScoringPlan (без изменений): вес 1, разбор right_answer на каждый вызов."""
+    total_score = 0
+    total_possible_score = 0
+    detailed_answers = {}
+
+    for question in questions:
+        question_id_str = str(question.id)
+        user_answer = user_answers.get(question_id_str)
+        is_correct = False
+        question_score = 1
+
+        if user_answer is not None:
+            if question.question_type == 'single_choice':
+                correct_option_ids = list(question.right_answer)
+                is_correct = str(user_answer) == question.right_answer
+            elif question.question_type == 'multiple_choice':
+                correct_option_ids = list(question.right_answer)
+                user_answer_ids = list(str(user_answer))
+                is_correct = set(user_answer_ids) == set(correct_option_ids)
+            elif question.question_type == 'text_input':
+                correct_answer = question.right_answer.strip().lower() if question.right_answer else ""
+                user_input = user_answer.strip().lower()
+                is_correct = user_input == correct_answer
+            if is_correct:
+                total_score += question_score
+            total_possible_score += question_score
+            detailed_answers[question_id_str] = {'user_answer': user_answer, 'correct': is_correct}
+        else:
+            detailed_answers[question_id_str] = {'user_answer': None, 'correct': False}
+            total_possible_score += question_score
+
+    return total_score, total_score >= test.scores_need_to_pass, detailed_answers
+
+
+def make_questions(count: int):
+    questions = []
+    for i in range(1, count + 1):
+        kind = ('single_choice', 'multiple_choice', 'text_input')[i % 3]
+        right_answer = {'single_choice': '2', 'multiple_choice': '13', 'text_input': 'фотосинтез'}[kind]
+        questions.append(Question(id=i, question_type=kind, right_answer=right_answer, weight=1,
+                                  partial_credit=False))
+    return questions
+
+
+def make_answers(questions, attempts: int, rng: random.Random):
+    choices = {'single_choice': ['1', '2', '3'], 'multiple_choice': ['13', '1', '123'],
+               'text_input': ['Фотосинтез ', 'хемосинтез']}
+    return [{str(q.id): rng.choice(choices[q.question_type]) for q in questions if rng.random() < 0.9}
+            for _ in range(attempts)]
+
+
+def main():
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    question_count = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    test = SimpleNamespace(id=1, version=1, scores_need_to_pass=question_count // 2)
+    questions = make_questions(question_count)
+    answers = make_answers(questions, attempts, random.Random(0))
+
+    started = time.perf_counter()
+    legacy = [legacy_calculate_score(test, attempt, questions) for attempt in answers]
+    legacy_time = time.perf_counter() - started
+
+    plan = ScoringPlan(questions)
+    started = time.perf_counter()
+    planned = [plan.score(test, attempt, questions) for attempt in answers]
+    plan_time = time.perf_counter() - started
+
+    mismatches = sum(old[0] != new.score or old[1] != new.passed for old, new in zip(legacy, planned))
+    print(f"{attempts} попыток × {question_count} вопросов, расхождений с прежним подсчётом: {mismatches}")
+    print(f"Прежний calculate_score: {legacy_time * 1e6 / attempts:.1f} мкс на попытку")
+    print(f"ScoringPlan.score:       {plan_time * 1e6 / attempts:.1f} мкс на попытку")
+
+
+if __name__ == '__main__':
+    main()
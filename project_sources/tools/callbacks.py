@@ -0,0 +1,85 @@
+from enum import Enum
+
+from aiogram.filters.callback_data import CallbackData
+
+
+# Прохождение теста
+
+class SelectTest(CallbackData, prefix="select_test"):
+    test_id: int
+
+
+class AnswerOption(CallbackData, prefix="answer"):
+    option_id: int
+
+
+class Direction(str, Enum):
+    PREV = "prev"
+    NEXT = "next"
+
+
+class Navigate(CallbackData, prefix="navigate"):
+    direction: Direction
+
+
+class EditAnswer(CallbackData, prefix="edit_answer"):
+    question_id: int
+
+
+class CancelEditing(CallbackData, prefix="cancel_editing"):
+    pass
+
+
+class FinishTest(CallbackData, prefix="finish_test"):
+    pass
+
+
+class ConfirmFinishYes(CallbackData, prefix="confirm_finish_yes"):
+    pass
+
+
+class ConfirmFinishNo(CallbackData, prefix="confirm_finish_no"):
+    pass
+
+
+class Noop(CallbackData, prefix="noop"):
+    pass
+
+
+# Просмотр результатов
+
+class TestsPage(CallbackData, prefix="tests_page"):
+    page: int
+
+
+class ViewResultsTest(CallbackData, prefix="view_results_test"):
+    test_id: int
+
+
+class AttemptsPage(CallbackData, prefix="attempts_page"):
+    test_id: int
+    page: int
+
+
+class ViewAttempt(CallbackData, prefix="view_attempt"):
+    attempt_id: int
+
+
+class AttemptNav(CallbackData, prefix="attempt_nav"):
+    attempt_id: int
+    question_index: int
+
+
+class BackToAttempts(CallbackData, prefix="back_to_attempts"):
+    pass
+
+
+class BackToTestsMenu(CallbackData, prefix="back_to_tests_menu"):
+    pass
+
+
+class BackToMainMenu(CallbackData, prefix="back_to_main_menu"):
+    pass
+
+
+NOOP = Noop().pack()
@@ -1,10 +1,61 @@
 
 from dotenv import load_dotenv
 import os
+import socket
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
-ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
\ No newline at end of file
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
+# Порт HTTP-эндпоинта /metrics бота
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", 9100))
+# Порог детектора N+1: сколько одинаковых запросов допустимо за один апдейт или HTTP-запрос
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 5))
+# Апдейты бота дольше этого времени (мс) пишутся в журнал с раскладкой по SQL и Telegram API
+SLOW_UPDATE_THRESHOLD_MS = int(os.getenv("SLOW_UPDATE_THRESHOLD_MS", 1000))
+# Уровень журнала бота и прореживание частых записей (в журнал попадает одна из LOG_SAMPLE_EVERY)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 10))
+# Реплика для чтения (необязательно): URL в том же формате, что DATABASE_URL
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+# Реплика с отставанием больше этого (с) не используется; как часто проверять отставание (с)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", 2))
+# Сколько секунд после записи пользователь читает с основной базы
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 30))
+# Сколько попыток теста создаются одновременно; остальные студенты ждут в очереди с номером позиции
+START_TEST_CONCURRENCY = int(os.getenv("START_TEST_CONCURRENCY", 8))
+START_TEST_QUEUE_LIMIT = int(os.getenv("START_TEST_QUEUE_LIMIT", 500))
+START_TEST_QUEUE_TIMEOUT_SECONDS = float(os.getenv("START_TEST_QUEUE_TIMEOUT_SECONDS", 60))
+# Как часто (с) обновлять сообщение с позицией в очереди
+QUEUE_POSITION_UPDATE_SECONDS = float(os.getenv("QUEUE_POSITION_UPDATE_SECONDS", 3))
+# Сколько (с) допущенный запрос ждёт свободного соединения, прежде чем получить отказ «сервис занят»
+START_TEST_POOL_WAIT_SECONDS = float(os.getenv("START_TEST_POOL_WAIT_SECONDS", 2))
+# Обновление оставшегося времени в вопросах: не больше правок в секунду на весь бот
+# и не раньше, чем через столько секунд после последней правки сообщения
+COUNTDOWN_EDITS_PER_SECOND = float(os.getenv("COUNTDOWN_EDITS_PER_SECOND", 10))
+COUNTDOWN_QUIET_SECONDS = float(os.getenv("COUNTDOWN_QUIET_SECONDS", 10))
+# Состояние FSM в памяти: чат без попытки удаляется после стольких секунд простоя,
+# чат с попыткой — через FSM_ACTIVE_GRACE_SECONDS после её окончания; сверх FSM_MAX_CHATS
+# удаляются давно не активные чаты без попытки (0 — без лимита). Проверка раз в FSM_SWEEP_SECONDS
+FSM_IDLE_TTL_SECONDS = float(os.getenv("FSM_IDLE_TTL_SECONDS", 6 * 3600))
+FSM_ACTIVE_GRACE_SECONDS = float(os.getenv("FSM_ACTIVE_GRACE_SECONDS", 600))
+FSM_MAX_CHATS = int(os.getenv("FSM_MAX_CHATS", 50000))
+FSM_SWEEP_SECONDS = float(os.getenv("FSM_SWEEP_SECONDS", 60))
+# Режим запуска bot.py: polling — один процесс; worker — рабочий процесс за front.py (шардирование по чатам)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WORKER_NAME = os.getenv("WORKER_NAME") or socket.gethostname()
+WORKER_PORT = int(os.getenv("WORKER_PORT", 8081))
+WORKER_URL = os.getenv("WORKER_URL") or f"http://{WORKER_NAME}:{WORKER_PORT}"
+# Как часто рабочий процесс отмечается в bot_workers; без отметки дольше WORKER_TIMEOUT_SECONDS он считается упавшим
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", 5))
+WORKER_TIMEOUT_SECONDS = float(os.getenv("WORKER_TIMEOUT_SECONDS", 20))
+# Приёмник вебхука front.py: порт, публичный адрес (для setWebhook), путь и секрет
+FRONT_PORT = int(os.getenv("FRONT_PORT", 8080))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Как часто front.py перечитывает состав рабочих процессов
+FRONT_REFRESH_SECONDS = float(os.getenv("FRONT_REFRESH_SECONDS", 2))
@@ -0,0 +1,36 @@
+"""
+Сборка мусора версий тестов (utils.test_versions.collect_garbage): удаляет
+прежние версии и заменённые вопросы, на которые больше не ссылается ни одна попытка.
+
+Запуск из корня проекта (например, раз в сутки по cron):
+    python -m tools.gc_test_versions
+    python -m tools.gc_test_versions --dry-run
+"""
+import argparse
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import tools.config as config
+from utils.test_versions import collect_garbage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=config.DATABASE_URL)
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не удаляя")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url.replace("+asyncpg", ""))
+    with sessionmaker(bind=engine)() as db_session:
+        versions, questions = collect_garbage(db_session)
+        if args.dry_run:
+            db_session.rollback()
+        else:
+            db_session.commit()
+    print(f"{'Можно удалить' if args.dry_run else 'Удалено'}: версий тестов {versions}, вопросов {questions}")
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
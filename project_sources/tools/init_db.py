@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from models import Base, User, Test, Question, TestAttempt
 import config
@@ -6,6 +6,177 @@ import config
 engine = create_engine(config.DATABASE_URL.replace("+asyncpg", ''))
 Base.metadata.create_all(engine)
 
+
+def migrate_groups_with_access(connection):
+    """
+    Переносит строку tests.groups_with_access ("Б121, Б122") в таблицу test_groups
+    и удаляет старый столбец.
+
+    Тест без записей в test_groups доступен всем, а непустая строка давала доступ
+    только названным группам, даже если таких групп ещё нет. Поэтому недостающие
+    группы создаются (как при регистрации студента в новой группе), а тесты, в
+    строке которых нет ни одного имени группы, останавливают миграцию: их доступ
+    надо исправить вручную, иначе они станут открыты всем.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('tests')}
+    if 'groups_with_access' not in columns:
+        return
+
+    unnamed = connection.execute(text("""
+        SELECT t.id, t.groups_with_access
+        FROM tests t
+        WHERE btrim(t.groups_with_access) <> ''
+          AND NOT EXISTS (SELECT 1 FROM unnest(string_to_array(t.groups_with_access, ',')) AS name
+                          WHERE btrim(name) <> '')
+        ORDER BY t.id
+    """)).all()
+    if unnamed:
+        listed = ", ".join(f"{test_id} ({value!r})" for test_id, value in unnamed)
+        raise RuntimeError(f"В groups_with_access тестов нет ни одного имени группы: {listed}. "
+                           f"Укажите группы или очистите строку и повторите миграцию.")
+
+    created = connection.execute(text("""
+        INSERT INTO groups (groupname)
+        SELECT DISTINCT btrim(name)
+        FROM tests t
+        CROSS JOIN LATERAL unnest(string_to_array(t.groups_with_access, ',')) AS name
+        WHERE btrim(name) <> ''
+        ON CONFLICT (groupname) DO NOTHING
+        RETURNING groupname
+    """)).scalars().all()
+    if created:
+        print("Созданы группы, упомянутые в доступе к тестам:", ", ".join(sorted(created)))
+
+    connection.execute(text("""
+        INSERT INTO test_groups (test_id, group_id)
+        SELECT t.id, g.id
+        FROM tests t
+        CROSS JOIN LATERAL unnest(string_to_array(t.groups_with_access, ',')) AS name
+        JOIN groups g ON g.groupname = btrim(name)
+        WHERE t.groups_with_access IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """))
+    connection.execute(text("ALTER TABLE tests DROP COLUMN groups_with_access"))
+    print("Доступ групп к тестам перенесён в таблицу test_groups.")
+
+
+def migrate_attempt_answers(connection):
+    """
+    Переносит JSON test_attempts.answers ({question_id: {"user_answer", "correct"}})
+    в таблицу attempt_answers и удаляет старый столбец.
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('test_attempts')}
+    if 'answers' not in columns:
+        return
+
+    connection.execute(text("""
+        INSERT INTO attempt_answers (attempt_id, question_id, option_mask, text_answer, correct)
+        SELECT
+            a.id,
+            q.id,
+            CASE
+                WHEN q.question_type = 'single_choice' AND e.value->>'user_answer' ~ '^[0-9]+$'
+                    THEN 1 << ((e.value->>'user_answer')::int - 1)
+                WHEN q.question_type = 'multiple_choice'
+                    THEN (SELECT bit_or(1 << (ch::int - 1))
+                          FROM regexp_split_to_table(e.value->>'user_answer', '') AS ch
+                          WHERE ch ~ '^[0-9]$')
+            END,
+            CASE WHEN q.question_type = 'text_input' THEN e.value->>'user_answer' END,
+            COALESCE((e.value->>'correct')::boolean, false)
+        FROM test_attempts a
+        CROSS JOIN LATERAL json_each(a.answers) AS e
+        JOIN questions q ON q.id::text = e.key
+        WHERE a.answers IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """))
+    connection.execute(text("ALTER TABLE test_attempts DROP COLUMN answers"))
+    print("Ответы попыток перенесены в таблицу attempt_answers.")
+
+
+def migrate_question_pools(connection):
+    """Добавляет столбцы банков вопросов: tests.shuffle, tests.version, test_attempts.seed и test_version."""
+    connection.execute(text("ALTER TABLE tests ADD COLUMN IF NOT EXISTS shuffle boolean NOT NULL DEFAULT false"))
+    connection.execute(text("ALTER TABLE tests ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1"))
+    connection.execute(text("ALTER TABLE test_attempts ADD COLUMN IF NOT EXISTS seed bigint"))
+    connection.execute(text("ALTER TABLE test_attempts ADD COLUMN IF NOT EXISTS test_version integer"))
+
+
+def migrate_question_weights(connection):
+    """Добавляет веса вопросов, частичный зачёт и баллы ответов."""
+    connection.execute(text("ALTER TABLE questions ADD COLUMN IF NOT EXISTS weight integer NOT NULL DEFAULT 1"))
+    connection.execute(text(
+        "ALTER TABLE questions ADD COLUMN IF NOT EXISTS partial_credit boolean NOT NULL DEFAULT false"))
+    connection.execute(text("ALTER TABLE test_attempts ADD COLUMN IF NOT EXISTS max_score integer"))
+    connection.execute(text("ALTER TABLE attempt_answers ADD COLUMN IF NOT EXISTS points integer"))
+
+
+def migrate_attempt_finalized(connection):
+    """Добавляет test_attempts.finalized; попытки, созданные до этого, считаются завершёнными."""
+    columns = {column['name'] for column in inspect(connection).get_columns('test_attempts')}
+    if 'finalized' in columns:
+        return
+    connection.execute(text("ALTER TABLE test_attempts ADD COLUMN finalized boolean NOT NULL DEFAULT true"))
+    connection.execute(text("ALTER TABLE test_attempts ALTER COLUMN finalized SET DEFAULT false"))
+
+
+def migrate_attempt_numbers(connection):
+    """Нумерует попытки каждого пользователя в тесте и добавляет уникальный индекс по номеру."""
+    columns = {column['name'] for column in inspect(connection).get_columns('test_attempts')}
+    if 'attempt_no' not in columns:
+        connection.execute(text("ALTER TABLE test_attempts ADD COLUMN attempt_no integer"))
+        connection.execute(text("""
+            UPDATE test_attempts a
+            SET attempt_no = numbered.no
+            FROM (
+                SELECT id, row_number() OVER (PARTITION BY user_id, test_id ORDER BY id) AS no
+                FROM test_attempts
+            ) numbered
+            WHERE numbered.id = a.id
+        """))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_test_attempts_user_test_no ON test_attempts (user_id, test_id, attempt_no)"))
+
+
+def migrate_test_versions(connection):
+    """
+    Добавляет диапазон версий вопросов и записывает текущую версию каждого теста
+    в test_versions. Прежние версии не восстановить: вопросы правились на месте,
+    поэтому все существующие вопросы считаются вопросами версий с первой.
+    """
+    connection.execute(text("ALTER TABLE questions ADD COLUMN IF NOT EXISTS added_in integer NOT NULL DEFAULT 1"))
+    connection.execute(text("ALTER TABLE questions ADD COLUMN IF NOT EXISTS retired_in integer"))
+    connection.execute(text("ALTER TABLE questions ADD COLUMN IF NOT EXISTS origin_id integer"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_test_id_added_in ON questions (test_id, added_in)"))
+    connection.execute(text("""
+        INSERT INTO test_versions (test_id, version, question_count, shuffle, created_at)
+        SELECT id, version, question_count, shuffle, timezone('Europe/Moscow', now()) FROM tests
+        ON CONFLICT DO NOTHING
+    """))
+
+
+def migrate_attempt_archive(connection):
+    """Добавляет tests.archived_at; секционированные таблицы архива создаёт create_all."""
+    connection.execute(text("ALTER TABLE tests ADD COLUMN IF NOT EXISTS archived_at timestamp"))
+
+
+def migrate_attempt_test_index(connection):
+    """Индекс попыток по тесту: результаты теста в админке и их водяной знак (utils.http_cache)."""
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_test_attempts_test_id_id ON test_attempts (test_id, id)"))
+
+
+with engine.begin() as connection:
+    migrate_groups_with_access(connection)
+    migrate_attempt_answers(connection)
+    migrate_question_pools(connection)
+    migrate_question_weights(connection)
+    migrate_attempt_finalized(connection)
+    migrate_attempt_numbers(connection)
+    migrate_test_versions(connection)
+    migrate_attempt_archive(connection)
+    migrate_attempt_test_index(connection)
+
 Session = sessionmaker(bind=engine)
 session = Session()
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, BigInteger
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, BigInteger, Table, Index, LargeBinary
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime, timedelta
 from sqlalchemy.dialects.postgresql import JSON
@@ -15,6 +15,20 @@ class Group(Base):
 
     # Обратное отношение к пользователям
     users = relationship('User', back_populates='group_rel')
+    # Тесты, к которым у группы есть доступ
+    tests = relationship('Test', secondary='test_groups', back_populates='groups')
+
+
+# Таблица доступа групп к тестам (многие ко многим).
+# Тест без записей в этой таблице доступен всем группам.
+test_groups = Table(
+    'test_groups',
+    Base.metadata,
+    Column('test_id', Integer, ForeignKey('tests.id', ondelete="CASCADE"), primary_key=True),
+    Column('group_id', Integer, ForeignKey('groups.id', ondelete="CASCADE"), primary_key=True),
+    # Первичный ключ (test_id, group_id) покрывает поиск по тесту, этот индекс — поиск по группе
+    Index('ix_test_groups_group_id_test_id', 'group_id', 'test_id'),
+)
 
 
 # Модель для пользователей
@@ -41,17 +55,40 @@ class Test(Base):
     id = Column(Integer, primary_key=True)
     test_name = Column(String, nullable=False)
     description = Column(Text)
-    groups_with_access = Column(String)
     creation_date = Column(DateTime, default=lambda: datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None))
     expiry_date = Column(DateTime)  # Дата окончания будет устанавливаться вручную
-    question_count = Column(Integer, nullable=False)
+    question_count = Column(Integer, nullable=False)  # Вопросов в попытке; в банке теста их может быть больше
     scores_need_to_pass = Column(Integer, nullable=False)
     duration = Column(Integer, nullable=False)
     number_of_attempts = Column(Integer, nullable=False)
+    shuffle = Column(Boolean, nullable=False, default=False, server_default='false')  # Перемешивать вопросы и варианты
+    # Текущая версия (test_versions): растёт при изменениях, от которых зависит выборка вопросов
+    # попытки (вопросы банка, question_count, shuffle)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # Попытки перенесены в архив (utils.attempt_archive); снова открыть такой тест нельзя
+    archived_at = Column(DateTime, nullable=True)
+
+    # Группы с доступом к тесту (пустой список — доступен всем группам)
+    groups = relationship('Group', secondary=test_groups, back_populates='tests')
 
-    # Связь с вопросами
+    # Связь с вопросами всех версий; вопросы текущей версии — с retired_in IS NULL
     questions = relationship("Question", back_populates="test", cascade="all, delete-orphan")
     attempts = relationship('TestAttempt', back_populates='test', cascade="all, delete-orphan")
+    versions = relationship('TestVersion', back_populates='test', cascade="all, delete-orphan")
+
+
+# Неизменяемая версия теста: то, по чему выбираются вопросы попытки.
+# Вопросы версии — строки questions, в диапазон версий которых она попадает (utils.test_versions)
+class TestVersion(Base):
+    __tablename__ = 'test_versions'
+    test_id = Column(Integer, ForeignKey('tests.id', ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, primary_key=True)
+    question_count = Column(Integer, nullable=False)
+    shuffle = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=False,
+                        default=lambda: datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None))
+
+    test = relationship('Test', back_populates='versions')
 
 
 # Модель для вопросов с JSON-столбцом для вариантов ответов
@@ -63,10 +100,20 @@ class Question(Base):
     question_type = Column(String, nullable=False)  # Тип: одиночный выбор, множественный выбор или текст
     options = Column(JSON, nullable=True)  # Варианты ответов
     right_answer = Column(Text, nullable=True)  # Правильный ответ
+    weight = Column(Integer, nullable=False, default=1, server_default='1')  # Баллы за верный ответ
+    # Множественный выбор: за частично верный ответ — доля веса (верные минус лишние отметки)
+    partial_credit = Column(Boolean, nullable=False, default=False, server_default='false')
+    # Вопрос не меняется после создания: правка создаёт новую строку в новой версии теста,
+    # а эта остаётся у версий [added_in, retired_in) для попыток, которые их прошли
+    added_in = Column(Integer, nullable=False, default=1, server_default='1')
+    retired_in = Column(Integer, nullable=True)  # NULL — вопрос текущей версии
+    origin_id = Column(Integer, nullable=True)  # id первой строки вопроса; NULL — это она и есть
 
     # Связь с тестом
     test = relationship("Test", back_populates="questions")
 
+    __table_args__ = (Index('ix_questions_test_id_added_in', 'test_id', 'added_in'),)
+
 
 # Модель для хранения попытки прохождения теста
 class TestAttempt(Base):
@@ -81,8 +128,121 @@ class TestAttempt(Base):
     end_time = Column(DateTime, nullable=False)
     score = Column(Integer, nullable=False)
     passed = Column(Boolean, nullable=False)
-    answers = Column(JSON, nullable=True)  # JSON поле для хранения ответов
+    # Вопросы попытки не хранятся: их заново выбирает utils.question_pool.draw_questions по зерну
+    seed = Column(BigInteger, nullable=True)  # NULL — попытка до появления банков вопросов
+    test_version = Column(Integer, nullable=True)  # Версия теста попытки (test_versions); NULL — версия 1
+    max_score = Column(Integer, nullable=True)  # Сумма весов вопросов попытки; NULL — попытка до весов вопросов
+    attempt_no = Column(Integer, nullable=True)  # Номер попытки пользователя в тесте, с 1 (utils.attempt_start)
+    # Итог записан (utils.finalization); повторное завершение попытки ничего не меняет
+    finalized = Column(Boolean, nullable=False, default=False, server_default='false')
 
     # Отношения
     test = relationship('Test', back_populates='attempts')
     user = relationship('User', back_populates='attempts')
+    answers = relationship('AttemptAnswer', back_populates='attempt', cascade="all, delete-orphan",
+                           order_by='AttemptAnswer.question_id')
+
+    # Уникальный номер попытки не даёт одновременным нажатиям превысить лимит попыток;
+    # индекс же покрывает подсчёт попыток пользователя по тестам. Попытки теста
+    # (результаты и их водяной знак в админке) — по ix_test_attempts_test_id_id
+    __table_args__ = (Index('uq_test_attempts_user_test_no', 'user_id', 'test_id', 'attempt_no', unique=True),
+                      Index('ix_test_attempts_test_id_id', 'test_id', 'id'))
+
+
+# Ответ пользователя на один вопрос в попытке.
+# Для вопросов с вариантами хранится битовая маска выбранных вариантов (бит id - 1),
+# для текстовых вопросов — введённый текст.
+class AttemptAnswer(Base):
+    __tablename__ = 'attempt_answers'
+
+    attempt_id = Column(Integer, ForeignKey('test_attempts.id', ondelete="CASCADE"), primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete="CASCADE"), primary_key=True)
+    option_mask = Column(Integer, nullable=True)  # Выбранные варианты, NULL — нет ответа или текстовый вопрос
+    text_answer = Column(Text, nullable=True)  # Ответ на текстовый вопрос
+    correct = Column(Boolean, nullable=False)
+    points = Column(Integer, nullable=True)  # Баллы за ответ; NULL — ответ до весов вопросов (1 за верный)
+
+    # Индекс для выборок по вопросу (статистика по вопросам теста)
+    __table_args__ = (Index('ix_attempt_answers_question_id', 'question_id'),)
+
+    attempt = relationship('TestAttempt', back_populates='answers')
+
+
+# Архив попыток закрытых тестов (utils.attempt_archive): те же столбцы, что у test_attempts,
+# секции по месяцам начала попытки. Рабочие таблицы и их индексы остаются небольшими,
+# а месяцы, к которым уже не обращаются, можно отсоединить от архива целиком
+class TestAttemptArchive(Base):
+    __tablename__ = 'test_attempts_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    start_time = Column(DateTime, primary_key=True)  # Ключ секционирования
+    test_id = Column(Integer, ForeignKey('tests.id', ondelete="CASCADE"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    score = Column(Integer, nullable=False)
+    passed = Column(Boolean, nullable=False)
+    seed = Column(BigInteger, nullable=True)
+    test_version = Column(Integer, nullable=True)
+    max_score = Column(Integer, nullable=True)
+    attempt_no = Column(Integer, nullable=True)
+    finalized = Column(Boolean, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+
+    test = relationship('Test')
+    user = relationship('User')
+
+    __table_args__ = (
+        Index('ix_test_attempts_archive_test_id', 'test_id'),
+        Index('ix_test_attempts_archive_user_id', 'user_id'),
+        {'postgresql_partition_by': 'RANGE (start_time)'},
+    )
+
+
+class AttemptAnswerArchive(Base):
+    __tablename__ = 'attempt_answers_archive'
+
+    attempt_id = Column(Integer, primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete="CASCADE"), primary_key=True)
+    start_time = Column(DateTime, primary_key=True)  # Начало попытки: секция та же, что у неё
+    option_mask = Column(Integer, nullable=True)
+    text_answer = Column(Text, nullable=True)
+    correct = Column(Boolean, nullable=False)
+    points = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index('ix_attempt_answers_archive_question_id', 'question_id'),
+        {'postgresql_partition_by': 'RANGE (start_time)'},
+    )
+
+
+# Рабочий процесс бота в режиме шардирования: front.py раздаёт ему апдейты по url
+class BotWorker(Base):
+    __tablename__ = 'bot_workers'
+
+    name = Column(String, primary_key=True)
+    url = Column(String, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+    leaving = Column(Boolean, nullable=False, default=False)  # Процесс завершается и отдаёт свои чаты
+
+
+# Состояние FSM чата, переданное от одного рабочего процесса другому при перебалансировке
+class FsmHandoff(Base):
+    __tablename__ = 'fsm_handoff'
+
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    payload = Column(LargeBinary, nullable=False)  # pickle (состояние, данные)
+    created_at = Column(DateTime, nullable=False,
+                        default=lambda: datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None))
+
+
+# Журнал событий шины сброса кэшей (utils.cache_bus): админка пишет событие и шлёт NOTIFY с его номером,
+# бот по пропуску в номерах дочитывает пропущенные события отсюда
+class CacheEventRecord(Base):
+    __tablename__ = 'cache_events'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False,
+                        default=lambda: datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None))
@@ -0,0 +1,148 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Optional
+
+from sqlalchemy.pool import QueuePool
+
+from utils.metrics import admission_queue_length, admission_total
+
+# Как часто перепроверять overloaded() в пределах overload_wait
+OVERLOAD_POLL_INTERVAL = 0.05
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: очередь переполнена, ожидание истекло или пул соединений занят."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Ограничение числа одновременно выполняемых участков кода с очередью FIFO.
+
+    Не больше limit корутин одновременно находятся внутри slot(), остальные
+    ждут своей очереди (не больше max_queue) не дольше queue_timeout секунд.
+    Пока корутина ждёт, on_queued вызывается при каждом изменении её позиции,
+    но не чаще раза в update_interval секунд. Освободившееся место передаётся
+    первому в очереди напрямую, поэтому новые запросы не обгоняют ожидающих.
+
+    Если после допуска overloaded() (например, пул соединений занят другими
+    обработчиками) остаётся истинным дольше overload_wait секунд, место
+    освобождается и бросается AdmissionRejected — быстрый отказ вместо
+    ожидания таймаута пула.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float, update_interval: float,
+                 overload_wait: float = 0.0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.update_interval = update_interval
+        self.overload_wait = overload_wait
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, on_queued: Optional[Callable[[int], Awaitable]] = None,
+                   overloaded: Optional[Callable[[], bool]] = None):
+        await self._acquire(on_queued)
+        try:
+            if overloaded is not None and not await self._wait_not_overloaded(overloaded):
+                admission_total.inc(controller=self.name, result='pool_saturated')
+                raise AdmissionRejected('pool_saturated')
+        except BaseException:
+            self._release()
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, on_queued: Optional[Callable[[int], Awaitable]]):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            admission_total.inc(controller=self.name, result='admitted')
+            return
+        if len(self._waiters) >= self.max_queue:
+            admission_total.inc(controller=self.name, result='queue_full')
+            raise AdmissionRejected('queue_full')
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self._report_queue()
+        deadline = loop.time() + self.queue_timeout
+        reported = None
+        try:
+            while not waiter.done():
+                position = self._waiters.index(waiter) + 1
+                if on_queued is not None and position != reported:
+                    reported = position
+                    await on_queued(position)
+                    if waiter.done():
+                        break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    admission_total.inc(controller=self.name, result='timeout')
+                    raise AdmissionRejected('timeout')
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), min(self.update_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if waiter.done():
+                # Место уже передано этой корутине — отдаём его следующему
+                self._release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                self._report_queue()
+            raise
+        admission_total.inc(controller=self.name, result='queued')
+
+    async def _wait_not_overloaded(self, overloaded: Callable[[], bool]) -> bool:
+        deadline = asyncio.get_running_loop().time() + self.overload_wait
+        while overloaded():
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(OVERLOAD_POLL_INTERVAL)
+        return True
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._report_queue()
+                waiter.set_result(None)
+                return
+        self._report_queue()
+        self._active -= 1
+
+    def _report_queue(self):
+        admission_queue_length.set(len(self._waiters), controller=self.name)
+
+
+def pool_saturated(engine) -> bool:
+    """
+    Все соединения пула движка (включая overflow) выданы: новый запрос будет ждать
+    pool_timeout, поэтому лучше сразу ответить пользователю, что сервис занят.
+    """
+    pool = getattr(engine, 'sync_engine', engine).pool
+    if not isinstance(pool, QueuePool):
+        return False
+    max_overflow = pool._max_overflow
+    if max_overflow < 0:
+        return False
+    return pool.checkedout() >= pool.size() + max_overflow
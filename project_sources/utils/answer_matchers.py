@@ -0,0 +1,101 @@
+import math
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import FrozenSet, Optional, Pattern, Tuple
+
+REGEX_PREFIX = "re:"
+NUMBER_PREFIX = "num:"
+
+# num: 3.14 ± 0.01, num: 100 +- 5%, num: 2,5
+NUMBER_SPEC = re.compile(r"^(?P<value>[-+]?[\d\s]*[.,]?\d+)\s*(?:(?:±|\+-|\+/-)\s*(?P<tol>[\d\s]*[.,]?\d+)\s*(?P<pct>%)?)?$")
+# Абсолютная погрешность для «ровных» ответов без ±, чтобы 0.1 + 0.2 засчитывалось как 0.3
+FLOAT_EPSILON = 1e-9
+
+
+class AnswerSpecError(ValueError):
+    """Строка ответа на текстовый вопрос записана с ошибкой (неверный шаблон или число)."""
+
+
+def normalize(text: str) -> str:
+    """Регистр, ё/е и лишние пробелы не влияют на сравнение ответов."""
+    return " ".join(text.casefold().replace("ё", "е").split())
+
+
+def _fold_yo(pattern: str) -> str:
+    """ё/е в шаблоне re:, как в normalize. Регистр в шаблоне значим (\\d и \\D), поэтому больше ничего не меняется."""
+    return pattern.replace("ё", "е").replace("Ё", "Е")
+
+
+def parse_number(text: str) -> Optional[float]:
+    """Число из ответа студента: десятичная запятая и пробелы между разрядами допускаются."""
+    try:
+        value = float(text.replace(" ", "").replace(",", "."))
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+@dataclass(frozen=True)
+class AnswerMatcher:
+    """Проверка ответа на текстовый вопрос, собранная из строки ответа один раз."""
+    literals: FrozenSet[str]  # Нормализованные допустимые ответы
+    patterns: Tuple[Pattern, ...]  # Шаблоны re:, ответ должен совпасть целиком
+    ranges: Tuple[Tuple[float, float], ...]  # Допустимые интервалы num:
+
+    def __call__(self, answer: Optional[str]) -> bool:
+        if answer is None:
+            return False
+        answer = normalize(answer)
+        if answer in self.literals:
+            return True
+        if self.ranges:
+            number = parse_number(answer)
+            if number is not None and any(low <= number <= high for low, high in self.ranges):
+                return True
+        return any(pattern.fullmatch(answer) for pattern in self.patterns)
+
+
+@lru_cache(maxsize=4096)
+def compile_matcher(spec: str) -> AnswerMatcher:
+    """
+    Собирает проверку ответа из строки right_answer текстового вопроса.
+
+    Каждая непустая строка — отдельный допустимый ответ (синонимы):
+      re:шаблон     — регулярное выражение без учёта регистра, совпадение целиком;
+      num:3.14±0.01 — число с абсолютной погрешностью, num:100±5% — с относительной;
+      иначе         — текст, сравниваемый без учёта регистра, ё/е и лишних пробелов.
+
+    Результат кэшируется по тексту ответа, поэтому изменённый в админке вопрос
+    получает новую проверку, а прежняя вытесняется из кэша.
+    """
+    literals, patterns, ranges = set(), [], []
+    for line in spec.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        prefix = line[:len(REGEX_PREFIX)].casefold()
+        if prefix == REGEX_PREFIX:
+            try:
+                patterns.append(re.compile(_fold_yo(line[len(REGEX_PREFIX):].strip()), re.IGNORECASE))
+            except re.error as e:
+                raise AnswerSpecError(f"Неверный шаблон «{line}»: {e}") from e
+        elif line[:len(NUMBER_PREFIX)].casefold() == NUMBER_PREFIX:
+            ranges.append(_parse_range(line))
+        else:
+            literals.add(normalize(line))
+    return AnswerMatcher(frozenset(literals), tuple(patterns), tuple(ranges))
+
+
+def _parse_range(line: str) -> Tuple[float, float]:
+    match = NUMBER_SPEC.match(line[len(NUMBER_PREFIX):].strip())
+    if not match:
+        raise AnswerSpecError(f"Неверное число «{line}»: ожидается, например, num: 3.14 ± 0.01 или num: 100 ± 5%")
+    value = parse_number(match["value"])
+    tolerance = parse_number(match["tol"]) if match["tol"] else 0.0
+    if value is None or tolerance is None:
+        raise AnswerSpecError(f"Неверное число «{line}»")
+    if match["pct"]:
+        tolerance = abs(value) * tolerance / 100
+    tolerance = max(tolerance, FLOAT_EPSILON * max(1.0, abs(value)))
+    return value - tolerance, value + tolerance
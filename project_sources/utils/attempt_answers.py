@@ -0,0 +1,57 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.models import AttemptAnswer, Question
+
+
+def option_ids_to_mask(option_ids) -> int:
+    """Собирает битовую маску из номеров вариантов (вариант с id=n — бит n - 1)."""
+    mask = 0
+    for option_id in option_ids:
+        mask |= 1 << (int(option_id) - 1)
+    return mask
+
+
+def mask_to_option_ids(mask: Optional[int]) -> List[int]:
+    """Раскладывает битовую маску обратно в упорядоченный список номеров вариантов."""
+    option_ids = []
+    option_id = 1
+    while mask:
+        if mask & 1:
+            option_ids.append(option_id)
+        mask >>= 1
+        option_id += 1
+    return option_ids
+
+
+def encode_user_answer(question_type: str, user_answer: Any) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Переводит ответ из FSM в столбцы attempt_answers.
+
+    :return: Кортеж (option_mask, text_answer).
+    """
+    if user_answer is None:
+        return None, None
+    if question_type == 'single_choice':
+        return option_ids_to_mask([user_answer]), None
+    if question_type == 'multiple_choice':
+        # В FSM ответ на множественный выбор — строка из номеров вариантов, например "13"
+        return option_ids_to_mask(str(user_answer)), None
+    return None, str(user_answer)
+
+
+def build_answer_rows(attempt_id: int, questions: List[Question],
+                      detailed_answers: Dict[str, Dict[str, Any]]) -> List[AttemptAnswer]:
+    """Строит строки attempt_answers из подробных ответов, которые возвращает ScoringPlan.score."""
+    rows = []
+    for question in questions:
+        entry = detailed_answers.get(str(question.id), {})
+        option_mask, text_answer = encode_user_answer(question.question_type, entry.get('user_answer'))
+        rows.append(AttemptAnswer(
+            attempt_id=attempt_id,
+            question_id=question.id,
+            option_mask=option_mask,
+            text_answer=text_answer,
+            correct=bool(entry.get('correct')),
+            points=entry.get('points')
+        ))
+    return rows
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import exists, func, select, text
+
+from tools.models import Test, TestAttempt, TestAttemptArchive
+from utils.cache_bus import publish_test_changed
+
+# Через сколько после expiry_date тест считается закрытым и его попытки переносятся в архив
+ARCHIVE_AFTER = timedelta(days=30)
+
+# Секционированные таблицы архива: секция на каждый месяц начала попытки
+ARCHIVE_TABLES = ('test_attempts_archive', 'attempt_answers_archive')
+
+# Перенос одним запросом: попытки и ответы удаляются из рабочих таблиц и
+# вставляются в архив; каскадное удаление ответов после этого ничего не находит
+MOVE_SQL = text("""
+    WITH moved AS (
+        DELETE FROM test_attempts WHERE test_id = :test_id
+        RETURNING id, start_time, test_id, user_id, end_time, score, passed, seed, test_version, max_score,
+                  attempt_no, finalized
+    ), moved_answers AS (
+        DELETE FROM attempt_answers a USING moved
+        WHERE a.attempt_id = moved.id
+        RETURNING a.attempt_id, a.question_id, moved.start_time, a.option_mask, a.text_answer, a.correct, a.points
+    ), archived AS (
+        INSERT INTO test_attempts_archive (id, start_time, test_id, user_id, end_time, score, passed, seed,
+                                           test_version, max_score, attempt_no, finalized, archived_at)
+        SELECT id, start_time, test_id, user_id, end_time, score, passed, seed, test_version, max_score,
+               attempt_no, finalized, :archived_at
+        FROM moved
+        RETURNING 1
+    ), archived_answers AS (
+        INSERT INTO attempt_answers_archive (attempt_id, question_id, start_time, option_mask, text_answer,
+                                             correct, points)
+        SELECT * FROM moved_answers
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM archived), (SELECT count(*) FROM archived_answers)
+""")
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+def attempt_model(test: Test):
+    """Где лежат попытки теста: TestAttemptArchive для теста в архиве, иначе TestAttempt. Столбцы у них общие."""
+    return TestAttemptArchive if test.archived_at is not None else TestAttempt
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def ensure_partitions(db_session, months: Iterable[datetime]):
+    """Создаёт секции архива для месяцев, начинающихся с months (если их ещё нет)."""
+    for month in sorted(set(map(month_start, months))):
+        upper = month_start(month + timedelta(days=32))
+        for table in ARCHIVE_TABLES:
+            # Границы секции — литералы: параметры в DDL не передаются
+            db_session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table}_{month:%Y_%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"))
+
+
+def closed_tests(db_session, closed_before: datetime) -> List[int]:
+    """Тесты с попытками, закрытые (expiry_date) раньше closed_before и ещё не перенесённые в архив."""
+    return db_session.execute(
+        select(Test.id)
+        .where(Test.archived_at.is_(None), Test.expiry_date < closed_before,
+               exists().where(TestAttempt.test_id == Test.id))
+        .order_by(Test.id)
+    ).scalars().all()
+
+
+def archive_test(db_session, test_id: int, now: datetime) -> Optional[Tuple[int, int]]:
+    """
+    Переносит все попытки закрытого теста и их ответы в архив и отмечает тест
+    archived_at. Строка теста блокируется, так что тест не продлят посреди
+    переноса. Коммит — за вызывающим. Возвращает (попыток, ответов) или None,
+    если тест не найден, ещё открыт, уже в архиве или по нему идёт попытка.
+    """
+    if db_session.bind.dialect.name != 'postgresql':
+        raise RuntimeError("Архив попыток есть только в PostgreSQL")
+    test = db_session.execute(select(Test).where(Test.id == test_id).with_for_update()).scalars().first()
+    if test is None or test.archived_at is not None or test.expiry_date is None or test.expiry_date >= now:
+        return None
+    # Попытка, начатая до expiry_date, ещё может идти
+    if db_session.execute(
+            select(exists().where(TestAttempt.test_id == test_id, TestAttempt.end_time > now))).scalar():
+        return None
+
+    months = db_session.execute(
+        select(func.date_trunc('month', TestAttempt.start_time)).where(TestAttempt.test_id == test_id).distinct()
+    ).scalars().all()
+    ensure_partitions(db_session, months)
+    attempts, answers = db_session.execute(MOVE_SQL, {"test_id": test_id, "archived_at": now}).one()
+    test.archived_at = now
+    # Админка показывает тест как архивный (водяной знак страниц — последнее событие шины)
+    groups = [group.groupname for group in test.groups]
+    publish_test_changed(db_session, test_id, groups, groups)
+    return attempts, answers
@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from sqlalchemy import exists, func, or_, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tools.models import Group, Test, TestAttempt, User, test_groups
+from utils.session_writes import mark_written
+
+
+class StartRefusal(str, Enum):
+    """Почему попытка не создана."""
+    NO_USER = 'no_user'  # Пользователь не зарегистрирован
+    NO_TEST = 'no_test'  # Тест удалён
+    NO_ACCESS = 'no_access'  # Тест закрыт для группы пользователя
+    EXPIRED = 'expired'  # Срок теста истёк
+    NO_ATTEMPTS_LEFT = 'no_attempts_left'  # Попытки исчерпаны
+    CONCURRENT = 'concurrent'  # Одновременно создаётся другая попытка этого теста (двойное нажатие)
+
+
+@dataclass(frozen=True)
+class AttemptStart:
+    attempt_id: Optional[int] = None
+    refusal: Optional[StartRefusal] = None
+
+
+# Проверки и вставка одним запросом. Номер попытки уникален для (пользователь, тест):
+# из двух одновременных вставок с одним номером вторая ничего не вставит, поэтому
+# лимит попыток не превышается и при двойном нажатии
+START_SQL = text("""
+    WITH candidate AS (
+        SELECT u.id AS user_pk, t.id AS test_pk, t.expiry_date, t.number_of_attempts,
+               used.count AS used, used.last_no,
+               (NOT EXISTS (SELECT 1 FROM test_groups tg WHERE tg.test_id = t.id)
+                OR EXISTS (SELECT 1 FROM test_groups tg JOIN groups g ON g.id = tg.group_id
+                           WHERE tg.test_id = t.id AND g.groupname = u."group")) AS allowed
+        FROM "user" u
+        JOIN tests t ON t.id = :test_id
+        CROSS JOIN LATERAL (
+            SELECT count(*) AS count, coalesce(max(a.attempt_no), 0) AS last_no
+            FROM test_attempts a
+            WHERE a.user_id = u.id AND a.test_id = t.id
+        ) used
+        WHERE u.user_id = :telegram_id
+    ), inserted AS (
+        INSERT INTO test_attempts (test_id, user_id, attempt_no, start_time, end_time, score, passed,
+                                   seed, test_version, finalized)
+        SELECT test_pk, user_pk, last_no + 1, :start_time, :end_time, 0, false, :seed, :test_version, false
+        FROM candidate
+        WHERE allowed AND (expiry_date IS NULL OR expiry_date > :start_time) AND used < number_of_attempts
+        ON CONFLICT (user_id, test_id, attempt_no) DO NOTHING
+        RETURNING id
+    )
+    SELECT
+        (SELECT id FROM inserted),
+        EXISTS (SELECT 1 FROM "user" WHERE user_id = :telegram_id),
+        (SELECT allowed FROM candidate),
+        (SELECT expiry_date IS NULL OR expiry_date > :start_time FROM candidate),
+        (SELECT used < number_of_attempts FROM candidate)
+""")
+
+
+def _refusal(user_found: bool, allowed: Optional[bool], is_open: Optional[bool],
+            attempts_left: Optional[bool]) -> StartRefusal:
+    if not user_found:
+        return StartRefusal.NO_USER
+    if allowed is None:
+        # Пользователь есть, а строки кандидата нет — нет теста
+        return StartRefusal.NO_TEST
+    if not allowed:
+        return StartRefusal.NO_ACCESS
+    if not is_open:
+        return StartRefusal.EXPIRED
+    if not attempts_left:
+        return StartRefusal.NO_ATTEMPTS_LEFT
+    return StartRefusal.CONCURRENT
+
+
+async def start_attempt(session: AsyncSession, telegram_id: int, test: Test, seed: int, start_time: datetime,
+                        end_time: datetime) -> AttemptStart:
+    """
+    Создаёт попытку, если тест ещё открыт, доступен группе пользователя и попытки
+    не исчерпаны, и фиксирует транзакцию. Условия проверяет база в момент вставки,
+    а не кнопка, по которой пользователь начал тест: она могла устареть.
+
+    :param test: Тест из снимка; из него берётся только версия банка вопросов,
+        из которой выбраны вопросы попытки.
+    """
+    params = dict(telegram_id=telegram_id, test_id=test.id, start_time=start_time, end_time=end_time,
+                  seed=seed, test_version=test.version)
+    if session.bind.dialect.name == 'postgresql':
+        attempt_id, *checks = (await session.execute(START_SQL, params)).one()
+        if attempt_id is None:
+            await session.rollback()
+            return AttemptStart(refusal=_refusal(*checks))
+        mark_written(session)
+        await session.commit()
+        return AttemptStart(attempt_id)
+    return await _start_attempt_orm(session, params)
+
+
+async def _start_attempt_orm(session: AsyncSession, params: dict) -> AttemptStart:
+    """Те же проверки для остальных баз: выборка и вставка, гонку решает уникальный номер попытки."""
+    user = (await session.execute(
+        select(User.id, User.group).where(User.user_id == params['telegram_id']))).first()
+    if user is None:
+        return AttemptStart(refusal=StartRefusal.NO_USER)
+    allowed = or_(
+        ~exists().where(test_groups.c.test_id == Test.id),
+        exists().where(test_groups.c.test_id == Test.id, test_groups.c.group_id == Group.id,
+                       Group.groupname == user.group),
+    )
+    own_attempts = (TestAttempt.user_id == user.id, TestAttempt.test_id == Test.id)
+    row = (await session.execute(
+        select(Test.expiry_date, Test.number_of_attempts, allowed,
+               select(func.count()).where(*own_attempts).scalar_subquery(),
+               select(func.coalesce(func.max(TestAttempt.attempt_no), 0)).where(*own_attempts).scalar_subquery())
+        .where(Test.id == params['test_id'])
+    )).first()
+    if row is None:
+        return AttemptStart(refusal=StartRefusal.NO_TEST)
+    expiry_date, number_of_attempts, is_allowed, count, last_no = row
+    is_open = expiry_date is None or expiry_date > params['start_time']
+    if not (is_allowed and is_open and count < number_of_attempts):
+        await session.rollback()
+        return AttemptStart(refusal=_refusal(True, is_allowed, is_open, count < number_of_attempts))
+
+    attempt = TestAttempt(test_id=params['test_id'], user_id=user.id, attempt_no=last_no + 1,
+                          start_time=params['start_time'], end_time=params['end_time'], score=0, passed=False,
+                          seed=params['seed'], test_version=params['test_version'])
+    session.add(attempt)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return AttemptStart(refusal=StartRefusal.CONCURRENT)
+    return AttemptStart(attempt.id)
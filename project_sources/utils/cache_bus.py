@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from tools.models import CacheEventRecord
+from utils.metrics import cache_event_lag_seconds, cache_event_recoveries_total, cache_events_total
+
+logger = logging.getLogger(__name__)
+
+# Канал Postgres NOTIFY шины сброса кэшей
+CACHE_EVENTS_CHANNEL = "cache_events"
+# Сколько последних событий хранить в cache_events для восстановления пропущенных
+CACHE_EVENTS_KEEP = 10000
+
+
+class EventKind(str, Enum):
+    TEST_CHANGED = 'test_changed'  # Тест создан или изменён: настройки, доступ групп
+    QUESTIONS_CHANGED = 'questions_changed'  # Изменены вопросы теста
+    USERS_CHANGED = 'users_changed'  # Пользователи подтверждены или удалены
+
+
+@dataclass(frozen=True)
+class CacheEvent:
+    seq: int
+    kind: EventKind
+    test_id: Optional[int] = None
+    groups: Optional[Tuple[str, ...]] = None  # У каких групп меняется список тестов; None — у всех
+    user_ids: Tuple[int, ...] = ()  # Telegram id пользователей
+    sent_at: Optional[float] = None  # time.time() публикации; для восстановленных событий не задано
+
+    @classmethod
+    def from_payload(cls, seq: int, kind: str, payload: Dict[str, Any], sent_at: Optional[float] = None):
+        groups = payload.get('groups')
+        return cls(seq, EventKind(kind), payload.get('test_id'), tuple(groups) if groups is not None else None,
+                   tuple(payload.get('user_ids', ())), sent_at)
+
+
+def publish(db_session, kind: EventKind, **payload):
+    """
+    Записывает событие в cache_events и отправляет NOTIFY с его номером и видом.
+    Данные события (список пользователей может быть длинным) подписчик читает из
+    журнала: NOTIFY ограничен 8000 байт. Как и запись в журнал, уведомление
+    уходит только при коммите транзакции.
+    """
+    seq = db_session.execute(
+        insert(CacheEventRecord).values(kind=kind.value, payload=payload).returning(CacheEventRecord.id)
+    ).scalar_one()
+    message = json.dumps({'seq': seq, 'kind': kind.value, 'sent_at': time.time()})
+    db_session.execute(text("SELECT pg_notify(:channel, :message)"),
+                       {"channel": CACHE_EVENTS_CHANNEL, "message": message})
+    # Старые события нужны только процессам, которые были отключены дольше, чем длится CACHE_EVENTS_KEEP событий
+    if seq % 100 == 0:
+        db_session.execute(delete(CacheEventRecord).where(CacheEventRecord.id <= seq - CACHE_EVENTS_KEEP))
+
+
+def publish_test_changed(db_session, test_id: int, groups: Iterable[str],
+                         previous_groups: Optional[Iterable[str]] = None):
+    """
+    groups — группы с доступом к тесту после изменения, previous_groups — до него
+    (None — тест только что создан). Пустой список — тест доступен всем группам:
+    тогда список тестов меняется у всех.
+    """
+    groups = set(groups)
+    previous_groups = set(previous_groups) if previous_groups is not None else None
+    everyone = not groups or previous_groups == set()
+    publish(db_session, EventKind.TEST_CHANGED, test_id=test_id,
+            groups=None if everyone else sorted(groups | (previous_groups or set())))
+
+
+def publish_questions_changed(db_session, test_id: int):
+    publish(db_session, EventKind.QUESTIONS_CHANGED, test_id=test_id)
+
+
+def publish_users_changed(db_session, user_ids: Iterable[int]):
+    publish(db_session, EventKind.USERS_CHANGED, user_ids=sorted(user_ids))
+
+
+def _decode(payload) -> Dict[str, Any]:
+    # asyncpg без кодека json отдаёт столбец строкой
+    return json.loads(payload) if isinstance(payload, str) else payload
+
+
+class CacheEventListener:
+    """
+    Подписка бота на шину: каждое событие передаётся on_cache_event(event) кэшей,
+    которые точечно удаляют затронутые записи.
+
+    Номера событий идут подряд (кроме откаченных транзакций), поэтому пропуск
+    в номерах означает потерянное уведомление: недостающие события дочитываются
+    из cache_events. После переподключения дочитывается всё, что пришло за время
+    разрыва; если журнал уже обрезан дальше последнего известного номера, кэши
+    сбрасываются целиком через invalidate().
+    """
+
+    def __init__(self, engine: AsyncEngine, caches: Iterable, retry_delay: float = 5.0):
+        self.engine = engine
+        self.caches = list(caches)
+        self.retry_delay = retry_delay
+        self.last_seq: Optional[int] = None
+
+    def apply(self, event: CacheEvent, via: str):
+        cache_events_total.inc(kind=event.kind.value, via=via)
+        if event.sent_at is not None:
+            cache_event_lag_seconds.observe(max(0.0, time.time() - event.sent_at), kind=event.kind.value)
+        for cache in self.caches:
+            cache.on_cache_event(event)
+        logger.debug("Событие шины кэшей %s: %s", via, event)
+
+    def reset(self, reason: str):
+        cache_event_recoveries_total.inc(reason=reason)
+        for cache in self.caches:
+            cache.invalidate()
+
+    async def run(self):
+        while True:
+            try:
+                async with self.engine.connect() as connection:
+                    try:
+                        raw_connection = await connection.get_raw_connection()
+                        await self._listen(raw_connection.driver_connection)
+                    finally:
+                        # Соединение подписки разорвано или с подписчиком: в пул его не возвращаем
+                        await connection.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка подписки на %s: %s", CACHE_EVENTS_CHANNEL, e)
+            await asyncio.sleep(self.retry_delay)
+
+    async def _listen(self, driver_connection):
+        notifications: asyncio.Queue = asyncio.Queue()
+        connection_lost = asyncio.Event()
+        driver_connection.add_termination_listener(lambda _: connection_lost.set())
+        await driver_connection.add_listener(CACHE_EVENTS_CHANNEL,
+                                             lambda *args: notifications.put_nowait(args[-1]))
+
+        # Подписка уже есть: события, опубликованные с этого момента, придут уведомлением
+        if self.last_seq is None:
+            self.last_seq = await driver_connection.fetchval("SELECT coalesce(max(id), 0) FROM cache_events")
+            # До подписки кэши могли загрузить данные, изменённые без уведомления
+            self.reset('subscribe')
+        else:
+            await self._recover(driver_connection, 'reconnect')
+        logger.info("Подписка на канал %s установлена (событие %s)", CACHE_EVENTS_CHANNEL, self.last_seq)
+
+        lost = asyncio.create_task(connection_lost.wait())
+        try:
+            while True:
+                received = asyncio.create_task(notifications.get())
+                done, _ = await asyncio.wait({received, lost}, return_when=asyncio.FIRST_COMPLETED)
+                if received not in done:
+                    received.cancel()
+                    logger.warning("Соединение подписки на %s потеряно", CACHE_EVENTS_CHANNEL)
+                    return
+                message = json.loads(received.result())
+                seq = message['seq']
+                if seq <= self.last_seq:
+                    continue  # Уже дочитано из журнала
+                if seq > self.last_seq + 1:
+                    # Уведомление между last_seq и этим событием не пришло (или транзакция откачена)
+                    await self._recover(driver_connection, 'gap', before=seq)
+                payload = await driver_connection.fetchval("SELECT payload FROM cache_events WHERE id = $1", seq)
+                if payload is None:
+                    # Событие уже удалено из журнала — точечно сбросить нельзя
+                    logger.warning("Событие %s не найдено в cache_events, кэши сбрасываются", seq)
+                    self.reset('truncated')
+                else:
+                    self.apply(CacheEvent.from_payload(seq, message['kind'], _decode(payload),
+                                                       message.get('sent_at')), 'notify')
+                self.last_seq = seq
+        finally:
+            lost.cancel()
+
+    async def _recover(self, driver_connection, reason: str, before: Optional[int] = None):
+        """Дочитывает из журнала события после last_seq (и до before, если задано)."""
+        if before is None:
+            oldest, newest = await driver_connection.fetchrow("SELECT min(id), max(id) FROM cache_events")
+            if oldest is not None and oldest > self.last_seq + 1:
+                # Часть событий уже удалена из журнала — точечно восстановить нельзя
+                logger.warning("Журнал cache_events обрезан после события %s, кэши сбрасываются", self.last_seq)
+                self.last_seq = newest
+                self.reset('truncated')
+                return
+        rows: List = await driver_connection.fetch(
+            "SELECT id, kind, payload FROM cache_events WHERE id > $1 AND ($2::bigint IS NULL OR id < $2) ORDER BY id",
+            self.last_seq, before)
+        cache_event_recoveries_total.inc(reason=reason)
+        for row in rows:
+            self.apply(CacheEvent.from_payload(row['id'], row['kind'], _decode(row['payload'])), 'recovery')
+            self.last_seq = max(self.last_seq, row['id'])
+        if rows:
+            logger.info("Восстановлено пропущенных событий шины кэшей: %s (%s)", len(rows), reason)
@@ -0,0 +1,82 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Type, Union
+
+from aiogram import Router, types
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.dispatcher.flags import extract_flags_from_object, get_flag
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State
+
+logger = logging.getLogger(__name__)
+
+# Разделитель полей callback-данных; префикс — всё до первого разделителя
+SEPARATOR = ":"
+
+
+@dataclass
+class CallbackRoute:
+    payload: Type[CallbackData]
+    handler: CallableObject
+    states: Optional[FrozenSet[str]]  # None — в любом состоянии
+    flags: Dict[str, Any]  # Флаги aiogram обработчика (@flags.replica и т.п.)
+
+    @property
+    def name(self) -> str:
+        return self.handler.callback.__name__
+
+
+class CallbackIndex:
+    """
+    Маршрутизация callback-запросов роутера по префиксу данных.
+
+    Вместо цепочки фильтров, которые aiogram проверяет по очереди для каждого
+    обработчика, на роутер вешается один обработчик: нужный маршрут берётся
+    из словаря по префиксу, а данные разбираются в объект CallbackData один раз
+    и передаются обработчику аргументом callback_data.
+    """
+
+    def __init__(self, router: Router):
+        self._routes: Dict[str, List[CallbackRoute]] = {}
+        router.callback_query.register(self._dispatch, self._resolve)
+
+    def __call__(self, payload: Type[CallbackData], *states: Union[State, str]) -> Callable:
+        """Декоратор обработчика: @callbacks(AnswerOption) или @callbacks(TestsPage, TestStates.VIEWING_TESTS)."""
+        state_names = frozenset(state.state if isinstance(state, State) else state for state in states) or None
+
+        if payload.__separator__ != SEPARATOR:
+            raise ValueError(f"{payload.__name__}: CallbackIndex поддерживает только разделитель {SEPARATOR!r}")
+
+        def decorator(handler: Callable) -> Callable:
+            route = CallbackRoute(payload, CallableObject(handler), state_names, extract_flags_from_object(handler))
+            self._routes.setdefault(payload.__prefix__, []).append(route)
+            return handler
+
+        return decorator
+
+    async def _resolve(self, callback: types.CallbackQuery,
+                       raw_state: Optional[str] = None) -> Union[bool, Dict[str, Any]]:
+        if not callback.data:
+            return False
+        prefix = callback.data.split(SEPARATOR, 1)[0]
+        for route in self._routes.get(prefix, ()):
+            if route.states is not None and raw_state not in route.states:
+                continue
+            try:
+                callback_data = route.payload.unpack(callback.data)
+            except (TypeError, ValueError) as e:
+                logger.warning("Некорректные данные callback %r для %s: %s", callback.data, route.name, e)
+                return False
+            return {"callback_data": callback_data, "callback_route": route}
+        return False
+
+    async def _dispatch(self, callback: types.CallbackQuery, callback_route: CallbackRoute, **data: Any) -> Any:
+        return await callback_route.handler.call(callback, **data)
+
+
+def handler_flag(data: Dict[str, Any], name: str, default: Any = None) -> Any:
+    """Флаг обработчика апдейта; для callback-запросов — обработчика, выбранного CallbackIndex."""
+    callback_route = data.get("callback_route")
+    if callback_route is not None:
+        return callback_route.flags.get(name, default)
+    return get_flag(data, name, default=default)
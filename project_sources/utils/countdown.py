@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardMarkup
+
+from utils.metrics import countdown_edits_total
+
+logger = logging.getLogger(__name__)
+
+# В последнюю минуту оставшееся время показывается с таким шагом (с)
+FINAL_MINUTE_STEP = 15
+
+# (message_id, текст, клавиатура) сообщения с вопросом или None, если попытка уже не активна
+Rendered = Optional[Tuple[int, str, InlineKeyboardMarkup]]
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+def format_time_left(time_left: timedelta) -> str:
+    """Оставшееся время с точностью до минуты, в последнюю минуту — до FINAL_MINUTE_STEP секунд (с округлением вверх)."""
+    seconds = max(0.0, time_left.total_seconds())
+    if seconds > 60:
+        return f"{math.ceil(seconds / 60)} мин"
+    return f"{math.ceil(seconds / FINAL_MINUTE_STEP) * FINAL_MINUTE_STEP} сек"
+
+
+@dataclass
+class CountdownEntry:
+    chat_id: int
+    end_time: datetime
+    state: FSMContext
+    shown: Optional[str] = None  # Время, показанное в сообщении сейчас
+    touched_at: float = float('-inf')  # Когда сообщение последний раз редактировалось (time.monotonic)
+
+
+class CountdownTicker:
+    """
+    Обновление оставшегося времени в сообщениях с вопросами активных попыток.
+
+    Раз в interval секунд для каждой попытки считается строка format_time_left;
+    сообщение редактируется, только если строка изменилась (раз в минуту, в
+    последнюю минуту — раз в FINAL_MINUTE_STEP секунд) и сам пользователь не
+    обновлял его последние quiet_seconds секунд. Правки идут одним потоком не
+    быстрее edits_per_second, начиная с попыток, у которых осталось меньше
+    всего времени, чтобы не занимать лимит Telegram на сообщения бота.
+    """
+
+    def __init__(self, render: Callable[[FSMContext], Awaitable[Rendered]], edits_per_second: float,
+                 quiet_seconds: float, interval: float = 1.0):
+        self.render = render
+        self.edit_interval = 1 / edits_per_second
+        self.quiet_seconds = quiet_seconds
+        self.interval = interval
+        self._entries: Dict[int, CountdownEntry] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, chat_id: int, end_time: datetime, state: FSMContext):
+        self._entries[chat_id] = CountdownEntry(chat_id, end_time, state)
+
+    def touch(self, chat_id: int, shown: str):
+        """Сообщение с вопросом только что отрисовал обработчик."""
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            entry.shown = shown
+            entry.touched_at = time.monotonic()
+
+    def forget(self, chat_id: int):
+        self._entries.pop(chat_id, None)
+
+    def start(self, bot: Bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                await self.tick(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка обновления таймеров попыток: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def tick(self, bot: Bot):
+        now = current_time()
+        quiet_since = time.monotonic() - self.quiet_seconds
+        due = []
+        for entry in list(self._entries.values()):
+            if entry.end_time <= now:
+                # Попытку завершит monitor_test_time
+                self.forget(entry.chat_id)
+                continue
+            shown = format_time_left(entry.end_time - now)
+            if shown != entry.shown and entry.touched_at <= quiet_since:
+                due.append((entry.end_time, shown, entry))
+        due.sort(key=lambda item: item[0])
+
+        for _, shown, entry in due:
+            if self._entries.get(entry.chat_id) is not entry or entry.touched_at > quiet_since:
+                continue
+            rendered = await self.render(entry.state)
+            if rendered is None:
+                self.forget(entry.chat_id)
+                continue
+            message_id, text, keyboard = rendered
+            try:
+                await bot.edit_message_text(text=text, chat_id=entry.chat_id, message_id=message_id,
+                                            reply_markup=keyboard)
+                countdown_edits_total.inc(result='edited')
+            except TelegramRetryAfter as e:
+                # Превысили лимит Telegram: остаток пачки обновится на следующем такте
+                countdown_edits_total.inc(result='retry_after')
+                logger.warning("Обновление таймеров приостановлено на %s с", e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                return
+            except TelegramBadRequest as e:
+                # Сообщение удалено или уже совпадает с новым текстом — больше его не трогаем до смены
+                countdown_edits_total.inc(result='failed')
+                logger.debug("Не удалось обновить таймер в чате %s: %s", entry.chat_id, e)
+            entry.shown = shown
+            entry.touched_at = time.monotonic()
+            await asyncio.sleep(self.edit_interval)
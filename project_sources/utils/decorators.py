@@ -5,6 +5,8 @@ from functools import wraps
 import logging
 
 from tools.states import TestStates
+from tools.callbacks import NOOP
+from utils.logging_config import state_fields
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +16,7 @@ def check_active_test(handler):
         user_data = await state.get_data()
         current_state = await state.get_state()
 
-        logger.debug(f"check_active_test: user_data={user_data}, current_state={current_state}")
+        logger.debug("check_active_test: %s, current_state=%s", state_fields(user_data), current_state)
 
         # Список состояний, при которых пользователь считается в активном тесте
         allowed_states = [TestStates.TESTING.state,
@@ -37,7 +39,7 @@ def check_active_test(handler):
             # Создаём клавиатуру с неактивными кнопками (например, для завершения теста)
             disabled_keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [
-                    InlineKeyboardButton(text="✅ Завершить тест (недоступно)", callback_data="noop")
+                    InlineKeyboardButton(text="✅ Завершить тест (недоступно)", callback_data=NOOP)
                 ]
             ])
 
@@ -50,7 +52,7 @@ def check_active_test(handler):
                 )
                 logger.debug("check_active_test: Disabled test buttons successfully.")
             except Exception as e:
-                logger.error(f"Ошибка при редактировании кнопок: {e}")
+                logger.error("Ошибка при редактировании кнопок: %s", e)
 
             return  # Прерываем выполнение обработчика
 
@@ -0,0 +1,72 @@
+from datetime import datetime
+from typing import Sequence
+
+from sqlalchemy import text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tools.models import Question, TestAttempt
+from utils.attempt_answers import build_answer_rows
+from utils.scoring_plan import AttemptScore
+from utils.session_writes import mark_written
+
+# Итог попытки и её ответы одним запросом: UPDATE срабатывает только для незавершённой
+# попытки, а ответы вставляются только из строки, которую он вернул
+FINALIZE_SQL = text("""
+    WITH finished AS (
+        UPDATE test_attempts
+        SET score = :score, max_score = :max_score, passed = :passed, end_time = :end_time, finalized = true
+        WHERE id = :attempt_id AND finalized = false
+        RETURNING id
+    ), inserted AS (
+        INSERT INTO attempt_answers (attempt_id, question_id, option_mask, text_answer, correct, points)
+        SELECT finished.id, answer.question_id, answer.option_mask, answer.text_answer, answer.correct, answer.points
+        FROM finished
+        CROSS JOIN unnest(CAST(:question_ids AS integer[]), CAST(:option_masks AS integer[]),
+                          CAST(:text_answers AS text[]), CAST(:correct AS boolean[]), CAST(:points AS integer[]))
+            AS answer(question_id, option_mask, text_answer, correct, points)
+        RETURNING 1
+    )
+    SELECT count(*) FROM finished
+""")
+
+
+async def finalize_attempt(session: AsyncSession, attempt_id: int, end_time: datetime, result: AttemptScore,
+                           questions: Sequence[Question]) -> bool:
+    """
+    Записывает итог попытки и ответы и фиксирует транзакцию.
+
+    Возвращает False, если попытку уже завершили: второе нажатие «Да» или
+    таймер окончания времени, сработавший одновременно с ним. Строка попытки
+    блокируется UPDATE, поэтому из двух одновременных вызовов итог запишет один.
+    В PostgreSQL это один запрос (CTE), в остальных базах — UPDATE и INSERT
+    в одной транзакции.
+    """
+    rows = build_answer_rows(attempt_id, questions, result.detailed_answers)
+    values = dict(score=result.score, max_score=result.max_score, passed=result.passed, end_time=end_time)
+
+    if session.bind.dialect.name == 'postgresql':
+        finished = (await session.execute(FINALIZE_SQL, dict(
+            values,
+            attempt_id=attempt_id,
+            question_ids=[row.question_id for row in rows],
+            option_masks=[row.option_mask for row in rows],
+            text_answers=[row.text_answer for row in rows],
+            correct=[row.correct for row in rows],
+            points=[row.points for row in rows],
+        ))).scalar_one()
+    else:
+        finished = (await session.execute(
+            update(TestAttempt)
+            .where(TestAttempt.id == attempt_id, TestAttempt.finalized.is_(False))
+            .values(finalized=True, **values)
+            .execution_options(synchronize_session=False)
+        )).rowcount
+        if finished:
+            session.add_all(rows)
+
+    if not finished:
+        await session.rollback()
+        return False
+    mark_written(session)
+    await session.commit()
+    return True
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import pickle
+import time
+from copy import copy
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+from utils.metrics import fsm_chats, fsm_evictions_total, fsm_state_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+@dataclass(frozen=True)
+class EvictionPolicy:
+    """
+    Когда состояние чата удаляется из памяти.
+
+    Обычные состояния (просмотр результатов, регистрация) живут idle_ttl секунд
+    с последнего обращения. Чат с идущей попыткой не удаляется до её end_time
+    плюс active_grace: к этому времени попытку уже завершил monitor_test_time.
+    Если чатов больше max_chats, сверх лимита удаляются давно не активные чаты
+    без попытки (0 — без лимита).
+    """
+    idle_ttl: float
+    active_grace: float
+    max_chats: int = 0
+    active_states: frozenset = frozenset()
+
+    def is_active(self, record: MemoryStorageRecord) -> bool:
+        return record.state in self.active_states
+
+    def expired(self, record: MemoryStorageRecord, idle: float, now: datetime) -> bool:
+        if self.is_active(record):
+            end_time = record.data.get('end_time')
+            if isinstance(end_time, datetime):
+                return now > end_time + timedelta(seconds=self.active_grace)
+        return idle > self.idle_ttl
+
+
+@dataclass(frozen=True)
+class ChatMemory:
+    key: StorageKey
+    state: Optional[str]
+    size: int  # Байт в pickle (как при передаче чата другому процессу)
+    idle: float  # Секунд с последнего обращения
+
+
+def record_size(record: MemoryStorageRecord) -> int:
+    """
+    Размер состояния чата в pickle. Вопросы попытки — общие объекты снимка
+    теста, поэтому в памяти процесса чат занимает меньше: это верхняя оценка.
+    """
+    try:
+        return len(pickle.dumps((record.state, record.data), pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return len(repr(record.data))
+
+
+class BoundedMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage с вытеснением состояния простаивающих чатов.
+
+    Чтение состояния не создаёт пустых записей, а запись пустого состояния
+    (state.clear()) удаляет запись, так что в памяти остаются только чаты,
+    которым есть что хранить. Раз в sweep_interval секунд записи проверяются по
+    EvictionPolicy, пересчитывается размер изменённых записей и обновляются
+    метрики bot_fsm_*. Для удалённого чата с попыткой вызывается on_evict(chat_id)
+    — остановить его таймеры.
+    """
+
+    def __init__(self, policy: EvictionPolicy, sweep_interval: float = 60.0,
+                 on_evict: Optional[Callable[[int], Any]] = None):
+        super().__init__()
+        self.policy = policy
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self._last_seen: Dict[StorageKey, float] = {}
+        self._sizes: Dict[StorageKey, int] = {}
+        self._dirty: Set[StorageKey] = set()
+        self._reported_states: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def _touch(self, key: StorageKey):
+        self._last_seen[key] = time.monotonic()
+
+    def _changed(self, key: StorageKey):
+        self._touch(key)
+        record = self.storage.get(key)
+        if record is not None and record.state is None and not record.data:
+            self._forget(key)
+        else:
+            self._dirty.add(key)
+
+    def _forget(self, key: StorageKey):
+        self.storage.pop(key, None)
+        self._last_seen.pop(key, None)
+        self._sizes.pop(key, None)
+        self._dirty.discard(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await super().set_state(key, state)
+        self._changed(key)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await super().set_data(key, data)
+        self._changed(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self.storage.get(key)
+        if record is None:
+            return None
+        self._touch(key)
+        return record.state
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self.storage.get(key)
+        if record is None:
+            return {}
+        self._touch(key)
+        return record.data.copy()
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        record = self.storage.get(storage_key)
+        if record is None:
+            return default
+        self._touch(storage_key)
+        return copy(record.data.get(dict_key, default))
+
+    def sweep(self) -> Tuple[int, int]:
+        """Удаляет устаревшие записи и обновляет метрики. Возвращает (по простою, сверх лимита)."""
+        now = current_time()
+        monotonic_now = time.monotonic()
+        # Записи, созданные в обход set_* (например, при приёме чата от другого процесса)
+        for key in self.storage.keys() - self._last_seen.keys():
+            self._last_seen[key] = monotonic_now
+            self._dirty.add(key)
+        for key in self._last_seen.keys() - self.storage.keys():
+            self._forget(key)
+
+        expired = [key for key, record in self.storage.items()
+                   if self.policy.expired(record, monotonic_now - self._last_seen[key], now)]
+        self._evict(expired, 'idle')
+
+        over_limit = []
+        if self.policy.max_chats and len(self.storage) > self.policy.max_chats:
+            idle_first = sorted((key for key, record in self.storage.items() if not self.policy.is_active(record)),
+                                key=self._last_seen.__getitem__)
+            over_limit = idle_first[:len(self.storage) - self.policy.max_chats]
+            self._evict(over_limit, 'capacity')
+
+        for key in self._dirty:
+            record = self.storage.get(key)
+            if record is not None:
+                self._sizes[key] = record_size(record)
+        self._dirty.clear()
+        self._update_metrics()
+        if expired or over_limit:
+            logger.info("Из памяти FSM удалено чатов: %s по простою, %s сверх лимита", len(expired), len(over_limit))
+        return len(expired), len(over_limit)
+
+    def _evict(self, keys: Iterable[StorageKey], reason: str):
+        count = 0
+        for key in keys:
+            record = self.storage.get(key)
+            if record is None:
+                continue
+            active = self.policy.is_active(record)
+            self._forget(key)
+            count += 1
+            if active and self.on_evict is not None:
+                self.on_evict(key.chat_id)
+        if count:
+            fsm_evictions_total.inc(count, reason=reason)
+
+    def _update_metrics(self):
+        by_state: Dict[str, int] = {}
+        for record in self.storage.values():
+            state = record.state or 'none'
+            by_state[state] = by_state.get(state, 0) + 1
+        # Состояния, из которых ушли все чаты, показываем нулём
+        for state in self._reported_states:
+            by_state.setdefault(state, 0)
+        self._reported_states.update(by_state)
+        for state, count in by_state.items():
+            fsm_chats.set(count, state=state)
+        fsm_state_bytes.set(sum(self._sizes.values()), kind='total')
+        fsm_state_bytes.set(max(self._sizes.values(), default=0), kind='max')
+
+    def chats(self, limit: Optional[int] = None) -> List[ChatMemory]:
+        """Чаты по убыванию размера состояния (по последнему sweep)."""
+        monotonic_now = time.monotonic()
+        report = [
+            ChatMemory(key, record.state, self._sizes.get(key, 0), monotonic_now - self._last_seen.get(key, monotonic_now))
+            for key, record in self.storage.items()
+        ]
+        report.sort(key=lambda chat: chat.size, reverse=True)
+        return report[:limit] if limit is not None else report
+
+    def total_size(self) -> int:
+        return sum(self._sizes.values())
+
+    async def start(self):
+        # async: синхронные обработчики startup aiogram вызывает в потоке, без цикла событий
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Ошибка очистки состояния FSM: %s", e)
+
+    async def close(self) -> None:
+        await self.stop()
@@ -0,0 +1,30 @@
+import bisect
+import hashlib
+from typing import Hashable, Iterable, List, Optional, Tuple
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Консистентное хеширование: ключ (id чата) принадлежит узлу, чья точка на кольце
+    идёт первой после хеша ключа. У каждого узла replicas точек, поэтому ключи
+    распределяются равномерно, а при добавлении или удалении узла переезжает
+    только примерно 1/N ключей.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 100):
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        points: List[Tuple[int, str]] = sorted(
+            (_hash(f"{node}#{replica}"), node) for node in self.nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: Hashable) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[index]
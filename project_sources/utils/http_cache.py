@@ -0,0 +1,129 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import func, select, true
+
+from tools.models import CacheEventRecord, Group, Test, TestAttempt
+
+MOSCOW = ZoneInfo("Europe/Moscow")
+
+
+@dataclass(frozen=True)
+class Watermark:
+    """
+    Состояние данных страницы: пока оно то же, страница не изменилась.
+    key — значения, от которых зависит страница; last_modified — время последнего изменения (UTC).
+    """
+    key: Tuple
+    last_modified: Optional[datetime] = None
+
+    @property
+    def etag(self) -> str:
+        return hashlib.blake2b(repr(self.key).encode(), digest_size=12).hexdigest()
+
+
+def _utc(moment: Optional[datetime]) -> Optional[datetime]:
+    # В базе — наивное московское время
+    return moment.replace(tzinfo=MOSCOW).astimezone(timezone.utc) if moment is not None else None
+
+
+def _latest_event():
+    """Последнее событие шины кэшей: каждое изменение из админки записывается в cache_events (utils.cache_bus)."""
+    return select(CacheEventRecord.id, CacheEventRecord.created_at).order_by(CacheEventRecord.id.desc()).limit(1)
+
+
+def tests_watermark(db_session) -> Watermark:
+    """Список тестов: меняется только из админки, а тесты, созданные в обход неё, видны по числу тестов."""
+    event = _latest_event().subquery()
+    event_id, event_time, tests = db_session.execute(
+        select(select(event.c.id).scalar_subquery(), select(event.c.created_at).scalar_subquery(),
+               select(func.count(Test.id)).scalar_subquery())
+    ).one()
+    return Watermark(('tests', event_id, tests), _utc(event_time))
+
+
+def test_watermark(db_session, test_id: int) -> Optional[Watermark]:
+    """
+    Результаты и вопросы теста: последнее событие админки (правки теста и
+    вопросов, перепроверка, пользователи), новые и завершённые попытки теста,
+    группы. None — теста нет.
+    """
+    event = _latest_event().subquery()
+    attempts = (
+        select(func.max(TestAttempt.id).label('last_id'),
+               func.count().filter(TestAttempt.finalized).label('finalized'),
+               func.max(TestAttempt.start_time).label('last_start'),
+               func.max(TestAttempt.end_time).filter(TestAttempt.finalized).label('last_finish'))
+        .where(TestAttempt.test_id == test_id)
+        .subquery()
+    )
+    row = db_session.execute(
+        select(Test.archived_at, attempts.c.last_id, attempts.c.finalized, attempts.c.last_start,
+               attempts.c.last_finish, select(event.c.id).scalar_subquery().label('event_id'),
+               select(event.c.created_at).scalar_subquery().label('event_time'),
+               select(func.count(Group.id)).scalar_subquery().label('groups'))
+        .join(attempts, true())  # Одна строка агрегатов
+        .where(Test.id == test_id)
+    ).first()
+    if row is None:
+        return None
+    changed = [moment for moment in (row.archived_at, row.last_start, row.last_finish, row.event_time)
+               if moment is not None]
+    return Watermark(('test', test_id, row.archived_at, row.last_id, row.finalized, row.event_id, row.groups),
+                     _utc(max(changed)) if changed else None)
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    body: bytes
+    headers: Tuple[Tuple[str, str], ...]
+
+
+class PageCache:
+    """
+    Отрисованные страницы и выгрузки по (адрес, ETag данных). Страница с
+    устаревшим ETag больше не запрашивается и вытесняется по LRU; общий объём
+    ограничен max_bytes. Потокобезопасен: Flask обрабатывает запросы в потоках.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], CachedPage]" = OrderedDict()
+        self._latest: Dict[str, str] = {}  # адрес -> ETag последней сохранённой версии
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str, etag: str) -> Optional[CachedPage]:
+        with self._lock:
+            page = self._entries.get((path, etag))
+            if page is not None:
+                self._entries.move_to_end((path, etag))
+            return page
+
+    def put(self, path: str, etag: str, page: CachedPage):
+        if len(page.body) > self.max_bytes:
+            return
+        with self._lock:
+            # Прежняя версия страницы больше не понадобится
+            previous = self._latest.get(path)
+            if previous is not None and previous != etag:
+                self._discard((path, previous))
+            self._discard((path, etag))
+            self._entries[(path, etag)] = page
+            self._latest[path] = etag
+            self._size += len(page.body)
+            while self._size > self.max_bytes:
+                key, _ = next(iter(self._entries.items()))
+                self._discard(key)
+
+    def _discard(self, key: Tuple[str, str]):
+        page = self._entries.pop(key, None)
+        if page is not None:
+            self._size -= len(page.body)
+            if self._latest.get(key[0]) == key[1]:
+                del self._latest[key[0]]
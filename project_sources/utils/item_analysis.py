@@ -0,0 +1,170 @@
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import func, or_, select
+
+from tools.models import AttemptAnswer, Question, TestAttempt
+
+# Попытка без ответов считается брошенной, если с её end_time прошло больше этого времени
+ABANDONED_ATTEMPT_GRACE = timedelta(minutes=10)
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+@dataclass
+class QuestionStats:
+    """Показатели вопроса по всем завершённым попыткам теста."""
+    question_id: int
+    responses: int
+    difficulty: Optional[float]  # Доля правильных ответов
+    discrimination: Optional[float]  # Точечно-бисериальная корреляция с баллом за остальные вопросы
+    option_shares: Dict[int, float] = field(default_factory=dict)  # {id варианта: доля выбравших}
+
+
+class ItemAnalysis:
+    """
+    Накопленная статистика вопросов одного теста.
+
+    Хранит только достаточные суммы по матрице «попытки × вопросы» (правильно = 1),
+    поэтому новые попытки добавляются без пересчёта старых. Суммы ведутся по
+    каждому вопросу отдельно: в тестах с банком вопросов попытка получает только
+    часть вопросов, и показатели вопроса считаются по попыткам, где он был.
+    """
+
+    def __init__(self, question_ids: Sequence[int], option_count: int):
+        self.question_ids = np.asarray(sorted(question_ids), dtype=np.int64)
+        self.option_count = option_count
+        k = len(self.question_ids)
+
+        self.attempts = 0
+        self.seen = np.zeros(k, dtype=np.int64)  # Попыток, в которых был вопрос
+        self.sum_x = np.zeros(k, dtype=np.int64)  # Правильных ответов на вопрос
+        self.sum_t = np.zeros(k, dtype=np.int64)  # Сумма баллов попыток, где был вопрос
+        self.sum_tt = np.zeros(k, dtype=np.int64)  # Сумма квадратов баллов попыток, где был вопрос
+        self.sum_xt = np.zeros(k, dtype=np.int64)  # Сумма баллов попыток, где вопрос решён верно
+        self.option_counts = np.zeros((k, option_count), dtype=np.int64)
+
+        # Граница инкрементальной загрузки: попытки с id <= watermark уже учтены,
+        # кроме pending — начатых, но ещё не завершённых к моменту прошлого пересчёта
+        self.watermark = 0
+        self.pending: Dict[int, datetime] = {}
+
+    def update(self, attempt_ids: np.ndarray, question_ids: np.ndarray,
+               option_masks: np.ndarray, correct: np.ndarray):
+        """Добавляет строки attempt_answers новых попыток (по одной строке на ответ)."""
+        known = np.isin(question_ids, self.question_ids)
+        attempt_ids, question_ids = attempt_ids[known], question_ids[known]
+        option_masks, correct = option_masks[known], correct[known]
+        if not len(attempt_ids):
+            return
+
+        _, attempt_index = np.unique(attempt_ids, return_inverse=True)
+        question_index = np.searchsorted(self.question_ids, question_ids)
+        k = len(self.question_ids)
+
+        matrix = np.zeros((attempt_index.max() + 1, k), dtype=np.int64)
+        matrix[attempt_index, question_index] = correct
+        presented = np.zeros_like(matrix)
+        presented[attempt_index, question_index] = 1
+        totals = matrix.sum(axis=1)
+
+        self.attempts += matrix.shape[0]
+        self.seen += presented.sum(axis=0)
+        self.sum_x += matrix.sum(axis=0)
+        self.sum_t += totals @ presented
+        self.sum_tt += (totals * totals) @ presented
+        self.sum_xt += totals @ matrix
+
+        for bit in range(self.option_count):
+            chosen = (option_masks >> bit) & 1
+            self.option_counts[:, bit] += np.bincount(question_index, weights=chosen, minlength=k).astype(np.int64)
+
+    def stats(self) -> List[QuestionStats]:
+        n = self.seen.astype(np.float64)
+
+        # Корреляция ответа на вопрос с баллом за остальные вопросы (rest = total - x)
+        sum_x = self.sum_x.astype(np.float64)
+        sum_r = self.sum_t - sum_x
+        sum_rr = self.sum_tt - 2 * self.sum_xt + sum_x
+        sum_xr = self.sum_xt - sum_x
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = sum_x / n
+            cov = sum_xr / n - p * (sum_r / n)
+            var_x = p * (1 - p)
+            var_r = sum_rr / n - (sum_r / n) ** 2
+            discrimination = cov / np.sqrt(var_x * var_r)
+            shares = self.option_counts / n[:, None]
+
+        return [
+            QuestionStats(int(qid), 0, None, None) if not self.seen[j] else
+            QuestionStats(
+                question_id=int(qid),
+                responses=int(self.seen[j]),
+                difficulty=float(p[j]),
+                discrimination=float(discrimination[j]) if np.isfinite(discrimination[j]) else None,
+                option_shares={bit + 1: float(shares[j, bit]) for bit in range(self.option_count)}
+            )
+            for j, qid in enumerate(self.question_ids)
+        ]
+
+
+_cache: Dict[int, ItemAnalysis] = {}
+_cache_lock = threading.Lock()
+
+
+def get_question_stats(db_session, test_id: int, questions: List[Question]) -> Dict[int, QuestionStats]:
+    """
+    Возвращает статистику вопросов теста {question_id: QuestionStats}.
+
+    Статистика кэшируется в процессе и при каждом вызове дополняется только
+    попытками, завершёнными после прошлого вызова. Изменение набора вопросов
+    сбрасывает кэш теста.
+    """
+    question_ids = sorted(question.id for question in questions)
+    option_count = max([len(question.options or []) for question in questions] + [0])
+
+    with _cache_lock:
+        analysis = _cache.get(test_id)
+        if (analysis is None or analysis.question_ids.tolist() != question_ids
+                or analysis.option_count != option_count):
+            analysis = ItemAnalysis(question_ids, option_count)
+            _cache[test_id] = analysis
+
+        new_attempts = or_(TestAttempt.id > analysis.watermark, TestAttempt.id.in_(list(analysis.pending)))
+        candidates = db_session.execute(
+            select(TestAttempt.id, TestAttempt.end_time)
+            .where(TestAttempt.test_id == test_id, new_attempts)
+        ).all()
+        if not candidates:
+            return {stats.question_id: stats for stats in analysis.stats()}
+
+        # Ответы читаем только для уже отобранных попыток: созданные между запросами попадут в следующий вызов
+        last_candidate_id = max(attempt_id for attempt_id, _ in candidates)
+        rows = db_session.execute(
+            select(AttemptAnswer.attempt_id, AttemptAnswer.question_id,
+                   func.coalesce(AttemptAnswer.option_mask, 0), AttemptAnswer.correct)
+            .join(TestAttempt, TestAttempt.id == AttemptAnswer.attempt_id)
+            .where(TestAttempt.test_id == test_id, new_attempts, TestAttempt.id <= last_candidate_id)
+        ).all()
+
+        if rows:
+            columns = np.array(rows, dtype=np.int64)
+            analysis.update(columns[:, 0], columns[:, 1], columns[:, 2], columns[:, 3])
+
+        # Попытки без ответов ещё идут; брошенные перестаём ждать после ABANDONED_ATTEMPT_GRACE
+        answered = {row[0] for row in rows}
+        deadline = current_time() - ABANDONED_ATTEMPT_GRACE
+        for attempt_id, end_time in candidates:
+            analysis.pending.pop(attempt_id, None)
+            if attempt_id not in answered and end_time > deadline:
+                analysis.pending[attempt_id] = end_time
+            analysis.watermark = max(analysis.watermark, attempt_id)
+
+        return {stats.question_id: stats for stats in analysis.stats()}
@@ -0,0 +1,105 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Ограничение длины одного значения в структурированных полях
+FIELD_VALUE_LIMIT = 200
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class LogFields:
+    """
+    Структурированные поля записи журнала в виде key=value.
+
+    Передаётся аргументом %-форматирования, поэтому значения превращаются
+    в строку, только если запись прошла проверку уровня и фильтры.
+    """
+
+    __slots__ = ('fields',)
+
+    def __init__(self, **fields: Any):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        parts = []
+        for key, value in self.fields.items():
+            text = str(value)
+            if len(text) > FIELD_VALUE_LIMIT:
+                text = text[:FIELD_VALUE_LIMIT] + '…'
+            parts.append(f'{key}={text}')
+        return ' '.join(parts)
+
+
+def state_fields(user_data: Dict[str, Any]) -> LogFields:
+    """Краткая сводка FSM-данных прохождения теста вместо полного словаря с вопросами."""
+    return LogFields(
+        attempt=user_data.get('test_attempt_id'),
+        index=user_data.get('current_index'),
+        questions=len(user_data.get('questions') or ()),
+        answers=len(user_data.get('answers') or ()),
+        editing=user_data.get('editing_question_id'),
+    )
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает частые записи: запись с extra={'sample_every': N} пропускается
+    один раз из N. Счёт ведётся отдельно для каждого места вызова.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._counters: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, 'sample_every', 1)
+        if every <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            seen = self._counters.get(key, 0)
+            self._counters[key] = seen + 1
+        if seen % every:
+            return False
+        record.msg = f'{record.msg} [1 из {every}]'
+        return True
+
+
+def create_queue_handler(stream=None) -> Tuple[logging.handlers.QueueHandler, logging.handlers.QueueListener]:
+    """Обработчик, ставящий записи в очередь, и слушатель, пишущий их в stream в отдельном потоке."""
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    return queue_handler, listener
+
+
+def setup_logging(level: str = 'INFO') -> logging.handlers.QueueListener:
+    """
+    Настраивает корневой логгер процесса.
+
+    Обработчики модулей только ставят запись в очередь; форматирование вывода
+    и запись в поток выполняет отдельный поток QueueListener, так что event loop
+    не блокируется на I/O журнала.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    queue_handler, _listener = create_queue_handler()
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
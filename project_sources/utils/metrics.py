@@ -0,0 +1,337 @@
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter as StatementCounter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...]) -> str:
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Монотонный счётчик с метками в формате Prometheus."""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in values]
+
+
+class Gauge(Counter):
+    """Значение, которое может как расти, так и уменьшаться."""
+
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами в формате Prometheus."""
+
+    type_name = 'histogram'
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # [счётчики корзин..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(bucket_values)) for key, bucket_values in self._values.items()]
+        lines = []
+        for key, bucket_values in values:
+            for bound, bucket_count in zip(self.buckets, bucket_values):
+                labels = _format_labels(self.labelnames + ('le',), key + (repr(bound),))
+                lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+            labels = _format_labels(self.labelnames + ('le',), key + ('+Inf',))
+            lines.append(f'{self.name}_bucket{labels} {bucket_values[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {bucket_values[-2]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {bucket_values[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+requests_total = registry.register(Counter(
+    'app_requests_total', 'Обработанные апдейты бота или HTTP-запросы', ['endpoint']))
+db_queries_total = registry.register(Counter(
+    'db_queries_total', 'Выполненные SQL-запросы', ['endpoint']))
+db_rows_total = registry.register(Counter(
+    'db_rows_total', 'Строки, возвращённые или изменённые SQL-запросами', ['endpoint']))
+db_time_seconds_total = registry.register(Counter(
+    'db_time_seconds_total', 'Время выполнения SQL-запросов', ['endpoint']))
+db_repeated_statements_total = registry.register(Counter(
+    'db_repeated_statements_total', 'Срабатывания детектора N+1 запросов', ['endpoint']))
+
+
+update_latency_seconds = registry.register(Histogram(
+    'bot_update_latency_seconds', 'Полное время обработки апдейта', ['route']))
+update_db_seconds = registry.register(Histogram(
+    'bot_update_db_seconds', 'Время SQL-запросов за апдейт', ['route']))
+update_api_seconds = registry.register(Histogram(
+    'bot_update_telegram_api_seconds', 'Время запросов к Telegram API за апдейт', ['route']))
+telegram_api_seconds_total = registry.register(Counter(
+    'telegram_api_seconds_total', 'Время запросов к Telegram API', ['method']))
+telegram_api_calls_total = registry.register(Counter(
+    'telegram_api_calls_total', 'Запросы к Telegram API', ['method']))
+db_sessions_total = registry.register(Counter(
+    'bot_db_sessions_total', 'Апдейты по обработчикам: used="true" — обработчик открывал сессию БД',
+    ['endpoint', 'used']))
+db_early_releases_total = registry.register(Counter(
+    'bot_db_early_releases_total', 'Соединения, отданные в пул перед запросом к Telegram API', ['endpoint']))
+
+replica_lag_seconds = registry.register(Gauge(
+    'db_replica_lag_seconds', 'Отставание реплики по последней проверке'))
+read_routing_total = registry.register(Counter(
+    'db_read_routing_total', 'Сессии только для чтения по выбранной базе', ['target', 'reason']))
+
+admission_total = registry.register(Counter(
+    'bot_admission_total', 'Запросы к ограниченным участкам: admitted — сразу, queued — после очереди, '
+    'queue_full / timeout / pool_saturated — отказ', ['controller', 'result']))
+admission_queue_length = registry.register(Gauge(
+    'bot_admission_queue_length', 'Длина очереди ожидающих допуска', ['controller']))
+
+countdown_edits_total = registry.register(Counter(
+    'bot_countdown_edits_total', 'Правки оставшегося времени в сообщениях с вопросами', ['result']))
+
+handoff_chats_total = registry.register(Counter(
+    'bot_handoff_chats_total', 'Чаты, переданные другим рабочим процессам (export) и принятые от них (import)',
+    ['direction']))
+front_updates_total = registry.register(Counter(
+    'front_updates_total', 'Апдейты, пересланные рабочим процессам; worker="lost" — не доставлены', ['worker']))
+front_rebalances_total = registry.register(Counter(
+    'front_rebalances_total', 'Перераспределения чатов при изменении состава рабочих процессов'))
+
+fsm_chats = registry.register(Gauge(
+    'bot_fsm_chats', 'Чаты с состоянием FSM в памяти по состояниям', ['state']))
+fsm_state_bytes = registry.register(Gauge(
+    'bot_fsm_state_bytes', 'Размер состояния FSM в pickle: total — всех чатов, max — самого большого чата',
+    ['kind']))
+fsm_evictions_total = registry.register(Counter(
+    'bot_fsm_evictions_total', 'Состояния чатов, удалённые из памяти: idle — по простою, capacity — сверх лимита',
+    ['reason']))
+
+cache_events_total = registry.register(Counter(
+    'bot_cache_events_total', 'События шины сброса кэшей: via="notify" — уведомлением, "recovery" — дочитаны из журнала',
+    ['kind', 'via']))
+cache_event_lag_seconds = registry.register(Histogram(
+    'bot_cache_event_lag_seconds', 'Задержка доставки уведомления шины кэшей от публикации в админке', ['kind'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+cache_event_recoveries_total = registry.register(Counter(
+    'bot_cache_event_recoveries_total', 'Восстановления шины кэшей: gap — пропуск в номерах событий, reconnect — '
+    'после разрыва, truncated и subscribe — со сбросом кэшей целиком', ['reason']))
+
+admin_pages_total = registry.register(Counter(
+    'admin_pages_total', 'Условные GET админки: not_modified — ответ 304, hit — страница из кэша, render — отрисована',
+    ['endpoint', 'result']))
+
+startup_seconds = registry.register(Gauge(
+    'process_startup_seconds', 'Время запуска процесса по этапам: import — импорт модулей, setup — настройка',
+    ['phase']))
+
+# Сколько событий (SQL и вызовов API) запоминать на апдейт для разбора медленных апдейтов
+TIMELINE_LIMIT = 200
+
+
+class RequestScope:
+    """Счётчики запросов к БД и Telegram API в рамках одного апдейта бота или HTTP-запроса."""
+
+    def __init__(self, endpoint: str, repeat_threshold: int, route: Optional[str] = None):
+        self.endpoint = endpoint
+        self.route = route or endpoint
+        self.repeat_threshold = repeat_threshold
+        self.started = time.perf_counter()
+        self.elapsed: Optional[float] = None  # Заполняется в end_scope
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+        self.statements: StatementCounter = StatementCounter()
+        self.reported_statements = set()
+        self.timeline: List[Tuple[float, str, float, str]] = []  # (начало, вид, длительность, описание)
+
+    def record(self, kind: str, started: float, elapsed: float, description: str):
+        if len(self.timeline) < TIMELINE_LIMIT:
+            self.timeline.append((started - self.started, kind, elapsed, description))
+
+    def __str__(self) -> str:
+        """Подробная раскладка времени апдейта для журнала."""
+        total = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        other = max(total - self.db_time - self.api_time, 0.0)
+        title = self.route if self.route == self.endpoint else f"{self.route} ({self.endpoint})"
+        lines = [
+            f"{title} {total * 1000:.0f} мс: "
+            f"БД {self.db_time * 1000:.0f} мс ({self.queries} запросов), "
+            f"Telegram API {self.api_time * 1000:.0f} мс ({self.api_calls} вызовов), "
+            f"прочее {other * 1000:.0f} мс"
+        ]
+        for offset, kind, elapsed, description in self.timeline:
+            lines.append(f"  +{offset * 1000:7.1f} мс {kind:<3} {elapsed * 1000:7.1f} мс  {description}")
+        return "\n".join(lines)
+
+
+current_scope: contextvars.ContextVar[Optional[RequestScope]] = contextvars.ContextVar(
+    'metrics_request_scope', default=None)
+
+# Списки параметров IN (...) разворачиваются в разное число плейсхолдеров — сводим их к одному
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\$\d+|\?|%\(\w+\)s|%s)\s*,)+\s*(?:\$\d+|\?|%\(\w+\)s|%s)\s*\)')
+
+
+def normalize_statement(statement: str) -> str:
+    return _PLACEHOLDER_LIST.sub('(?)', ' '.join(statement.split()))
+
+
+def begin_scope(endpoint: str, repeat_threshold: int, route: Optional[str] = None) -> contextvars.Token:
+    requests_total.inc(endpoint=endpoint)
+    return current_scope.set(RequestScope(endpoint, repeat_threshold, route))
+
+
+def end_scope(token: contextvars.Token) -> Optional[RequestScope]:
+    scope = current_scope.get()
+    current_scope.reset(token)
+    scope.elapsed = time.perf_counter() - scope.started
+    return scope
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_start_time'].pop()
+    elapsed = time.perf_counter() - started
+    rows = max(cursor.rowcount, 0) if cursor is not None else 0
+
+    scope = current_scope.get()
+    endpoint = scope.endpoint if scope else 'background'
+    db_queries_total.inc(endpoint=endpoint)
+    db_rows_total.inc(rows, endpoint=endpoint)
+    db_time_seconds_total.inc(elapsed, endpoint=endpoint)
+
+    if scope is None:
+        return
+    scope.queries += 1
+    scope.rows += rows
+    scope.db_time += elapsed
+
+    normalized = normalize_statement(statement)
+    scope.statements[normalized] += 1
+    scope.record('SQL', started, elapsed, normalized[:120])
+    if scope.statements[normalized] > scope.repeat_threshold and normalized not in scope.reported_statements:
+        scope.reported_statements.add(normalized)
+        db_repeated_statements_total.inc(endpoint=endpoint)
+        logger.warning(
+            "Возможный N+1 в %s: запрос выполнен больше %s раз за один запрос: %s",
+            endpoint, scope.repeat_threshold, normalized[:200])
+
+
+def record_api_call(method: str, started: float, elapsed: float):
+    """Учитывает запрос к Telegram API в метриках и в текущем апдейте."""
+    telegram_api_calls_total.inc(method=method)
+    telegram_api_seconds_total.inc(elapsed, method=method)
+    scope = current_scope.get()
+    if scope is not None:
+        scope.api_calls += 1
+        scope.api_time += elapsed
+        scope.record('API', started, elapsed, method)
+
+
+def _handle_error(exception_context):
+    # Для упавшего запроса after_cursor_execute не вызывается — снимаем его время начала
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+
+def instrument_engine(engine):
+    """Подключает счётчики запросов к движку (синхронному или AsyncEngine)."""
+    sync_engine: Engine = getattr(engine, 'sync_engine', engine)
+    event.listen(sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', _handle_error)
+    return engine
+
+
+async def start_metrics_server(port: int, host: str = '0.0.0.0'):
+    """Поднимает в текущем event loop HTTP-сервер с эндпоинтом /metrics."""
+    from aiohttp import web
+
+    async def metrics_handler(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
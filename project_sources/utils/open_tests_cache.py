@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import exists, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from tools.models import Group, Test, test_groups
+from utils.cache_bus import CacheEvent, EventKind
+
+logger = logging.getLogger(__name__)
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+@dataclass(frozen=True)
+class OpenTest:
+    """Снимок открытого теста, достаточный для построения списка доступных тестов."""
+    id: int
+    test_name: str
+    expiry_date: Optional[datetime]
+    number_of_attempts: int
+
+
+class OpenTestsCache:
+    """
+    Кэш открытых тестов по группам.
+
+    Запись группы живёт до ближайшего expiry_date среди её тестов (но не дольше max_age)
+    и удаляется, когда админка меняет тест, доступный этой группе (utils.cache_bus).
+
+    Если тесты читаются с реплики, она может получить изменение позже уведомления;
+    записи, загруженные в течение settle_time после сброса, живут только до конца
+    этого окна, чтобы не закэшировать устаревшие данные на max_age.
+    """
+
+    def __init__(self, max_age: timedelta = timedelta(minutes=5), settle_time: timedelta = timedelta(0)):
+        self.max_age = max_age
+        self.settle_time = settle_time
+        self._invalidated_at = datetime.min
+        self._entries: Dict[str, Tuple[List[OpenTest], datetime]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._generation = 0
+
+    async def get(self, session: AsyncSession, group_name: str) -> List[OpenTest]:
+        tests = self._get_fresh(group_name)
+        if tests is not None:
+            return tests
+
+        # Одновременные запросы одной группы ждут единственной загрузки из БД
+        lock = self._locks.setdefault(group_name, asyncio.Lock())
+        async with lock:
+            tests = self._get_fresh(group_name)
+            if tests is None:
+                generation = self._generation
+                tests, valid_until = await self._load(session, group_name)
+                # Если тест изменили во время загрузки, список мог устареть — не кэшируем его
+                if generation == self._generation:
+                    self._entries[group_name] = (tests, valid_until)
+                    logger.debug("Кэш открытых тестов группы %s: %s тестов до %s",
+                                 group_name, len(tests), valid_until)
+            return tests
+
+    def invalidate(self, group_name: Optional[str] = None):
+        self._generation += 1
+        self._invalidated_at = current_time()
+        if group_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(group_name, None)
+
+    def on_cache_event(self, event: CacheEvent):
+        if event.kind is not EventKind.TEST_CHANGED:
+            return
+        if event.groups is None:
+            self.invalidate()
+        for group_name in event.groups or ():
+            self.invalidate(group_name)
+
+    def _get_fresh(self, group_name: str) -> Optional[List[OpenTest]]:
+        entry = self._entries.get(group_name)
+        if entry is None:
+            return None
+        tests, valid_until = entry
+        if current_time() >= valid_until:
+            self._entries.pop(group_name, None)
+            return None
+        return tests
+
+    async def _load(self, session: AsyncSession, group_name: str) -> Tuple[List[OpenTest], datetime]:
+        now = current_time()
+        group_id = select(Group.id).where(Group.groupname == group_name).scalar_subquery()
+        stmt = (
+            select(Test.id, Test.test_name, Test.expiry_date, Test.number_of_attempts)
+            .where(
+                (Test.expiry_date == None) | (Test.expiry_date > now),
+                Test.question_count > 0,
+                or_(
+                    ~exists().where(test_groups.c.test_id == Test.id),
+                    exists().where(test_groups.c.test_id == Test.id, test_groups.c.group_id == group_id)
+                )
+            )
+            .order_by(Test.id)
+        )
+        result = await session.execute(stmt)
+        tests = [OpenTest(*row) for row in result.all()]
+
+        expiry_dates = [test.expiry_date for test in tests if test.expiry_date]
+        valid_until = min([now + self.max_age, *expiry_dates])
+        if now < self._invalidated_at + self.settle_time:
+            valid_until = min(valid_until, self._invalidated_at + self.settle_time)
+        return tests, valid_until
+
+
+open_tests_cache = OpenTestsCache()
@@ -0,0 +1,65 @@
+import hashlib
+import secrets
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence
+
+from tools.models import Question, TestAttempt
+from utils.test_versions import VersionBank
+
+
+def new_attempt_seed() -> int:
+    """Зерно выборки вопросов для новой попытки (помещается в BIGINT)."""
+    return secrets.randbits(63)
+
+
+def _rank(seed: int, *parts: int) -> bytes:
+    # Не random.Random: порядок не должен зависеть от версии Python, на которой попытку пересматривают
+    return hashlib.blake2b(":".join(map(str, (seed, *parts))).encode(), digest_size=8).digest()
+
+
+def attempt_size(question_count: int, bank_size: int) -> int:
+    """Сколько вопросов получает попытка: question_count из банка, но не больше, чем в нём есть."""
+    return min(question_count, bank_size)
+
+
+def draw_questions(bank: Sequence[Question], count: int, seed: Optional[int],
+                   shuffle: bool = False) -> List[Question]:
+    """
+    Вопросы попытки из банка теста, однозначно заданные зерном.
+
+    Вопрос получает ранг — хеш (seed, id вопроса), и попытке достаются count
+    вопросов с наименьшим рангом, поэтому выборку можно повторить в любой момент,
+    не храня её. Если банк не больше count и shuffle выключен, вопросы идут в
+    порядке банка, как в обычном тесте. Без зерна (попытки до появления банков)
+    берутся первые count вопросов. Возвращаются ссылки на объекты банка, без копий.
+    """
+    if seed is None or (count >= len(bank) and not shuffle):
+        return list(bank[:count])
+    ranked = sorted(bank, key=lambda question: _rank(seed, question.id))[:count]
+    if shuffle:
+        return ranked
+    # Выборка из большого банка без перемешивания сохраняет порядок банка
+    order = {id(question): index for index, question in enumerate(bank)}
+    return sorted(ranked, key=lambda question: order[id(question)])
+
+
+def attempt_questions(bank: VersionBank, attempt: TestAttempt,
+                      recorded_ids: AbstractSet[int] = frozenset()) -> List[Question]:
+    """
+    Вопросы попытки для просмотра из версии теста, которую она проходила.
+    Состав берётся из записанных ответов attempt_answers (recorded_ids), если они
+    есть: у версий до test_versions question_count мог с тех пор измениться.
+    Порядок — по зерну.
+    """
+    questions = bank.questions
+    if recorded_ids:
+        questions = [question for question in questions if question.id in recorded_ids]
+        return draw_questions(questions, len(questions), attempt.seed, bank.shuffle)
+    return draw_questions(questions, attempt_size(bank.question_count, len(questions)), attempt.seed, bank.shuffle)
+
+
+def ordered_options(question: Question, seed: Optional[int], shuffle: bool = False) -> List[Dict[str, Any]]:
+    """Варианты ответа в порядке показа в попытке. Ответы по-прежнему хранятся по id варианта."""
+    options = question.options or []
+    if seed is None or not shuffle:
+        return options
+    return sorted(options, key=lambda option: _rank(seed, question.id, option['id']))
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Hashable, Optional
+
+from sqlalchemy import text
+
+from utils.metrics import read_routing_total, replica_lag_seconds
+
+logger = logging.getLogger(__name__)
+
+# Отставание реплики в секундах. Если реплика применила всё полученное, отставания нет,
+# даже когда последняя транзакция была давно; не реплика (pg_is_in_recovery() = false) — ноль
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReplicaRouting:
+    """
+    Выбор базы для сессий только для чтения: реплика, если она доступна и отстаёт
+    не больше чем на max_lag секунд, иначе основная база.
+
+    Отставание проверяется не чаще раза в check_interval секунд, остальные
+    запросы пользуются последним результатом. Пользователь, только что
+    записавший данные, закрепляется за основной базой на pin_seconds, чтобы
+    сразу видеть свои изменения.
+    """
+
+    def __init__(self, engine, max_lag: float, check_interval: float, pin_seconds: float):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pin_seconds = pin_seconds
+        self.lag: Optional[float] = None
+        self._usable = False
+        self._checked_at = float('-inf')
+        self._pins: Dict[Hashable, float] = {}
+
+    def pin(self, key: Hashable):
+        now = time.monotonic()
+        self._pins[key] = now + self.pin_seconds
+        if len(self._pins) > 1000:
+            self._pins = {pinned: until for pinned, until in self._pins.items() if until > now}
+
+    def is_pinned(self, key: Hashable) -> bool:
+        until = self._pins.get(key)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            self._pins.pop(key, None)
+            return False
+        return True
+
+    def _check_due(self) -> bool:
+        return time.monotonic() - self._checked_at >= self.check_interval
+
+    def _record(self, lag: Optional[float], error: Optional[Exception] = None):
+        self._checked_at = time.monotonic()
+        usable = lag is not None and lag <= self.max_lag
+        if usable != self._usable:
+            if usable:
+                logger.info("Чтение переключено на реплику (отставание %.1f с)", lag)
+            elif error is not None:
+                logger.warning("Реплика недоступна, чтение идёт с основной базы: %s", error)
+            else:
+                logger.warning("Реплика отстаёт на %.1f с, чтение идёт с основной базы", lag)
+        self.lag = lag
+        self._usable = usable
+        if lag is not None:
+            replica_lag_seconds.set(lag)
+
+    def _decide(self, pinned: bool) -> bool:
+        if pinned:
+            reason = 'pinned'
+        elif self._checked_at == float('-inf'):
+            reason = 'unchecked'
+        elif not self._usable:
+            reason = 'unavailable' if self.lag is None else 'lag'
+        else:
+            read_routing_total.inc(target='replica', reason='ok')
+            return True
+        read_routing_total.inc(target='primary', reason=reason)
+        return False
+
+
+class AsyncReplicaRouting(ReplicaRouting):
+    """ReplicaRouting для AsyncEngine бота."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = asyncio.Lock()
+
+    async def use_replica(self, pinned: bool = False) -> bool:
+        if not pinned and self._check_due() and not self._lock.locked():
+            async with self._lock:
+                try:
+                    async with self.engine.connect() as connection:
+                        lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar()
+                    self._record(float(lag))
+                except Exception as e:
+                    self._record(None, e)
+        return self._decide(pinned)
+
+
+class SyncReplicaRouting(ReplicaRouting):
+    """ReplicaRouting для синхронного Engine админки."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def use_replica(self, pinned: bool = False) -> bool:
+        if not pinned and self._check_due() and self._lock.acquire(blocking=False):
+            try:
+                with self.engine.connect() as connection:
+                    lag = connection.execute(REPLICA_LAG_QUERY).scalar()
+                self._record(float(lag))
+            except Exception as e:
+                self._record(None, e)
+            finally:
+                self._lock.release()
+        return self._decide(pinned)
@@ -0,0 +1,57 @@
+from typing import List
+
+from sqlalchemy import case, func, select, update
+
+from tools.models import AttemptAnswer, Question, Test, TestAttempt
+from utils.answer_matchers import compile_matcher
+from utils.test_versions import lineage
+
+# Сколько попыток пересчитывать одним UPDATE
+RESCORE_BATCH = 1000
+
+
+def rescore_text_question(db_session, question: Question) -> int:
+    """
+    Перепроверяет сохранённые ответы на текстовый вопрос во всех его версиях по
+    right_answer вопроса question и пересчитывает баллы попыток, где проверка
+    изменилась. Баллы за ответ — по весу той версии вопроса, которую проходила
+    попытка, иначе балл разошёлся бы с её max_score. Коммит — за вызывающим.
+    Возвращает число изменённых ответов.
+    """
+    matcher = compile_matcher(question.right_answer or "")
+    rows = db_session.execute(
+        select(AttemptAnswer.attempt_id, AttemptAnswer.question_id, AttemptAnswer.text_answer,
+               AttemptAnswer.correct, AttemptAnswer.points, Question.weight)
+        .join(Question, Question.id == AttemptAnswer.question_id)
+        .where(lineage(question))
+    ).all()
+    changed = []
+    for attempt_id, question_id, text_answer, correct, points, weight in rows:
+        verdict = matcher(text_answer)
+        # Баллы тоже сверяются: у старых ответов их могло не быть
+        if verdict != correct or points != (weight if verdict else 0):
+            changed.append({"attempt_id": attempt_id, "question_id": question_id, "correct": verdict,
+                            "points": weight if verdict else 0})
+    if changed:
+        db_session.execute(update(AttemptAnswer), changed)
+        rescore_attempts(db_session, [row["attempt_id"] for row in changed])
+    return len(changed)
+
+
+def rescore_attempts(db_session, attempt_ids: List[int]):
+    """Балл попытки — сумма баллов ответов в attempt_answers (у старых ответов без баллов — 1 за верный)."""
+    points = func.coalesce(AttemptAnswer.points, case((AttemptAnswer.correct, 1), else_=0))
+    score = (select(func.coalesce(func.sum(points), 0)).where(AttemptAnswer.attempt_id == TestAttempt.id)
+             .scalar_subquery())
+    # В attempt_answers есть строка на каждый вопрос попытки, в том числе без ответа
+    max_score = (select(func.sum(Question.weight)).select_from(AttemptAnswer)
+                 .join(Question, Question.id == AttemptAnswer.question_id)
+                 .where(AttemptAnswer.attempt_id == TestAttempt.id).scalar_subquery())
+    need_to_pass = select(Test.scores_need_to_pass).where(Test.id == TestAttempt.test_id).scalar_subquery()
+    for start in range(0, len(attempt_ids), RESCORE_BATCH):
+        db_session.execute(
+            update(TestAttempt)
+            .where(TestAttempt.id.in_(attempt_ids[start:start + RESCORE_BATCH]))
+            .values(score=score, max_score=max_score, passed=score >= need_to_pass)
+            .execution_options(synchronize_session=False)
+        )
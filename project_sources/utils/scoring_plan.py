@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Optional, Sequence, Tuple
+
+from tools.models import Question, Test
+from utils.answer_matchers import compile_matcher
+from utils.attempt_answers import option_ids_to_mask
+from utils.test_versions import VersionBank
+
+SINGLE_CHOICE = 'single_choice'
+MULTIPLE_CHOICE = 'multiple_choice'
+TEXT_INPUT = 'text_input'
+
+# Сколько планов (тест, версия) держать в памяти
+PLAN_CACHE_SIZE = 256
+
+
+@dataclass(frozen=True)
+class QuestionRule:
+    """Правило оценки одного вопроса, собранное заранее."""
+    key: str  # id вопроса строкой — ключ ответа в FSM
+    kind: str
+    weight: int
+    correct_answer: str = ""  # Одиночный выбор: номер правильного варианта
+    correct_ids: FrozenSet[str] = frozenset()  # Множественный выбор: номера правильных вариантов
+    correct_mask: int = 0  # Множественный выбор: те же варианты битами (бит id - 1)
+    partial_credit: bool = False  # Множественный выбор: доля балла за частично верный ответ
+    matcher: Optional[Callable[[Optional[str]], bool]] = None  # Текстовый вопрос
+
+    def points(self, user_answer: Any) -> int:
+        if self.kind == SINGLE_CHOICE:
+            return self.weight if str(user_answer) == self.correct_answer else 0
+        if self.kind == MULTIPLE_CHOICE:
+            # В FSM ответ на множественный выбор — строка из номеров вариантов, например "13"
+            user_answer = str(user_answer)
+            if frozenset(user_answer) == self.correct_ids:
+                return self.weight
+            if not self.partial_credit or not self.correct_ids:
+                return 0
+            # Верно отмеченные минус ошибочно отмеченные, не меньше нуля; балл округляется вниз
+            mask = option_ids_to_mask(user_answer)
+            right = bin(mask & self.correct_mask).count('1')
+            wrong = bin(mask & ~self.correct_mask).count('1')
+            return max(0, right - wrong) * self.weight // len(self.correct_ids)
+        if self.kind == TEXT_INPUT:
+            return self.weight if self.matcher(user_answer) else 0
+        return 0
+
+
+def compile_rule(question: Question) -> QuestionRule:
+    key = str(question.id)
+    weight = question.weight if question.weight is not None else 1
+    right_answer = question.right_answer or ""
+    if question.question_type == SINGLE_CHOICE:
+        return QuestionRule(key, SINGLE_CHOICE, weight, correct_answer=right_answer)
+    if question.question_type == MULTIPLE_CHOICE:
+        return QuestionRule(key, MULTIPLE_CHOICE, weight, correct_ids=frozenset(right_answer),
+                            correct_mask=option_ids_to_mask(right_answer),
+                            partial_credit=bool(question.partial_credit))
+    if question.question_type == TEXT_INPUT:
+        return QuestionRule(key, TEXT_INPUT, weight, matcher=compile_matcher(right_answer))
+    return QuestionRule(key, question.question_type, weight)
+
+
+@dataclass(frozen=True)
+class AttemptScore:
+    score: int
+    max_score: int
+    passed: bool
+    detailed_answers: Dict[str, Dict[str, Any]]
+
+
+class ScoringPlan:
+    """
+    Правила оценки всех вопросов банка теста: маски правильных вариантов, веса,
+    частичный зачёт и проверки текстовых ответов разобраны один раз на версию
+    теста, а завершение попытки — один проход по её вопросам.
+    """
+
+    def __init__(self, questions: Sequence[Question]):
+        self.rules: Dict[int, QuestionRule] = {question.id: compile_rule(question) for question in questions}
+
+    def score(self, test: Test, user_answers: Dict[str, Any], questions: Sequence[Question]) -> AttemptScore:
+        """
+        :param user_answers: Ответы из FSM {question_id: user_answer}.
+        :param questions: Вопросы попытки (выборка из банка, см. utils.question_pool).
+        """
+        total = 0
+        max_score = 0
+        detailed_answers = {}
+        rules = self.rules
+        for question in questions:
+            rule = rules.get(question.id)
+            if rule is None:
+                # Вопрос попытки не из этой версии банка
+                rule = compile_rule(question)
+            user_answer = user_answers.get(rule.key)
+            weight = rule.weight
+            points = 0 if user_answer is None else rule.points(user_answer)
+            total += points
+            max_score += weight
+            detailed_answers[rule.key] = {
+                'user_answer': user_answer,
+                'correct': user_answer is not None and points == weight,
+                'points': points,
+            }
+        passing_score = test.scores_need_to_pass if hasattr(test, 'scores_need_to_pass') else 0
+        return AttemptScore(total, max_score, total >= passing_score, detailed_answers)
+
+
+_plans: "OrderedDict[Tuple[int, int], ScoringPlan]" = OrderedDict()
+
+
+def scoring_plan(bank: VersionBank) -> ScoringPlan:
+    """План оценки версии теста из кэша по (id теста, версия). Версия не меняется, поэтому план не сбрасывается."""
+    key = (bank.test_id, bank.version)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = ScoringPlan(bank.questions)
+        if len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    else:
+        _plans.move_to_end(key)
+    return plan
@@ -0,0 +1,27 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Флаги в session.info: в текущей транзакции / за время жизни сессии был flush с изменениями
+HAS_WRITES = "has_flushed_writes"
+WROTE = "wrote"
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_writes(session, flush_context):
+    session.info[HAS_WRITES] = True
+    session.info[WROTE] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _clear_writes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(HAS_WRITES, None)
+
+
+def mark_written(session):
+    """
+    Отмечает запись текстовым запросом, который не проходит через flush: транзакцию
+    не отдают в пул досрочно, а пользователь затем читает с основной базы.
+    """
+    session.info[HAS_WRITES] = True
+    session.info[WROTE] = True
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import pickle
+import signal
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+import aiohttp
+from aiohttp import web
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.future import select
+
+from tools.models import BotWorker, FsmHandoff
+from utils.hash_ring import HashRing
+from utils.metrics import front_rebalances_total, front_updates_total, handoff_chats_total
+
+logger = logging.getLogger(__name__)
+
+# Поля апдейта, в которых чат лежит не в самом событии, а во вложенном сообщении
+NESTED_MESSAGE_FIELDS = ("message",)
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """id чата апдейта Telegram в виде JSON; для событий без чата — id пользователя."""
+    for field, event in update.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        if "chat" in event:
+            return event["chat"]["id"]
+        for nested in NESTED_MESSAGE_FIELDS:
+            if isinstance(event.get(nested), dict) and "chat" in event[nested]:
+                return event[nested]["chat"]["id"]
+        if "from" in event:
+            return event["from"]["id"]
+    return 0
+
+
+class ShardWorker:
+    """
+    Рабочий процесс бота в режиме шардирования (BOT_MODE=worker).
+
+    Апдейты приходят от front.py по HTTP (POST /update); front выбирает процесс
+    консистентным хешированием id чата, поэтому FSM-состояние и таймеры чата
+    живут в памяти одного процесса. Процесс регистрируется в таблице
+    bot_workers и обновляет heartbeat_at.
+
+    Когда состав процессов меняется, front приостанавливает раздачу апдейтов
+    и вызывает POST /handoff с новым списком: каждый процесс записывает в
+    fsm_handoff состояние чатов, которые теперь принадлежат другим, и забывает
+    их. Новый владелец забирает состояние из БД при первом апдейте чата.
+    При остановке процесс помечает себя leaving и ждёт такого вызова, а если
+    front не ответил за leave_timeout — выгружает все чаты сам.
+    """
+
+    def __init__(self, name: str, url: str, dp: Dispatcher, bot: Bot, session_maker: async_sessionmaker,
+                 on_export: Callable[[int], Any], on_import: Callable[[Bot, FSMContext], Awaitable[Any]],
+                 heartbeat_interval: float, leave_timeout: float):
+        if not isinstance(dp.storage, MemoryStorage):
+            raise TypeError("ShardWorker передаёт состояние только для MemoryStorage")
+        self.name = name
+        self.url = url
+        self.dp = dp
+        self.bot = bot
+        self.storage: MemoryStorage = dp.storage
+        self.session_maker = session_maker
+        self.on_export = on_export
+        self.on_import = on_import
+        self.heartbeat_interval = heartbeat_interval
+        self.leave_timeout = leave_timeout
+        self._checked: Set[int] = set()  # Чаты, для которых переданное состояние уже искали
+        self._importing: Dict[int, asyncio.Task] = {}
+        self._inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._released = asyncio.Event()
+
+    def web_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/update', self._handle_update)
+        app.router.add_post('/handoff', self._handle_handoff)
+        return app
+
+    async def run(self, host: str, port: int):
+        await self._upsert(leaving=False)
+        heartbeat = asyncio.create_task(self._heartbeat())
+        runner = web.AppRunner(self.web_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Рабочий процесс %s принимает апдейты на %s", self.name, self.url)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+
+        heartbeat.cancel()
+        await self.leave()
+        await runner.cleanup()
+
+    async def leave(self):
+        await self._upsert(leaving=True)
+        try:
+            await asyncio.wait_for(self._released.wait(), self.leave_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("front не перераспределил чаты за %s с, выгружаем их сами", self.leave_timeout)
+            await self.export_chats(lambda chat_id: False)
+        async with self.session_maker() as session:
+            await session.execute(delete(BotWorker).where(BotWorker.name == self.name))
+            await session.commit()
+        logger.info("Рабочий процесс %s остановлен", self.name)
+
+    async def export_chats(self, keep: Callable[[int], bool]) -> int:
+        """Записывает в fsm_handoff состояние чатов, для которых keep ложно, и удаляет их из памяти."""
+        # Апдейты, уже отданные обработчикам, должны успеть изменить состояние до выгрузки
+        await self._idle.wait()
+        moving = {key: record for key, record in self.storage.storage.items() if not keep(key.chat_id)}
+        rows = [
+            FsmHandoff(chat_id=key.chat_id, user_id=key.user_id, payload=pickle.dumps((record.state, record.data)))
+            for key, record in moving.items() if record.state is not None or record.data
+        ]
+        if rows:
+            async with self.session_maker() as session:
+                for row in rows:
+                    await session.merge(row)
+                await session.commit()
+        for key in moving:
+            del self.storage.storage[key]
+            self.on_export(key.chat_id)
+        handoff_chats_total.inc(len(rows), direction='export')
+        if rows:
+            logger.info("Передано другим процессам чатов: %s", len(rows))
+        return len(rows)
+
+    async def import_chat(self, chat_id: int):
+        """Забирает состояние чата, переданное другим процессом (один запрос на чат после перебалансировки)."""
+        if chat_id in self._checked:
+            return
+        task = self._importing.get(chat_id)
+        if task is None:
+            task = self._importing[chat_id] = asyncio.create_task(self._import_chat(chat_id))
+            task.add_done_callback(lambda _: self._importing.pop(chat_id, None))
+        await task
+
+    async def _import_chat(self, chat_id: int):
+        async with self.session_maker() as session:
+            rows = (await session.execute(select(FsmHandoff).where(FsmHandoff.chat_id == chat_id))).scalars().all()
+            if rows:
+                await session.execute(delete(FsmHandoff).where(FsmHandoff.chat_id == chat_id))
+                await session.commit()
+        for row in rows:
+            key = StorageKey(bot_id=self.bot.id, chat_id=row.chat_id, user_id=row.user_id)
+            record = self.storage.storage[key]
+            record.state, record.data = pickle.loads(row.payload)
+            await self.on_import(self.bot, FSMContext(self.storage, key))
+        handoff_chats_total.inc(len(rows), direction='import')
+        self._checked.add(chat_id)
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        update = await request.json()
+        self._inflight += 1
+        self._idle.clear()
+        asyncio.create_task(self._feed(update))
+        return web.Response()
+
+    async def _feed(self, update: Dict[str, Any]):
+        try:
+            await self.import_chat(update_chat_id(update))
+            await self.dp.feed_webhook_update(self.bot, update)
+        except Exception as e:
+            logger.error("Ошибка обработки апдейта %s: %s", update.get("update_id"), e)
+        finally:
+            self._inflight -= 1
+            if not self._inflight:
+                self._idle.set()
+
+    async def _handle_handoff(self, request: web.Request) -> web.Response:
+        members = (await request.json())["members"]
+        ring = HashRing(members)
+        exported = await self.export_chats(lambda chat_id: ring.node_for(chat_id) == self.name)
+        self._checked.clear()
+        if self.name not in members:
+            self._released.set()
+        return web.json_response({"exported": exported})
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._upsert(leaving=False)
+            except Exception as e:
+                logger.error("Не удалось обновить heartbeat процесса %s: %s", self.name, e)
+
+    async def _upsert(self, leaving: bool):
+        async with self.session_maker() as session:
+            await session.merge(BotWorker(name=self.name, url=self.url, heartbeat_at=current_time(),
+                                          leaving=leaving or self._released.is_set()))
+            await session.commit()
+
+
+class Front:
+    """
+    Приёмник вебхука Telegram для режима шардирования (front.py).
+
+    Каждый апдейт пересылается рабочему процессу, которому id его чата
+    принадлежит на кольце HashRing. Состав процессов читается из bot_workers
+    раз в refresh_interval секунд: живые (heartbeat не старше worker_timeout)
+    и не завершающиеся. При изменении состава раздача приостанавливается,
+    пока все процессы не выполнят /handoff для нового кольца.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, refresh_interval: float, worker_timeout: float,
+                 secret: Optional[str] = None):
+        self.session_maker = session_maker
+        self.refresh_interval = refresh_interval
+        self.worker_timeout = worker_timeout
+        self.secret = secret
+        self.ring = HashRing()
+        self.urls: Dict[str, str] = {}
+        self._routing = asyncio.Event()
+        self._routing.set()
+        self._refresh_lock = asyncio.Lock()
+        self.http: Optional[aiohttp.ClientSession] = None
+
+    def web_app(self, path: str) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self._handle_webhook)
+        return app
+
+    async def watch_workers(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Не удалось обновить состав рабочих процессов: %s", e)
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            alive_since = current_time() - timedelta(seconds=self.worker_timeout)
+            async with self.session_maker() as session:
+                workers = (await session.execute(
+                    select(BotWorker).where(BotWorker.heartbeat_at > alive_since))).scalars().all()
+            active = {worker.name: worker.url for worker in workers if not worker.leaving}
+            if set(active) == self.ring.nodes:
+                return
+            # Процессам, которые уходят или перестали отвечать, тоже нужно отдать свои чаты
+            reachable = {**self.urls, **{worker.name: worker.url for worker in workers}}
+            await self._rebalance(active, reachable)
+
+    async def _rebalance(self, active: Dict[str, str], reachable: Dict[str, str]):
+        members = sorted(active)
+        self._routing.clear()
+        try:
+            for name, url in reachable.items():
+                try:
+                    async with self.http.post(f"{url}/handoff", json={"members": members},
+                                              timeout=aiohttp.ClientTimeout(total=30)) as response:
+                        response.raise_for_status()
+                except Exception as e:
+                    logger.error("Процесс %s не передал чаты (%s): их состояние потеряно", name, e)
+            self.ring = HashRing(members)
+            self.urls = active
+        finally:
+            self._routing.set()
+        front_rebalances_total.inc()
+        logger.info("Рабочие процессы бота: %s", ", ".join(members) or "нет")
+
+    async def _handle_webhook(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=401)
+        body = await request.read()
+        update = await request.json()
+        asyncio.create_task(self.forward(update_chat_id(update), body))
+        return web.Response()
+
+    async def forward(self, chat_id: int, body: bytes):
+        for attempt in range(2):
+            await self._routing.wait()
+            worker = self.ring.node_for(chat_id)
+            if worker is None:
+                break
+            try:
+                async with self.http.post(f"{self.urls[worker]}/update", data=body,
+                                          headers={"Content-Type": "application/json"},
+                                          timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    response.raise_for_status()
+                front_updates_total.inc(worker=worker)
+                return
+            except Exception as e:
+                logger.warning("Процесс %s не принял апдейт: %s", worker, e)
+                # Возможно, процесс упал: перечитываем состав и пробуем нового владельца чата
+                await self.refresh()
+        front_updates_total.inc(worker='lost')
+        logger.error("Апдейт чата %s потерян: нет доступных рабочих процессов", chat_id)
@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence, Set
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+
+from tools.models import Question, Test
+from utils.cache_bus import CacheEvent, EventKind
+from utils.test_versions import VersionBank, version_banks
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TestSnapshot:
+    """Тест на момент загрузки и его текущая версия. Объекты отсоединены от сессии и общие для всех студентов."""
+    test: Test
+    bank: VersionBank
+
+    @property
+    def questions(self) -> Sequence[Question]:
+        return self.bank.questions
+
+
+class TestSnapshotCache:
+    """
+    Кэш тестов с вопросами для начала попытки.
+
+    Когда открывается тест, start_test у всей группы приходит почти одновременно;
+    тест и вопросы загружает один запрос (остальные ждут его), а не каждый
+    студент отдельно. Снимок можно загрузить заранее через prewarm — список
+    доступных тестов делает это для показанных тестов, так что к нажатию
+    кнопки снимок обычно уже готов. Снимок удаляется, когда админка меняет
+    тест или его вопросы (utils.cache_bus); вопросы же берутся из неизменяемой
+    версии теста (utils.test_versions), так что после правки заново загружается
+    только строка теста и вопросы новой версии.
+    """
+
+    def __init__(self, session_maker: Optional[async_sessionmaker] = None):
+        self.session_maker = session_maker
+        self._entries: Dict[int, TestSnapshot] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._warming: Set[int] = set()
+        self._generation = 0
+
+    async def get(self, session: AsyncSession, test_id: int) -> Optional[TestSnapshot]:
+        """Снимок теста или None, если теста нет."""
+        snapshot = self._entries.get(test_id)
+        if snapshot is not None:
+            return snapshot
+        lock = self._locks.setdefault(test_id, asyncio.Lock())
+        async with lock:
+            snapshot = self._entries.get(test_id)
+            if snapshot is None:
+                generation = self._generation
+                snapshot = await self._load(session, test_id)
+                # Если тест изменили во время загрузки, снимок мог устареть — не кэшируем его
+                if snapshot is not None and generation == self._generation:
+                    self._entries[test_id] = snapshot
+            return snapshot
+
+    def prewarm(self, test_ids: Iterable[int]):
+        """Фоновая загрузка ещё не закэшированных снимков (нужен session_maker)."""
+        if self.session_maker is None:
+            return
+        for test_id in test_ids:
+            if test_id not in self._entries and test_id not in self._warming:
+                self._warming.add(test_id)
+                # Пустой контекст: запросы загрузки не относятся к апдейту, который её запустил
+                asyncio.create_task(self._prewarm(test_id), context=contextvars.Context())
+
+    def invalidate(self, test_id: Optional[int] = None):
+        self._generation += 1
+        if test_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(test_id, None)
+
+    def on_cache_event(self, event: CacheEvent):
+        if event.kind in (EventKind.TEST_CHANGED, EventKind.QUESTIONS_CHANGED):
+            self.invalidate(event.test_id)
+
+    async def _prewarm(self, test_id: int):
+        try:
+            async with self.session_maker() as session:
+                await self.get(session, test_id)
+            logger.debug("Снимок теста %s загружен заранее", test_id)
+        except Exception as e:
+            logger.error("Не удалось заранее загрузить тест %s: %s", test_id, e)
+        finally:
+            self._warming.discard(test_id)
+
+    @staticmethod
+    async def _load(session: AsyncSession, test_id: int) -> Optional[TestSnapshot]:
+        test = (await session.execute(select(Test).where(Test.id == test_id))).scalars().first()
+        if test is None:
+            return None
+        # Снимок переживает сессию обработчика, который его загрузил
+        session.expunge(test)
+        bank = await version_banks.get(session, test_id, test.version)
+        if bank is None:
+            return None
+        return TestSnapshot(test, bank)
+
+
+test_snapshots = TestSnapshotCache()
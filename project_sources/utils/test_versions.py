@@ -0,0 +1,194 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, exists, func, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from tools.models import (AttemptAnswer, AttemptAnswerArchive, Question, Test, TestAttempt, TestAttemptArchive,
+                          TestVersion)
+
+# Версия, которую сборка мусора ещё не трогает после выхода следующей: попытку
+# могли начать по снимку теста, который бот ещё не успел сбросить
+GC_GRACE = timedelta(hours=1)
+
+
+def current_time() -> datetime:
+    return datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+
+
+def in_version(test_id: int, version: int):
+    """Условие на вопросы версии теста: version попадает в [added_in, retired_in)."""
+    return (Question.test_id == test_id, Question.added_in <= version,
+            or_(Question.retired_in.is_(None), Question.retired_in > version))
+
+
+def in_current_version(test_id: int):
+    return Question.test_id == test_id, Question.retired_in.is_(None)
+
+
+def lineage_id():
+    """id первой строки вопроса: общий для всех его версий, по нему же порядок вопросов в тесте."""
+    return func.coalesce(Question.origin_id, Question.id)
+
+
+@dataclass(frozen=True)
+class VersionBank:
+    """Версия теста с её вопросами (по порядку в тесте). Объекты отсоединены от сессии и не меняются."""
+    test_id: int
+    version: int
+    question_count: int
+    shuffle: bool
+    questions: Tuple[Question, ...]
+
+
+class VersionBankCache:
+    """
+    Вопросы версий тестов по (id теста, версия).
+
+    Версия не меняется после создания, поэтому записи не сбрасываются — старые
+    вытесняются по LRU. Одну версию загружает один запрос, остальные ждут его.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[int, int], VersionBank]" = OrderedDict()
+        self._locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+
+    async def get(self, session: AsyncSession, test_id: int, version: Optional[int]) -> Optional[VersionBank]:
+        """Версия теста или None, если теста нет. version None — попытка до версий, это версия 1."""
+        key = (test_id, version or 1)
+        bank = self._entries.get(key)
+        if bank is not None:
+            self._entries.move_to_end(key)
+            return bank
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            bank = self._entries.get(key)
+            if bank is None:
+                bank, immutable = await self._load(session, *key)
+                if immutable:
+                    self._entries[key] = bank
+                    if len(self._entries) > self.max_size:
+                        evicted, _ = self._entries.popitem(last=False)
+                        self._locks.pop(evicted, None)
+            return bank
+
+    @staticmethod
+    async def _load(session: AsyncSession, test_id: int, version: int) -> Tuple[Optional[VersionBank], bool]:
+        row = (await session.execute(
+            select(TestVersion.question_count, TestVersion.shuffle)
+            .where(TestVersion.test_id == test_id, TestVersion.version == version))).first()
+        immutable = row is not None
+        if row is None:
+            # Версия старше test_versions: её настройки не сохранились, берутся текущие настройки теста
+            row = (await session.execute(
+                select(Test.question_count, Test.shuffle).where(Test.id == test_id))).first()
+            if row is None:
+                return None, False
+        questions = (await session.execute(
+            select(Question).where(*in_version(test_id, version)).order_by(lineage_id()))).scalars().all()
+        # Версия переживает сессию, которая её загрузила
+        for question in questions:
+            session.expunge(question)
+        return VersionBank(test_id, version, row.question_count, row.shuffle, tuple(questions)), immutable
+
+
+version_banks = VersionBankCache()
+
+
+def new_version(db_session, test: Test) -> int:
+    """
+    Создаёт следующую версию теста с текущими (в том числе ещё не записанными)
+    question_count и shuffle. Строка теста блокируется до конца транзакции, так
+    что одновременные правки одного теста получают разные версии. Коммит — за вызывающим.
+    """
+    version = db_session.execute(
+        update(Test).where(Test.id == test.id).values(version=Test.version + 1).returning(Test.version)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    set_committed_value(test, 'version', version)
+    db_session.add(TestVersion(test_id=test.id, version=version, question_count=test.question_count,
+                               shuffle=test.shuffle))
+    return version
+
+
+def replace_question(db_session, question: Question, edited: Question) -> bool:
+    """
+    Правка вопроса без изменения строки: question выходит из новой версии теста,
+    edited (ещё не добавленный в сессию) входит в неё. Попытки прежних версий
+    по-прежнему видят question. False — вопрос уже заменили в другой транзакции.
+    """
+    test = db_session.get(Test, question.test_id)
+    version = new_version(db_session, test)
+    retired = db_session.execute(
+        update(Question).where(Question.id == question.id, Question.retired_in.is_(None))
+        .values(retired_in=version).execution_options(synchronize_session=False)
+    ).rowcount
+    if not retired:
+        return False
+    edited.test_id = question.test_id
+    edited.added_in = version
+    edited.origin_id = question.origin_id or question.id
+    db_session.add(edited)
+    db_session.flush()
+    return True
+
+
+def collect_garbage(db_session, now: Optional[datetime] = None) -> Tuple[int, int]:
+    """
+    Удаляет версии тестов и вопросы, на которые больше не ссылается ни одна
+    попытка, в том числе в архиве: прежние версии без попыток и заменённые вопросы, не входящие в версию
+    ни одной попытки и без ответов в attempt_answers. Текущие версии, а также
+    версии, заменённые меньше GC_GRACE назад, не трогаются. Коммит — за вызывающим.
+    Возвращает (удалено версий, удалено вопросов).
+    """
+    cutoff = (now or current_time()) - GC_GRACE
+    attempt_version = func.coalesce(TestAttempt.test_version, 1)
+    archived_version = func.coalesce(TestAttemptArchive.test_version, 1)
+    # Версии идут по порядку создания: если уже есть версия не моложе заменившей и старше
+    # cutoff, то и замена была раньше cutoff
+    successor = aliased(TestVersion)
+
+    questions = db_session.execute(
+        delete(Question)
+        .where(
+            Question.retired_in.is_not(None),
+            exists().where(successor.test_id == Question.test_id, successor.version >= Question.retired_in,
+                           successor.created_at < cutoff),
+            ~exists().where(AttemptAnswer.question_id == Question.id),
+            ~exists().where(TestAttempt.test_id == Question.test_id, attempt_version >= Question.added_in,
+                            attempt_version < Question.retired_in),
+            # Попытки в архиве тоже ссылаются на свои версии
+            ~exists().where(AttemptAnswerArchive.question_id == Question.id),
+            ~exists().where(TestAttemptArchive.test_id == Question.test_id, archived_version >= Question.added_in,
+                            archived_version < Question.retired_in),
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    versions = db_session.execute(
+        delete(TestVersion)
+        .where(
+            TestVersion.version < select(Test.version).where(Test.id == TestVersion.test_id).scalar_subquery(),
+            exists().where(successor.test_id == TestVersion.test_id, successor.version > TestVersion.version,
+                           successor.created_at < cutoff),
+            ~exists().where(TestAttempt.test_id == TestVersion.test_id, attempt_version == TestVersion.version),
+            ~exists().where(TestAttemptArchive.test_id == TestVersion.test_id,
+                            archived_version == TestVersion.version),
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return versions, questions
+
+
+def lineage(question: Question):
+    """Условие на все строки вопроса (его версии), включая саму question."""
+    return lineage_id() == (question.origin_id or question.id)
+
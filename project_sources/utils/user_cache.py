@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from tools.models import User
+from utils.cache_bus import CacheEvent, EventKind
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """Поля пользователя, нужные для списка доступных тестов."""
+    id: int
+    group: str
+    confirmed: bool
+
+
+class UserProfileCache:
+    """
+    Профили подтверждённых пользователей по Telegram id.
+
+    Неподтверждённые не кэшируются: их подтверждение не должно ждать сброса.
+    Запись удаляется, когда админка подтверждает или удаляет пользователя
+    (utils.cache_bus), и в любом случае живёт не дольше max_age. Попытку всё
+    равно проверяет по базе utils.attempt_start, так что удалённый пользователь
+    не начнёт тест и по устаревшей записи.
+
+    Как и в OpenTestsCache, профиль, загруженный в течение settle_time после
+    сброса, живёт только до конца этого окна: реплика могла ещё не получить изменение.
+    """
+
+    def __init__(self, max_size: int = 10000, max_age: float = 600.0, settle_time: float = 0.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.settle_time = settle_time
+        self._invalidated_at = float('-inf')
+        self._generation = 0
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # telegram id -> (профиль, годен до)
+
+    async def get(self, session: AsyncSession, user_id: int) -> Optional[UserProfile]:
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() < entry[1]:
+            self._entries.move_to_end(user_id)
+            return entry[0]
+        generation = self._generation
+        row = (await session.execute(
+            select(User.id, User.group, User.confirmed).where(User.user_id == user_id))).first()
+        if row is None:
+            self._entries.pop(user_id, None)
+            return None
+        profile = UserProfile(row.id, row.group, bool(row.confirmed))
+        # Если пользователей изменили во время загрузки, профиль мог устареть — не кэшируем его
+        if profile.confirmed and generation == self._generation:
+            now = time.monotonic()
+            valid_until = now + self.max_age
+            if now < self._invalidated_at + self.settle_time:
+                valid_until = min(valid_until, self._invalidated_at + self.settle_time)
+            self._entries[user_id] = (profile, valid_until)
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id: Optional[int] = None):
+        self._generation += 1
+        self._invalidated_at = time.monotonic()
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+
+    def on_cache_event(self, event: CacheEvent):
+        if event.kind is EventKind.USERS_CHANGED:
+            for user_id in event.user_ids:
+                self.invalidate(user_id)
+
+
+user_profiles = UserProfileCache()